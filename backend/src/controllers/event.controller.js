@@ -10,6 +10,33 @@ import { asyncHandler } from "../utils/asyncHandler.js";
  */
 
 
+// Tell the recommendation service about a user's new event so it can drop
+// that user's cached history. Fire-and-forget: logging never waits on it.
+const notifyRecommendationService = (ev) => {
+    const serviceUrl = process.env.RECOMMENDATION_SERVICE_URL;
+    if (!serviceUrl || !ev.userId) return;
+
+    fetch(`${serviceUrl}/api/events/ingest`, {
+        method: "POST",
+        headers: {
+            "Content-Type": "application/json",
+            "X-Service-Key": process.env.RECOMMENDATION_SERVICE_KEY || ""
+        },
+        body: JSON.stringify({
+            events: [{
+                userId: ev.userId,
+                productId: ev.productId,
+                action: ev.action,
+                value: ev.value,
+                createdAt: ev.createdAt
+            }]
+        }),
+        signal: AbortSignal.timeout(2000)
+    }).catch((error) => {
+        console.error("Failed to notify recommendation service:", error.message);
+    });
+};
+
 // Rate limiting to prevent infinite loops
 const eventCache = new Map();
 const RATE_LIMIT_WINDOW = 10000; // 10 seconds
@@ -59,6 +86,8 @@ const logEvent = asyncHandler(async (req, res) => {
         userAgent: req.get("User-Agent")
     });
 
+    notifyRecommendationService(ev);
+
     return res
         .status(200)
         .json(new ApiResponse(200, ev, "Event logged successfully"));
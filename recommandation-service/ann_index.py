@@ -0,0 +1,121 @@
+import os
+
+import numpy as np
+
+ANN_INDEX_FILE = 'ann_index.npz'
+
+
+class IVFIndex:
+    """Inverted-file index over item factors for approximate top-k retrieval.
+
+    Items are stored as ``[qi, bi]`` and queried with ``[pu, 1]``, so the inner
+    product equals the SVD estimate minus the per-user constant
+    ``global_mean + bu``. Items are bucketed by k-means; a query only scores the
+    items in the ``n_probe`` buckets whose centroids match it best.
+    """
+
+    def __init__(self, centroids, list_offsets, list_items):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_items = list_items
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @property
+    def n_items(self):
+        return len(self.list_items)
+
+    @classmethod
+    def build(cls, engine, n_lists=None, n_iter=15, seed=42):
+        """Cluster the engine's item vectors into ``n_lists`` buckets"""
+        vectors = item_vectors(engine)
+        n_items = len(vectors)
+        if n_lists is None:
+            n_lists = int(np.sqrt(n_items))
+        n_lists = max(1, min(n_lists, n_items))
+
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(n_items, size=n_lists, replace=False)].copy()
+        assignment = np.zeros(n_items, dtype=np.int64)
+
+        for _ in range(n_iter):
+            # Squared distance without the constant ||x||^2 term
+            distances = (centroids ** 2).sum(axis=1) - 2 * vectors @ centroids.T
+            assignment = distances.argmin(axis=1)
+            counts = np.bincount(assignment, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            non_empty = counts > 0
+            centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+
+        list_items = np.argsort(assignment, kind='stable').astype(np.int32)
+        counts = np.bincount(assignment, minlength=n_lists)
+        list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(centroids, list_offsets, list_items)
+
+    def candidates(self, query, n_probe):
+        """Item rows stored in the ``n_probe`` best-matching lists"""
+        n_probe = max(1, min(n_probe, self.n_lists))
+        lists = np.argsort(-(self.centroids @ query), kind='stable')[:n_probe]
+        return np.concatenate([
+            self.list_items[self.list_offsets[l]:self.list_offsets[l + 1]] for l in lists
+        ])
+
+    def search(self, engine, user_id, k, allowed_mask=None, n_probe=8):
+        """Approximate top-k for a user, widening the probe until k items survive"""
+        query = np.append(engine.pu[engine.user_index[str(user_id)]], 1.0)
+        # Items folded in after the index was built are always scored
+        unindexed = np.arange(self.n_items, engine.n_items)
+        while True:
+            candidates = np.concatenate([self.candidates(query, n_probe), unindexed])
+            if allowed_mask is not None:
+                candidates = candidates[allowed_mask[candidates]]
+            if len(candidates) >= k or n_probe >= self.n_lists:
+                break
+            n_probe *= 2
+        return engine.top_k(user_id, k, candidates=candidates)
+
+    def save(self, path=ANN_INDEX_FILE):
+        np.savez(path, centroids=self.centroids, list_offsets=self.list_offsets, list_items=self.list_items)
+
+    @classmethod
+    def load(cls, path=ANN_INDEX_FILE):
+        with np.load(path) as data:
+            return cls(data['centroids'], data['list_offsets'], data['list_items'])
+
+
+def item_vectors(engine):
+    """Item factors with the item bias folded in as an extra dimension"""
+    return np.hstack([engine.qi, engine.bi[:, None]])
+
+
+def recall_at_k(index, engine, k=10, n_probe=8, max_users=500, seed=42):
+    """Average overlap between approximate and exact top-k over sampled users"""
+    user_ids = engine.user_ids
+    if len(user_ids) > max_users:
+        rng = np.random.default_rng(seed)
+        user_ids = [user_ids[i] for i in rng.choice(len(user_ids), size=max_users, replace=False)]
+
+    k = min(k, engine.n_items)
+    if not user_ids or k == 0:
+        return 0.0
+
+    hits = 0
+    for uid in user_ids:
+        exact = {pid for pid, score in engine.top_k(uid, k)}
+        approximate = {pid for pid, score in index.search(engine, uid, k, n_probe=n_probe)}
+        hits += len(exact & approximate)
+    return hits / (k * len(user_ids))
+
+
+def load_ann_index(engine, path=ANN_INDEX_FILE):
+    """Load the index if it exists and still matches the engine's items"""
+    if engine is None or not os.path.exists(path):
+        return None
+    index = IVFIndex.load(path)
+    # Incremental updates only ever append items, so a smaller index still lines up
+    if index.n_items > engine.n_items:
+        return None
+    return index
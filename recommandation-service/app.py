@@ -1,14 +1,33 @@
 import os
-from flask import Flask, jsonify, request
+import json
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity
-import joblib
 from pymongo import MongoClient
 from bson import ObjectId
 from dotenv import load_dotenv
-import random
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
+import hmac
 import traceback
+import threading
+import time
+from functools import wraps
+from catalog import CatalogWatcher
+from history_cache import HistoryCache, UserHistory, watch_events
+from cooccurrence import aggregate_similar_user_products, aggregate_similar_user_products_many
+from event_loader import load_events
+from incremental import fold_in, fold_in_options
+from model_store import ModelBundle, ModelStore
+from popularity import load_product_categories
+from indexes import provision
+from interactions import INTERACTIONS_COLLECTION, apply_events
+from jobs import RetrainJobManager
+import prefork
+from metrics import CONTENT_TYPE, MetricsRegistry, RequestTracer
+from pipeline import CandidatePipeline, CandidateRequest, Deadline, Source
+from profiling import SamplingProfiler, SlowRequestRecorder
+from recommender import assemble_recommendations, rank_for_trained_user, rank_for_trained_users
+from response_cache import ResponseCache
 
 load_dotenv()
 
@@ -19,6 +38,82 @@ app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
 app.config["JWT_IDENTITY_CLAIM"] = "_id"
 mongo_uri = os.getenv("MONGO_URI")
 
+# Candidate retrieval for the ML strategy: "exact" scores the whole trained
+# catalog, "ann" only scores the items returned by the ANN index
+RETRIEVAL_MODE = os.getenv("RECOMMENDATION_RETRIEVAL", "exact").lower()
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+
+# How often the in-process catalog snapshot is refreshed (seconds)
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "30"))
+# How long startup waits for the first catalog load; requests never wait for it
+CATALOG_STARTUP_WAIT_SECONDS = float(os.getenv("CATALOG_STARTUP_WAIT_SECONDS", "5"))
+
+# Per-user interaction history cache
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "10000"))
+HISTORY_CACHE_TTL_SECONDS = float(os.getenv("HISTORY_CACHE_TTL_SECONDS", "300"))
+# Set to "true" to also invalidate cached histories from an events change stream
+HISTORY_CHANGE_STREAM = os.getenv("HISTORY_CHANGE_STREAM", "").lower() in ("1", "true")
+
+# Whole recommendation responses: concurrent requests of a user always share
+# one computation, and the result is reused for a few seconds (0: not kept)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "5"))
+
+# Time budget of one recommendation request: candidate sources (ML ranking,
+# collaborative filtering) still running at the deadline are dropped and the
+# fallbacks fill in (0: wait for every source)
+RECOMMENDATION_DEADLINE_MS = float(os.getenv("RECOMMENDATION_DEADLINE_MS", "250"))
+# Threads running the expensive sources, and how many of their calls may be
+# pending before expensive sources are skipped (0: one per thread)
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "8"))
+PIPELINE_MAX_PENDING = int(os.getenv("PIPELINE_MAX_PENDING", "0"))
+
+# Read user histories from the pre-aggregated user_item_interactions collection
+# (backfill it first with `python interactions.py backfill`) instead of events
+USE_INTERACTIONS_COLLECTION = os.getenv("USE_INTERACTIONS_COLLECTION", "").lower() in ("1", "true")
+
+# Fold new events into the live model every N seconds (0 disables)
+INCREMENTAL_UPDATE_SECONDS = float(os.getenv("INCREMENTAL_UPDATE_SECONDS", "0"))
+
+# Versioned model artifacts: one directory per training run under MODEL_DIR
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+MODEL_VERSIONS_KEPT = int(os.getenv("MODEL_VERSIONS_KEPT", "5"))
+RETRAIN_TIMEOUT_SECONDS = int(os.getenv("RETRAIN_TIMEOUT_SECONDS", "300"))
+
+# Shared secret for service-to-service calls from the Node backend
+SERVICE_API_KEY = os.getenv("SERVICE_API_KEY")
+
+# POST /api/recommendations/batch: most user ids per call, and users handled per
+# history query / streamed chunk
+BATCH_MAX_USERS = int(os.getenv("BATCH_MAX_USERS", "100000"))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "500"))
+
+# Seconds between adding new events to the time-decayed popularity index (0 disables)
+POPULARITY_REFRESH_SECONDS = float(os.getenv("POPULARITY_REFRESH_SECONDS", "60"))
+# Most products returned by GET /api/recommendations/popular
+POPULAR_MAX_LIMIT = int(os.getenv("POPULAR_MAX_LIMIT", "100"))
+
+# Create missing indexes for the hot queries at startup (in the background);
+# with "false" they are only checked with explain() and reported in /api/status
+AUTO_CREATE_INDEXES = os.getenv("AUTO_CREATE_INDEXES", "true").lower() in ("1", "true")
+
+# Set by gunicorn.conf.py: the app is imported once in the gunicorn master and
+# workers are forked from it, so threads and MongoDB connections only start
+# after the fork (see prefork.py)
+PREFORK_SERVING = os.getenv("PREFORK_SERVING", "").lower() in ("1", "true")
+
+# Each worker would fold events into its own copy of the model and the result
+# would never be shared: fold in with `python train.py --incremental` instead
+if PREFORK_SERVING and INCREMENTAL_UPDATE_SECONDS > 0:
+    raise RuntimeError("INCREMENTAL_UPDATE_SECONDS is not supported with gunicorn.conf.py; "
+                       "schedule `python train.py --incremental` and reload the master instead")
+
+# Opt-in sampling profiler: keep folded stacks of the N slowest recommendation
+# requests in PROFILE_DIR (0 disables)
+PROFILE_SLOWEST_REQUESTS = int(os.getenv("PROFILE_SLOWEST_REQUESTS", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
 jwt = JWTManager(app)
 
 @jwt.invalid_token_loader
@@ -33,222 +128,398 @@ def unauthorized_callback(error):
 def expired_token_callback(jwt_header, jwt_payload):
     return jsonify({"success": False, "message": "Token has expired"}), 401
 
+# Hot-path instrumentation, exported from /api/metrics
+metrics_registry = MetricsRegistry()
+tracer = RequestTracer(metrics_registry)
+request_seconds = metrics_registry.histogram(
+    'recommendation_request_seconds',
+    'Latency of GET /api/recommendations by strategy',
+    ('strategy',)
+)
+requests_total = metrics_registry.counter(
+    'recommendation_requests_total',
+    'Recommendation requests by strategy, model version and status code',
+    ('strategy', 'model_version', 'status')
+)
+batch_users_total = metrics_registry.counter(
+    'recommendation_batch_users_total',
+    'Users answered by POST /api/recommendations/batch, by strategy',
+    ('strategy',)
+)
+mongo_round_trips = metrics_registry.histogram(
+    'recommendation_mongo_round_trips',
+    'MongoDB commands sent while serving one recommendation request',
+    buckets=(0, 1, 2, 3, 5, 10, 20)
+)
+
+profiler = None
+slow_requests = None
+if PROFILE_SLOWEST_REQUESTS > 0:
+    profiler = SamplingProfiler(interval=PROFILE_INTERVAL_MS / 1000)
+    slow_requests = SlowRequestRecorder(PROFILE_DIR, keep=PROFILE_SLOWEST_REQUESTS)
+
 # MongoDB Connection
 try:
-    client = MongoClient(mongo_uri)
+    client = MongoClient(mongo_uri, connect=not PREFORK_SERVING, event_listeners=[tracer.listener])
     db = client['E-commerce']
     events_collection = db.events
     products_collection = db.products
+    interactions_collection = db[INTERACTIONS_COLLECTION]
 except Exception as e:
     events_collection = None
     products_collection = None
+    interactions_collection = None
+
+index_report = None
+
+def provision_indexes():
+    """Background task: create missing indexes, then explain the hot queries"""
+    global index_report
+    try:
+        index_report = provision(db, create=AUTO_CREATE_INDEXES)
+    except Exception:
+        traceback.print_exc()
 
 # Load Model and Metadata
+model_store = ModelStore(MODEL_DIR, keep=MODEL_VERSIONS_KEPT)
 try:
-    model = joblib.load('recommendation_model.joblib')
-    metadata = joblib.load('model_metadata.joblib')
-    popular_products = joblib.load('popular_products.joblib')
-    all_product_ids = metadata['product_ids']
-    all_user_ids = metadata['user_ids']
+    bundle = model_store.load()
 except FileNotFoundError as e:
-    model = None
-    metadata = None
-    popular_products = []
-    all_product_ids = []
-    all_user_ids = []
-
-def get_popular_products(exclude_ids=None, limit=10):
-    """Get popular products as fallback"""
-    if exclude_ids is None:
-        exclude_ids = set()
-    
-    available_popular = [pid for pid in popular_products if pid not in exclude_ids]
-    return available_popular[:limit]
+    bundle = ModelBundle.empty()
+# Version served before the last retrain, kept in memory for instant rollback
+previous_bundle = None
+
+# Active product ids, kept fresh in the background so requests never scan products
+catalog_watcher = None
+if products_collection is not None:
+    catalog_watcher = CatalogWatcher(products_collection, bundle.engine, interval=CATALOG_REFRESH_SECONDS)
+
+# Serialises model swaps (retrain, rollback and incremental updates)
+model_lock = threading.Lock()
+
+response_cache = ResponseCache(max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL_SECONDS)
+
+def model_state(current):
+    """What a cached response was computed from: version and last incremental update"""
+    return current.version, (current.last_incremental_update or {}).get('updated_at')
+
+def activate_bundle(new_bundle, publish=True):
+    """Serve ``new_bundle`` from now on, keeping the current one for rollback.
+
+    Under gunicorn.conf.py a worker that switches versions also asks the
+    master to load the version once and re-fork every worker from it.
+    """
+    global bundle, previous_bundle
+    with model_lock:
+        if catalog_watcher is not None:
+            catalog_watcher.rebind(new_bundle.engine)
+        changed = new_bundle.version != bundle.version
+        if changed:
+            previous_bundle = bundle
+        bundle = new_bundle
+        model_store.activate(new_bundle.version)
+        response_cache.clear()
+    if publish and changed and PREFORK_SERVING:
+        prefork.request_reload()
+
+def activate_version(version):
+    """Load a trained version from disk and start serving it"""
+    activate_bundle(model_store.load(version))
+
+retrain_jobs = RetrainJobManager(model_store, activate_version, timeout=RETRAIN_TIMEOUT_SECONDS)
+
+def load_user_history(user_id):
+    """Read a user's events from MongoDB into a compact UserHistory"""
+    if USE_INTERACTIONS_COLLECTION:
+        return UserHistory.from_interactions(interactions_collection.find(
+            {'userId': ObjectId(user_id)},
+            {'_id': 0, 'productId': 1, 'score': 1, 'counts': 1}
+        ))
+    user_events = events_collection.find(
+        {'userId': ObjectId(user_id)},
+        {'_id': 0, 'productId': 1, 'action': 1}
+    )
+    return UserHistory.from_events(user_events)
+
+def load_user_histories(user_ids):
+    """Read the events of several users with one $in query"""
+    events_by_user = {user_id: [] for user_id in user_ids}
+    query = {'userId': {'$in': [ObjectId(user_id) for user_id in user_ids]}}
+    if USE_INTERACTIONS_COLLECTION:
+        user_events = interactions_collection.find(query, {'_id': 0, 'userId': 1, 'productId': 1, 'score': 1, 'counts': 1})
+        build = UserHistory.from_interactions
+    else:
+        user_events = events_collection.find(query, {'_id': 0, 'userId': 1, 'productId': 1, 'action': 1})
+        build = UserHistory.from_events
+    for event in user_events:
+        events_by_user[str(event['userId'])].append(event)
+    return {user_id: build(events) for user_id, events in events_by_user.items()}
+
+history_cache = HistoryCache(load_user_history, max_size=HISTORY_CACHE_SIZE, ttl=HISTORY_CACHE_TTL_SECONDS)
+
+def invalidate_user(user_id):
+    """Drop a user's cached history and responses after new events"""
+    cached = history_cache.invalidate(user_id)
+    return response_cache.invalidate(user_id) or cached
+
+# Point-in-time state, read when /api/metrics is scraped
+metrics_registry.gauge(
+    'recommendation_model_info',
+    'Model version currently serving (always 1)',
+    lambda: [({'version': bundle.version or 'none'}, 1)]
+)
+metrics_registry.gauge(
+    'recommendation_catalog_products',
+    'Products in the in-process catalog snapshot',
+    lambda: [({}, len(catalog_watcher.snapshot))] if catalog_watcher is not None else []
+)
+metrics_registry.gauge(
+    'recommendation_history_cache',
+    'User history cache entries and lookups',
+    lambda: [({'stat': name}, value) for name, value in history_cache.stats().items()
+             if isinstance(value, (int, float))]
+)
+metrics_registry.gauge(
+    'recommendation_response_cache',
+    'Recommendation response cache entries, hits, coalesced requests and saved seconds',
+    lambda: [({'stat': name}, value) for name, value in response_cache.stats().items()
+             if isinstance(value, (int, float))]
+)
+metrics_registry.gauge(
+    'recommendation_candidate_source_calls',
+    'Candidate source calls by outcome (ok, skipped under load, timed out, failed)',
+    lambda: [({'source': name, 'outcome': outcome}, count)
+             for name, outcomes in candidate_pipeline.stats()['sources'].items()
+             for outcome, count in outcomes.items()]
+)
+
+def run_incremental_update():
+    """Fold events created since the watermark into the live scoring engine"""
+    global bundle
+
+    with model_lock:
+        current = bundle
+        if current.engine is None or current.events_watermark is None:
+            return None
+
+        started = time.perf_counter()
+        events = load_events(events_collection, {'createdAt': {'$gt': current.events_watermark}})
+        if len(events) == 0:
+            return None
+
+        updated, summary = fold_in(
+            current.engine, events, **fold_in_options(current.metadata.get('model_params', {}))
+        )
+        events_watermark = summary['events_watermark'] or current.events_watermark
+        summary['events_watermark'] = events_watermark.isoformat()
+        summary['seconds'] = round(time.perf_counter() - started, 3)
+        summary['updated_at'] = datetime.now(timezone.utc).isoformat()
+
+        catalog_watcher.rebind(updated)
+        bundle = current.with_engine(updated, events_watermark, summary, changed_users=events.user_ids)
+        response_cache.clear()
+        return summary
+
+def incremental_update_loop(interval):
+    """Background task: periodically fold new events into the live model"""
+    while True:
+        time.sleep(interval)
+        try:
+            run_incremental_update()
+        except Exception:
+            traceback.print_exc()
+
+def refresh_popularity():
+    """Add events created since the popularity watermark to the live index"""
+    popularity = bundle.popularity
+    if popularity is None or popularity.watermark is None:
+        return 0
+
+    events = load_events(events_collection, {'createdAt': {'$gt': popularity.watermark}})
+    if len(events) == 0:
+        return 0
+    categories = load_product_categories(products_collection, popularity.uncategorized(events.product_ids))
+    popularity.update(events, categories)
+    return len(events)
+
+def popularity_refresh_loop(interval):
+    """Background task: keep the popularity fallback current between retrains"""
+    while True:
+        time.sleep(interval)
+        try:
+            refresh_popularity()
+        except Exception:
+            traceback.print_exc()
+
+def start_background_tasks():
+    """Start this process's watcher and refresh threads.
+
+    Runs at import, or in each worker right after the fork when serving with
+    gunicorn.conf.py, since threads do not survive a fork.
+    """
+    if catalog_watcher is not None:
+        catalog_watcher.start()
+        catalog_watcher.current(timeout=CATALOG_STARTUP_WAIT_SECONDS)
+
+    if events_collection is not None:
+        threading.Thread(target=provision_indexes, name='index-provisioning', daemon=True).start()
+
+    if HISTORY_CHANGE_STREAM and events_collection is not None:
+        threading.Thread(
+            target=watch_events,
+            args=(events_collection, invalidate_user),
+            name='history-invalidation',
+            daemon=True
+        ).start()
+
+    if INCREMENTAL_UPDATE_SECONDS > 0 and events_collection is not None and catalog_watcher is not None:
+        threading.Thread(
+            target=incremental_update_loop,
+            args=(INCREMENTAL_UPDATE_SECONDS,),
+            name='incremental-update',
+            daemon=True
+        ).start()
+
+    if POPULARITY_REFRESH_SECONDS > 0 and events_collection is not None:
+        threading.Thread(
+            target=popularity_refresh_loop,
+            args=(POPULARITY_REFRESH_SECONDS,),
+            name='popularity-refresh',
+            daemon=True
+        ).start()
+
+if not PREFORK_SERVING:
+    start_background_tasks()
+
+def service_auth_required(fn):
+    """Require the shared service key for backend-to-service endpoints"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not SERVICE_API_KEY:
+            return jsonify({"success": False, "message": "Service authentication is not configured"}), 503
+        # Constant-time, so response timing doesn't reveal how much of a guess matched
+        if not hmac.compare_digest(request.headers.get("X-Service-Key", "").encode(), SERVICE_API_KEY.encode()):
+            return jsonify({"success": False, "message": "Invalid service key"}), 401
+        return fn(*args, **kwargs)
+    return wrapper
 
 def get_user_interaction_history(user_id):
-    """Get products user has already interacted with"""
+    """Get the user's history of interactions (empty if it can't be read)"""
     try:
-        user_events = events_collection.find({'userId': ObjectId(user_id)})
-        seen_products = set()
-        product_scores = {}
-        
-        for event in user_events:
-            product_id = str(event['productId'])
-            seen_products.add(product_id)
-            
-            # Calculate engagement score
-            action = event['action']
-            weight = {'purchase': 10, 'add_to_cart': 5, 'rating': 4, 'view': 1}.get(action, 1)
-            product_scores[product_id] = product_scores.get(product_id, 0) + weight
-        
-        return seen_products, product_scores
+        with tracer.stage('history'):
+            return history_cache.get(user_id)
     except Exception as e:
-        return set(), {}
+        return UserHistory({}, [])
 
-def get_similar_user_recommendations(user_id, seen_products, limit=5):
+def get_similar_user_recommendations(current, user_id, seen_products, limit=5, max_time_ms=None):
     """Find products liked by similar users (collaborative filtering)"""
     try:
         # Get user's favorite products (purchases and cart additions)
-        user_events = list(events_collection.find({'userId': ObjectId(user_id)}))
-        user_purchases = {str(e['productId']) for e in user_events if e['action'] in ['purchase', 'add_to_cart']}
+        user_purchases = history_cache.get(user_id).liked_products
         
         if not user_purchases:
             return []
         
-        # Find other users who bought similar products
-        similar_users = events_collection.aggregate([
-            {'$match': {'productId': {'$in': [ObjectId(pid) for pid in user_purchases]}}},
-            {'$group': {'_id': '$userId', 'count': {'$sum': 1}}},
-            {'$match': {'_id': {'$ne': ObjectId(user_id)}}},
-            {'$sort': {'count': -1}},
-            {'$limit': 10}
-        ])
-        
-        similar_user_ids = [str(u['_id']) for u in similar_users]
-        
-        if not similar_user_ids:
-            return []
-        
-        # Get products these similar users liked
-        similar_user_products = events_collection.aggregate([
-            {'$match': {
-                'userId': {'$in': [ObjectId(uid) for uid in similar_user_ids]},
-                'action': {'$in': ['purchase', 'add_to_cart']}
-            }},
-            {'$group': {'_id': '$productId', 'score': {'$sum': 1}}},
-            {'$sort': {'score': -1}},
-            {'$limit': limit * 2}
-        ])
-        
-        recommendations = []
-        for product in similar_user_products:
-            product_id = str(product['_id'])
-            if product_id not in seen_products:
-                recommendations.append(product_id)
-                if len(recommendations) >= limit:
-                    break
-        
-        return recommendations
+        # "Users like you bought": precomputed item-item neighbours when
+        # available, otherwise aggregate over the events collection
+        with tracer.stage('collaborative'):
+            if current.item_neighbors is not None:
+                return current.item_neighbors.recommend(user_purchases, seen_products, limit=limit)
+            return aggregate_similar_user_products(
+                events_collection, user_id, user_purchases, seen_products, limit=limit, max_time_ms=max_time_ms
+            )
         
     except Exception as e:
         return []
 
+def ml_candidates(request):
+    """Strategy 1: ML-based predictions for a user in the training data"""
+    return rank_for_trained_user(
+        request.current, request.catalog, request.user_id, request.history.seen_products,
+        retrieval_mode=RETRIEVAL_MODE, n_probe=ANN_NPROBE, tracer=tracer
+    )
+
+def collaborative_candidates(request):
+    """Strategy 2: products liked by similar users"""
+    return get_similar_user_recommendations(
+        request.current, request.user_id, request.history.seen_products, limit=5,
+        max_time_ms=request.deadline.remaining_ms()
+    )
+
+def collaborative_applies(request):
+    # For trained users only when the item neighbours make it cheap: it then
+    # answers in place of the ML ranking if that one is dropped
+    if not request.history.liked_products:
+        return False
+    return request.current.item_neighbors is not None or not request.current.engine.has_user(request.user_id)
+
+# Candidate sources of GET /api/recommendations; assemble_recommendations
+# merges what they return with the in-process fallbacks
+candidate_pipeline = CandidatePipeline([
+    Source('ml', ml_candidates,
+           applies=lambda request: request.current.engine.has_user(request.user_id),
+           # Served from the top-K table unless the user has to be scored online
+           expensive=lambda request: request.current.topk_table is None or not request.current.topk_table.has(
+               request.current.engine.user_index[str(request.user_id)])),
+    Source('collaborative', collaborative_candidates,
+           applies=collaborative_applies,
+           # Without item neighbours it aggregates over the events collection
+           expensive=lambda request: request.current.item_neighbors is None)
+], workers=PIPELINE_WORKERS, max_pending=PIPELINE_MAX_PENDING)
+
+def traced_request(fn):
+    """Record latency, strategy, Mongo round trips and (opt-in) a profile per request"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = profiler.start() if profiler is not None else None
+        with tracer.trace() as trace:
+            try:
+                response = fn(*args, **kwargs)
+            finally:
+                stacks = profiler.stop(token) if profiler is not None else None
+            seconds = trace.elapsed()
+
+        record_request(trace, seconds, response[1] if isinstance(response, tuple) else 200, stacks)
+        return response
+    return wrapper
+
+def record_request(trace, seconds, status, stacks=None):
+    """Feed one finished recommendation request into the metrics (and slow-request profiles)"""
+    request_seconds.observe(seconds, strategy=trace.strategy)
+    requests_total.inc(strategy=trace.strategy, model_version=trace.model_version, status=status)
+    mongo_round_trips.observe(trace.mongo_round_trips)
+    if slow_requests is not None and stacks:
+        slow_requests.offer(seconds, stacks, label=f'-{trace.strategy}')
+
 @app.route('/api/recommendations', methods=['GET'])
 @jwt_required()
+@traced_request
 def get_recommendations():
     """Main recommendation endpoint - returns personalized product recommendations"""
-    if model is None or events_collection is None:
+    # One reference for the whole request, so a model swap can't mix versions
+    current = bundle
+    trace = tracer.current()
+    trace.model_version = current.version
+    if not current.loaded or events_collection is None:
+        trace.strategy = "not_ready"
         return jsonify({
             "success": False, 
             "message": "Recommendation service is not ready. Please train the model first."
         }), 500
+    if not catalog_watcher.ready:
+        trace.strategy = "not_ready"
+        return catalog_not_ready()
     
     try:
         user_id = get_jwt_identity()
-        
-        # Get user's interaction history
-        seen_products, product_scores = get_user_interaction_history(user_id)
-        
-        # Get all current products from database
-        current_products = list(products_collection.find({}, {'_id': 1}))
-        current_product_ids = [str(product['_id']) for product in current_products]
-        
-        recommendations = []
-        strategy_used = "none"
-        
-        # Strategy 1: ML-based predictions for users in training data
-        if str(user_id) in all_user_ids:
-            strategy_used = "ml"
-            
-            # Get unseen products that model was trained on
-            unseen_trained_products = [
-                pid for pid in all_product_ids 
-                if pid not in seen_products and pid in current_product_ids
-            ]
-            
-            if unseen_trained_products:
-                # Get predictions from the model
-                predictions = []
-                for pid in unseen_trained_products:
-                    try:
-                        pred = model.predict(str(user_id), pid)
-                        predictions.append((pid, pred.est))
-                    except Exception as pred_error:
-                        continue
-                
-                # Sort by estimated rating (highest first)
-                predictions.sort(key=lambda x: x[1], reverse=True)
-                ml_recommendations = [pid for pid, score in predictions[:6]]
-                recommendations.extend(ml_recommendations)
-        else:
-            strategy_used = "collaborative"
-            
-            # Strategy 2: Find similar users and recommend their favorites
-            similar_user_recs = get_similar_user_recommendations(user_id, seen_products, limit=5)
-            if similar_user_recs:
-                recommendations.extend(similar_user_recs)
-        
-        # Strategy 3: Add new products (not in training data) - exploration
-        new_products = [
-            pid for pid in current_product_ids 
-            if pid not in all_product_ids and pid not in seen_products
-        ]
-        
-        if new_products and len(recommendations) < 10:
-            random.shuffle(new_products)
-            slots_available = min(3, 10 - len(recommendations))
-            new_product_sample = new_products[:slots_available]
-            recommendations.extend(new_product_sample)
-        
-        # Strategy 4: Fill with popular products if needed
-        if len(recommendations) < 8:
-            needed = 10 - len(recommendations)
-            popular_recs = get_popular_products(
-                exclude_ids=set(recommendations) | seen_products,
-                limit=needed
-            )
-            recommendations.extend(popular_recs)
-            if not strategy_used or strategy_used == "none":
-                strategy_used = "popular"
-        
-        # Strategy 5: Last resort - show user's favorites (re-engagement)
-        if not recommendations and product_scores:
-            strategy_used = "favorites"
-            favorite_products = sorted(
-                product_scores.items(), 
-                key=lambda x: x[1], 
-                reverse=True
-            )[:10]
-            recommendations = [pid for pid, score in favorite_products]
-        
-        # Final fallback - completely random (shouldn't happen often)
-        if not recommendations:
-            strategy_used = "random"
-            available_products = [
-                pid for pid in current_product_ids 
-                if pid not in seen_products
-            ]
-            random.shuffle(available_products)
-            recommendations = available_products[:10]
-        
-        # Remove duplicates while preserving order
-        seen = set()
-        unique_recommendations = []
-        for pid in recommendations:
-            if pid not in seen:
-                seen.add(pid)
-                unique_recommendations.append(pid)
-        
-        return jsonify({
-            "success": True, 
-            "recommendations": unique_recommendations[:10],
-            "metadata": {
-                "user_seen_count": len(seen_products),
-                "catalog_size": len(current_product_ids),
-                "strategy_used": strategy_used,
-                "recommendation_count": len(unique_recommendations)
-            }
-        })
+        # Widgets of one page load ask at the same moment: compute once
+        payload, _ = response_cache.get(
+            user_id, model_state(current), lambda: compute_recommendations(current, user_id),
+            keep=is_complete
+        )
+        trace.strategy = payload["metadata"]["strategy_used"]
+        with tracer.stage('serialize'):
+            return jsonify(payload)
         
     except Exception as e:
         return jsonify({
@@ -256,64 +527,265 @@ def get_recommendations():
             "message": "An error occurred while generating recommendations"
         }), 500
 
-@app.route('/api/retrain', methods=['POST'])
-def retrain_model():
-    """Retrain the recommendation model with current data"""
+def catalog_not_ready():
+    """503 for requests that arrive before the first catalog load succeeded"""
+    return jsonify({
+        "success": False,
+        "message": "Product catalog is not loaded yet. Please retry shortly."
+    }), 503
+
+def compute_recommendations(current, user_id):
+    """Response payload of GET /api/recommendations for ``user_id``"""
+    deadline = Deadline(RECOMMENDATION_DEADLINE_MS / 1000)
+    history = get_user_interaction_history(user_id)
+    
+    # Get all current products from the in-process catalog snapshot
+    with tracer.stage('catalog'):
+        catalog = catalog_watcher.current().aligned(current.engine)
+    
+    candidates, dropped = candidate_pipeline.run(CandidateRequest(current, catalog, user_id, history, deadline))
+    
+    unique_recommendations, strategy_used = assemble_recommendations(
+        current, catalog, history.seen_products, history.product_scores,
+        ml_recommendations=candidates.get('ml'),
+        similar_user_recs=candidates.get('collaborative'),
+        tracer=tracer
+    )
+    return recommendation_payload(unique_recommendations, strategy_used, history, catalog, dropped)
+
+def recommendation_payload(recommendations, strategy_used, history, catalog, dropped):
+    """Body of a successful GET /api/recommendations response"""
+    return {
+        "success": True, 
+        "recommendations": recommendations[:10],
+        "metadata": {
+            "user_seen_count": len(history.seen_products),
+            "catalog_size": len(catalog),
+            "strategy_used": strategy_used,
+            "recommendation_count": len(recommendations),
+            # Sources left out of this response: {name: "skipped" | "timed_out" | "failed"}
+            "dropped_sources": dropped
+        }
+    }
+
+def is_complete(payload):
+    """Degraded responses are shared with concurrent requests but not cached"""
+    return not payload["metadata"]["dropped_sources"]
+
+def batch_recommendations(current, catalog, user_ids, k):
+    """One result dict per entry of ``user_ids``, for the batch endpoint"""
+    valid_ids = [uid for uid in user_ids if ObjectId.is_valid(uid)]
+    histories = history_cache.get_many(valid_ids, load_user_histories)
+    ml_by_user = rank_for_trained_users(current, catalog, {
+        uid: histories[uid].seen_products for uid in histories if current.engine.has_user(uid)
+    })
+    similar_by_user = batch_similar_user_recommendations(current, {
+        uid: history for uid, history in histories.items() if uid not in ml_by_user
+    })
+
+    for user_id in user_ids:
+        if user_id not in histories:
+            yield {"userId": user_id, "success": False, "message": "Invalid user id"}
+            continue
+
+        history = histories[user_id]
+        ml_recommendations = ml_by_user.get(user_id)
+        similar_user_recs = similar_by_user.get(user_id) if ml_recommendations is None else None
+        recommendations, strategy_used = assemble_recommendations(
+            current, catalog, history.seen_products, history.product_scores,
+            ml_recommendations=ml_recommendations,
+            similar_user_recs=similar_user_recs
+        )
+        batch_users_total.inc(strategy=strategy_used)
+        yield {
+            "userId": user_id,
+            "success": True,
+            "recommendations": recommendations[:k],
+            "strategy_used": strategy_used
+        }
+
+def batch_similar_user_recommendations(current, histories, limit=5):
+    """Strategy 2 for every user of ``histories`` at once: {user_id: product ids}"""
+    liked = {uid: history.liked_products for uid, history in histories.items() if history.liked_products}
     try:
-        import subprocess
-        import sys
-        
-        # Run the training script
-        result = subprocess.run(
-            [sys.executable, 'train.py'], 
-            capture_output=True, 
-            text=True, 
-            cwd='.',
-            timeout=300  # 5 minute timeout
+        if current.item_neighbors is not None:
+            return {
+                uid: current.item_neighbors.recommend(liked[uid], histories[uid].seen_products, limit=limit)
+                for uid in liked
+            }
+        # Two aggregations for the whole chunk rather than two per user
+        return aggregate_similar_user_products_many(
+            events_collection, liked, {uid: histories[uid].seen_products for uid in liked}, limit=limit
         )
-        
-        if result.returncode == 0:
-            # Reload the model and metadata
-            global model, metadata, popular_products, all_product_ids, all_user_ids
-            
-            model = joblib.load('recommendation_model.joblib')
-            metadata = joblib.load('model_metadata.joblib')
-            popular_products = joblib.load('popular_products.joblib')
-            all_product_ids = metadata['product_ids']
-            all_user_ids = metadata['user_ids']
-            
-            return jsonify({
-                "success": True, 
-                "message": "Model retrained successfully",
-                "metadata": {
-                    "total_products": len(all_product_ids),
-                    "total_users": len(all_user_ids),
-                    "trained_at": metadata['trained_at'],
-                    "model_performance": {
-                        "rmse": round(metadata['model_params']['rmse'], 4),
-                        "mae": round(metadata['model_params']['mae'], 4)
-                    }
-                }
-            })
-        else:
-            error_msg = result.stderr if result.stderr else "Unknown training error"
-            return jsonify({
-                "success": False, 
-                "message": "Model training failed",
-                "error": error_msg
-            }), 500
-            
-    except subprocess.TimeoutExpired:
+    except Exception as e:
+        return {}
+
+@app.route('/api/recommendations/batch', methods=['POST'])
+@service_auth_required
+def get_batch_recommendations():
+    """Recommendations for many users, streamed back as one NDJSON line per user"""
+    current = bundle
+    if not current.loaded or events_collection is None:
         return jsonify({
             "success": False, 
-            "message": "Training timeout - please try again or check your data size"
+            "message": "Recommendation service is not ready. Please train the model first."
         }), 500
+    if not catalog_watcher.ready:
+        return catalog_not_ready()
+
+    payload = request.get_json(silent=True) or {}
+    user_ids = payload.get('userIds')
+    k = payload.get('k', 10)
+    if not isinstance(user_ids, list) or not user_ids:
+        return jsonify({"success": False, "message": "userIds must be a non-empty list"}), 400
+    if len(user_ids) > BATCH_MAX_USERS:
+        return jsonify({"success": False, "message": f"At most {BATCH_MAX_USERS} userIds per request"}), 400
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= 10:
+        return jsonify({"success": False, "message": "k must be an integer between 1 and 10"}), 400
+
+    user_ids = [str(uid) for uid in user_ids]
+    catalog = catalog_watcher.current().aligned(current.engine)
+
+    def generate():
+        # One history query and one chunk of output at a time, so memory
+        # stays flat however many users were asked for
+        for start in range(0, len(user_ids), BATCH_CHUNK_SIZE):
+            chunk = user_ids[start:start + BATCH_CHUNK_SIZE]
+            try:
+                lines = list(batch_recommendations(current, catalog, chunk, k))
+            except Exception as e:
+                lines = [
+                    {"userId": uid, "success": False, "message": "An error occurred while generating recommendations"}
+                    for uid in chunk
+                ]
+            yield ''.join(json.dumps(line) + '\n' for line in lines)
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/recommendations/popular', methods=['GET'])
+def get_popular_recommendations():
+    """Most popular products right now, optionally within one category (no login needed)"""
+    current = bundle
+    if current.popularity is None:
+        return jsonify({
+            "success": False,
+            "message": "Popularity rankings are not available. Please train the model first."
+        }), 500
+
+    limit = request.args.get('limit', 10, type=int)
+    if limit is None or not 1 <= limit <= POPULAR_MAX_LIMIT:
+        return jsonify({"success": False, "message": f"limit must be an integer between 1 and {POPULAR_MAX_LIMIT}"}), 400
+    category = request.args.get('category') or None
+    exclude_ids = set(pid for pid in request.args.get('exclude', '').split(',') if pid)
+
+    recommendations = current.popularity.top_k(limit, exclude_ids, category=category)
+    return jsonify({
+        "success": True,
+        "recommendations": recommendations,
+        "metadata": {
+            "category": category,
+            "strategy_used": "popular",
+            "recommendation_count": len(recommendations)
+        }
+    })
+
+@app.route('/api/events/ingest', methods=['POST'])
+@service_auth_required
+def ingest_events():
+    """Notify the service of new user events so cached state can be refreshed"""
+    payload = request.get_json(silent=True) or {}
+    events = [event for event in payload.get('events', []) if isinstance(event, dict)]
+    user_ids = set(str(uid) for uid in payload.get('userIds', []))
+    user_ids.update(str(event['userId']) for event in events if event.get('userId'))
+
+    # Fold the events into their pair documents before dropping cached
+    # histories, so the next read already sees them. Only once histories are
+    # read from there: before that the collection may not be backfilled, and
+    # the backfill rebuilds it from the events anyway
+    pairs = rejected = 0
+    if events and USE_INTERACTIONS_COLLECTION and interactions_collection is not None:
+        try:
+            applied = apply_events(interactions_collection, events)
+            pairs, rejected = applied['pairs'], applied['rejected']
+        except Exception as e:
+            return jsonify({"success": False, "message": f"Failed to record interactions: {str(e)}"}), 500
+
+    invalidated = sum(1 for uid in user_ids if invalidate_user(uid))
+    # The other workers' caches hold the same users
+    prefork.publish_invalidations(user_ids)
+    
+    return jsonify({
+        "success": True,
+        "users": len(user_ids),
+        "pairs": pairs,
+        # Events left out of the interactions: invalid ids or rating values
+        "rejected": rejected,
+        "invalidated": invalidated
+    })
+
+@app.route('/api/retrain', methods=['POST'])
+def retrain_model():
+    """Start retraining in the background and return the job id immediately"""
+    try:
+        job, created = retrain_jobs.submit()
+        return jsonify({
+            "success": True,
+            "message": "Retraining started" if created else "Retraining already in progress",
+            "job": job.to_dict()
+        }), 202
     except Exception as e:
         return jsonify({
             "success": False, 
             "message": f"Retraining error: {str(e)}"
         }), 500
 
+@app.route('/api/retrain/<job_id>', methods=['GET'])
+def get_retrain_job(job_id):
+    """Progress and timings of a retraining job"""
+    job = retrain_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Retraining job not found"}), 404
+    
+    response = {"success": True, "job": job.to_dict()}
+    if job.status == 'succeeded' and bundle.version == job.version:
+        metadata = bundle.metadata
+        response["metadata"] = {
+            "total_products": len(bundle.product_ids),
+            "total_users": len(bundle.user_ids),
+            "trained_at": metadata['trained_at'],
+            "model_performance": {
+                "rmse": round(metadata['model_params']['rmse'], 4),
+                "mae": round(metadata['model_params']['mae'], 4)
+            }
+        }
+    return jsonify(response)
+
+@app.route('/api/retrain/rollback', methods=['POST'])
+def rollback_model():
+    """Serve the previously active model version again"""
+    try:
+        if previous_bundle is not None:
+            target = previous_bundle
+        else:
+            version = model_store.previous_version(bundle.version) if bundle.version else None
+            if version is None:
+                return jsonify({"success": False, "message": "No previous model version to roll back to"}), 409
+            target = model_store.load(version)
+        
+        rolled_back_from = bundle.version
+        activate_bundle(target)
+        return jsonify({
+            "success": True,
+            "message": "Model rolled back",
+            "version": target.version,
+            "rolled_back_from": rolled_back_from
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"Rollback error: {str(e)}"
+        }), 500
+
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Get the current status of the recommendation service"""
@@ -326,12 +798,14 @@ def get_status():
             }), 500
         
         # Get current catalog info
-        current_products = list(products_collection.find({}, {'_id': 1}))
-        current_product_count = len(current_products)
+        current_product_count = len(catalog_watcher.current())
         
         # Get training info
-        trained_product_count = len(all_product_ids) if all_product_ids else 0
-        trained_user_count = len(all_user_ids) if all_user_ids else 0
+        current = bundle
+        metadata = current.metadata
+        active_job = retrain_jobs.active()
+        trained_product_count = len(current.product_ids)
+        trained_user_count = len(current.user_ids)
         
         # Get events count
         events_count = events_collection.count_documents({})
@@ -354,8 +828,8 @@ def get_status():
             
             # Model older than 7 days
             if last_trained:
-                trained_date = datetime.fromisoformat(last_trained)
-                days_old = (datetime.now() - trained_date).days
+                trained_date = datetime.fromisoformat(last_trained).astimezone(timezone.utc)
+                days_old = (datetime.now(timezone.utc) - trained_date).days
                 if days_old > 7:
                     needs_retraining = True
                     retraining_reason.append(f"Model is {days_old} days old")
@@ -366,13 +840,14 @@ def get_status():
         return jsonify({
             "success": True,
             "status": {
-                "model_loaded": model is not None,
+                "model_loaded": current.loaded,
                 "database_connected": True,
-                "service_ready": model is not None and events_collection is not None,
+                "service_ready": current.loaded and events_collection is not None,
                 "catalog": {
                     "total_products": current_product_count,
                     "trained_products": trained_product_count,
-                    "new_products": max(0, current_product_count - trained_product_count)
+                    "new_products": max(0, current_product_count - trained_product_count),
+                    "snapshot": catalog_watcher.status()
                 },
                 "users": {
                     "trained_users": trained_user_count
@@ -381,10 +856,37 @@ def get_status():
                     "total_events": events_count,
                     "events_in_training": metadata.get('total_events', 0) if metadata else 0
                 },
+                "history_cache": history_cache.stats(),
+                "response_cache": response_cache.stats(),
+                "candidate_pipeline": dict(candidate_pipeline.stats(), deadline_ms=RECOMMENDATION_DEADLINE_MS),
+                "history_source": INTERACTIONS_COLLECTION if USE_INTERACTIONS_COLLECTION else "events",
+                "indexes": index_report,
+                "popularity": dict(current.popularity.status(), refresh_interval_seconds=POPULARITY_REFRESH_SECONDS)
+                              if current.popularity is not None else None,
                 "model_info": {
+                    "version": current.version,
+                    "previous_version": previous_bundle.version if previous_bundle else None,
+                    "available_versions": model_store.versions(),
                     "last_trained": last_trained,
-                    "performance": metadata['model_params'] if metadata else None
+                    "performance": metadata['model_params'] if metadata else None,
+                    "evaluation": metadata.get('evaluation') if metadata else None,
+                    "retrieval": {
+                        "mode": RETRIEVAL_MODE,
+                        "ann_index_loaded": current.ann_index is not None,
+                        "ann_index": metadata.get('ann_index') if metadata else None,
+                        "item_neighbors_loaded": current.item_neighbors is not None,
+                        "topk_table_loaded": current.topk_table is not None,
+                        "topk_table": metadata.get('topk_table') if metadata else None
+                    },
+                    "incremental": {
+                        "interval_seconds": INCREMENTAL_UPDATE_SECONDS,
+                        "events_watermark": current.events_watermark.isoformat() if current.events_watermark else None,
+                        "last_update": current.last_incremental_update
+                    }
                 },
+                "retrain_job": active_job.to_dict() if active_job else None,
+                "serving": prefork.serving_status(),
+                "slow_request_profiles": slow_requests.profiles() if slow_requests is not None else None,
                 "maintenance": {
                     "needs_retraining": needs_retraining,
                     "reasons": retraining_reason if needs_retraining else []
@@ -398,13 +900,18 @@ def get_status():
             "message": f"Status check failed: {str(e)}"
         }), 500
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Request, stage and Mongo metrics in the Prometheus text format"""
+    return Response(metrics_registry.render(), content_type=CONTENT_TYPE)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Simple health check endpoint"""
     return jsonify({
         "success": True,
         "message": "Recommendation service is running",
-        "model_loaded": model is not None,
+        "model_loaded": bundle.loaded,
         "database_connected": events_collection is not None
     })
 
@@ -416,8 +923,14 @@ def home():
         "version": "1.0.0",
         "endpoints": {
             "recommendations": "/api/recommendations (GET, requires JWT)",
-            "retrain": "/api/retrain (POST)",
+            "batch": "/api/recommendations/batch (POST, requires service key, streams NDJSON)",
+            "popular": "/api/recommendations/popular (GET, ?category=&limit=&exclude=)",
+            "ingest": "/api/events/ingest (POST, requires service key)",
+            "retrain": "/api/retrain (POST, returns a job id)",
+            "retrain_job": "/api/retrain/<job_id> (GET)",
+            "rollback": "/api/retrain/rollback (POST)",
             "status": "/api/status (GET)",
+            "metrics": "/api/metrics (GET, Prometheus text format)",
             "health": "/api/health (GET)"
         },
         "status": "running"
@@ -0,0 +1,261 @@
+"""Asyncio serving mode: ``uvicorn asgi:app --workers N``
+
+GET /api/recommendations is served on the event loop with the async pymongo
+driver, so a request waiting on MongoDB no longer holds an OS thread. Every
+other route (batch, status, retrain, ingest, metrics, CORS preflights) is handed to
+the Flask app in ``app.py`` on a thread pool, and both modes share the same
+model bundle, catalog watcher, history and response caches and metrics.
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from bson import ObjectId
+from flask import jsonify
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from pymongo import AsyncMongoClient
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Response
+
+import app as service
+from cooccurrence import aggregate_similar_user_products_async
+from history_cache import UserHistory
+from interactions import INTERACTIONS_COLLECTION
+from pipeline import CandidateRequest, Deadline
+from recommender import assemble_recommendations
+
+# Threads for CPU-heavy scoring and for the routes served by the Flask app
+ASGI_EXECUTOR_WORKERS = int(os.getenv("ASGI_EXECUTOR_WORKERS", "8"))
+
+
+class AsyncRecommendationApp:
+    """ASGI application; the collections are async (AsyncMongoClient) collections"""
+
+    def __init__(self, events_collection=None, mongo_uri=None, workers=ASGI_EXECUTOR_WORKERS,
+                 interactions_collection=None):
+        self.events_collection = events_collection
+        self.interactions_collection = interactions_collection
+        self.mongo_uri = mongo_uri
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='asgi-worker')
+        self._client = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+        if scope['path'] == '/api/recommendations' and scope['method'] == 'GET':
+            response = await self.get_recommendations(scope)
+        else:
+            body = await _read_body(receive)
+            response = await self.run_in_executor(_call_flask, scope, body)
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response.headers.items()]
+        })
+        if response.is_sequence:
+            await send({'type': 'http.response.body', 'body': response.get_data()})
+            return
+
+        # Streamed Flask responses (batch NDJSON) are pulled chunk by chunk
+        # on the pool and forwarded as they come
+        chunks = response.iter_encoded()
+        try:
+            while True:
+                chunk = await self.run_in_executor(next, chunks, None)
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await self.run_in_executor(response.close)
+
+    async def run_in_executor(self, fn, *args, **kwargs):
+        """Run ``fn`` on the thread pool, keeping the request's trace context"""
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(context.run, fn, *args, **kwargs))
+
+    async def get_recommendations(self, scope):
+        """Same responses as the Flask view, with the Mongo round trips awaited"""
+        # JWT checks and error responses come from the Flask app's own handlers
+        with service.app.request_context(_environ(scope)):
+            try:
+                verify_jwt_in_request()
+                user_id = get_jwt_identity()
+            except Exception as e:
+                response = service.app.make_response(service.app.handle_user_exception(e))
+                return service.app.process_response(response)
+
+        with service.tracer.trace() as trace:
+            response = await self._recommend(scope, trace, user_id)
+            seconds = trace.elapsed()
+        service.record_request(trace, seconds, response.status_code)
+        return response
+
+    async def _recommend(self, scope, trace, user_id):
+        # One reference for the whole request, so a model swap can't mix versions
+        current = service.bundle
+        trace.model_version = current.version
+        events_collection = self._events_collection()
+        if not current.loaded or events_collection is None or service.catalog_watcher is None:
+            trace.strategy = "not_ready"
+            return _json_response(scope, {
+                "success": False,
+                "message": "Recommendation service is not ready. Please train the model first."
+            }, 500)
+        if not service.catalog_watcher.ready:
+            trace.strategy = "not_ready"
+            return _json_response(scope, {
+                "success": False,
+                "message": "Product catalog is not loaded yet. Please retry shortly."
+            }, 503)
+
+        try:
+            payload, _ = await service.response_cache.get_async(
+                user_id, service.model_state(current),
+                lambda: self._compute(events_collection, current, user_id),
+                keep=service.is_complete
+            )
+            trace.strategy = payload["metadata"]["strategy_used"]
+            with service.tracer.stage('serialize'):
+                return _json_response(scope, payload)
+
+        except Exception as e:
+            return _json_response(scope, {
+                "success": False,
+                "message": "An error occurred while generating recommendations"
+            }, 500)
+
+    async def _compute(self, events_collection, current, user_id):
+        deadline = Deadline(service.RECOMMENDATION_DEADLINE_MS / 1000)
+        # The history read and the catalog alignment don't depend on each other
+        history, catalog = await asyncio.gather(
+            self._get_history(events_collection, user_id),
+            self.run_in_executor(self._aligned_catalog, current.engine)
+        )
+
+        request = CandidateRequest(current, catalog, user_id, history, deadline)
+        candidates, dropped = await service.candidate_pipeline.run_async(request, {
+            # Aggregations go through the async client instead of a pool thread
+            'collaborative': lambda request: self._similar_user_recommendations(
+                events_collection, request.current, request.user_id, request.history, limit=5
+            )
+        })
+
+        unique_recommendations, strategy_used = assemble_recommendations(
+            current, catalog, history.seen_products, history.product_scores,
+            ml_recommendations=candidates.get('ml'),
+            similar_user_recs=candidates.get('collaborative'),
+            tracer=service.tracer
+        )
+        return service.recommendation_payload(unique_recommendations, strategy_used, history, catalog, dropped)
+
+    async def _get_history(self, events_collection, user_id):
+        async def load(user_id):
+            if service.USE_INTERACTIONS_COLLECTION:
+                cursor = self.interactions_collection.find(
+                    {'userId': ObjectId(user_id)},
+                    {'_id': 0, 'productId': 1, 'score': 1, 'counts': 1}
+                )
+                return UserHistory.from_interactions(await cursor.to_list(None))
+            cursor = events_collection.find(
+                {'userId': ObjectId(user_id)},
+                {'_id': 0, 'productId': 1, 'action': 1}
+            )
+            return UserHistory.from_events(await cursor.to_list(None))
+
+        try:
+            with service.tracer.stage('history'):
+                return await service.history_cache.get_async(user_id, load)
+        except Exception as e:
+            return UserHistory({}, [])
+
+    def _aligned_catalog(self, engine):
+        with service.tracer.stage('catalog'):
+            return service.catalog_watcher.current().aligned(engine)
+
+    async def _similar_user_recommendations(self, events_collection, current, user_id, history, limit=5):
+        try:
+            if not history.liked_products:
+                return []
+            with service.tracer.stage('collaborative'):
+                if current.item_neighbors is not None:
+                    return current.item_neighbors.recommend(history.liked_products, history.seen_products, limit=limit)
+                return await aggregate_similar_user_products_async(
+                    events_collection, user_id, history.liked_products, history.seen_products, limit=limit
+                )
+        except Exception as e:
+            return []
+
+    def _events_collection(self):
+        if self.events_collection is None and self.mongo_uri:
+            # Created on first use so the client binds to the running event loop
+            self._client = AsyncMongoClient(self.mongo_uri, event_listeners=[service.tracer.listener])
+            self.events_collection = self._client['E-commerce'].events
+            self.interactions_collection = self._client['E-commerce'][INTERACTIONS_COLLECTION]
+        return self.events_collection
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            self.events_collection = None
+            self.interactions_collection = None
+        self.executor.shutdown(wait=False)
+
+
+def _environ(scope, body=b''):
+    headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']]
+    host = next((value for name, value in headers if name.lower() == 'host'), 'localhost')
+    builder = EnvironBuilder(
+        path=scope['path'],
+        base_url=f"{scope.get('scheme', 'http')}://{host}{scope.get('root_path', '')}",
+        query_string=scope.get('query_string', b'').decode('latin-1'),
+        method=scope['method'],
+        headers=headers,
+        data=body
+    )
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+
+def _call_flask(scope, body):
+    return Response.from_app(service.app, _environ(scope, body))
+
+
+def _json_response(scope, payload, status=200):
+    # Serialised and post-processed (CORS) exactly as the Flask view would be
+    with service.app.request_context(_environ(scope)):
+        response = service.app.make_response((jsonify(payload), status))
+        return service.app.process_response(response)
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+app = AsyncRecommendationApp(mongo_uri=service.mongo_uri)
@@ -0,0 +1,444 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+from bson import ObjectId
+
+from event_loader import load_events, peak_rss_mb
+from synthetic_data import generate_catalog, generate_events
+from trainers import TRAINERS, Ratings, compare_trainers
+
+# Dataset sizes; users default to one per 50 events
+SCALES = {
+    'smoke': {'products': 2000, 'events': 50000},
+    'small': {'products': 10000, 'events': 1000000},
+    'medium': {'products': 100000, 'events': 10000000},
+    'large': {'products': 1000000, 'events': 100000000},
+}
+# Request cohorts, named after the strategy each one is meant to exercise
+COHORTS = ('ml', 'collaborative', 'popular', 'random')
+# Serving modes: the threaded Flask app and the asyncio app in asgi.py
+SERVING_MODES = ('flask', 'asgi')
+
+
+def latency_summary(latencies, wall_seconds):
+    """Percentiles (ms) and throughput of one batch of requests"""
+    latencies = np.asarray(latencies) * 1000
+    if len(latencies) == 0:
+        return {'requests': 0}
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'mean_ms': round(float(latencies.mean()), 3),
+        'max_ms': round(float(latencies.max()), 3),
+        'requests_per_second': round(len(latencies) / wall_seconds, 1) if wall_seconds > 0 else None
+    }
+
+
+def load_test(flask_app, tokens, n_requests, concurrency):
+    """Send ``n_requests`` GET /api/recommendations from ``concurrency`` threads"""
+    local = threading.local()
+    strategies = Counter()
+    errors = Counter()
+    lock = threading.Lock()
+
+    def one_request(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = flask_app.test_client()
+        headers = {'Authorization': f'Bearer {tokens[i % len(tokens)]}'}
+        started = time.perf_counter()
+        response = client.get('/api/recommendations', headers=headers)
+        elapsed = time.perf_counter() - started
+        body = response.get_json(silent=True) or {}
+        with lock:
+            if response.status_code == 200:
+                strategies[body.get('metadata', {}).get('strategy_used')] += 1
+            else:
+                errors[response.status_code] += 1
+        return elapsed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(one_request, range(n_requests)))
+    wall_seconds = time.perf_counter() - started
+
+    summary = latency_summary(latencies, wall_seconds)
+    summary.update({
+        'concurrency': concurrency,
+        'strategies': dict(strategies),
+        'errors': {str(code): count for code, count in errors.items()}
+    })
+    return summary
+
+
+def load_test_asgi(mongo_uri, tokens, n_requests, concurrency):
+    """``load_test`` against the ASGI app: ``concurrency`` tasks on one event loop"""
+    import asgi
+
+    strategies = Counter()
+    errors = Counter()
+
+    async def one_request(asgi_app, token):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/api/recommendations', 'query_string': b'',
+            'scheme': 'http', 'headers': [(b'host', b'localhost'), (b'authorization', f'Bearer {token}'.encode())]
+        }
+        started = time.perf_counter()
+        await asgi_app(scope, receive, send)
+        elapsed = time.perf_counter() - started
+        status = messages[0]['status']
+        if status == 200:
+            strategies[json.loads(messages[1]['body'])['metadata']['strategy_used']] += 1
+        else:
+            errors[status] += 1
+        return elapsed
+
+    async def run():
+        asgi_app = asgi.AsyncRecommendationApp(mongo_uri=mongo_uri)
+        queue = list(range(n_requests))
+        latencies = []
+
+        async def client():
+            while queue:
+                i = queue.pop()
+                latencies.append(await one_request(asgi_app, tokens[i % len(tokens)]))
+
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(client() for _ in range(concurrency)))
+            return latencies, time.perf_counter() - started
+        finally:
+            await asgi_app.aclose()
+
+    latencies, wall_seconds = asyncio.run(run())
+    summary = latency_summary(latencies, wall_seconds)
+    summary.update({
+        'concurrency': concurrency,
+        'strategies': dict(strategies),
+        'errors': {str(code): count for code, count in errors.items()}
+    })
+    return summary
+
+
+def compare_event_sources(db, store, snapshot_dir, engine='svd'):
+    """Train once from a MongoDB scan and once from a Parquet snapshot of the same events.
+
+    Returns the export timing and, per source, the event load and total
+    training seconds.
+    """
+    import joblib
+    import train
+    from model_store import METADATA_FILE
+    from snapshots import export_events
+
+    # Nothing is being written while the benchmark runs, so nothing needs to settle
+    results = {'export': export_events(db.events, snapshot_dir, settle_seconds=0)}
+    for source in ('mongo', 'snapshots'):
+        version = store.create_version()
+        started = time.perf_counter()
+        train.main(output_dir=store.path(version), engine_name=engine, from_snapshots=source == 'snapshots',
+                   snapshot_dir=snapshot_dir)
+        load_stats = joblib.load(os.path.join(store.path(version), METADATA_FILE))['load_stats']
+        results[source] = {
+            'load_seconds': load_stats['seconds'],
+            'train_seconds': round(time.perf_counter() - started, 3),
+            'events': load_stats['events']
+        }
+    return results
+
+
+def run_scale(scale, products, events, users, requests, concurrency, users_per_cohort=50, mongo_uri=None,
+              seed=0, workdir=None, serving=('flask',), engine='svd', compare_engines=(), compare_sources=False):
+    """Generate data, train, start the app and load-test it; returns a result dict.
+
+    Without ``mongo_uri`` everything runs against an in-process mongomock
+    client, which has to be installed before train and app are imported, so
+    call this once per process. With ``mongo_uri`` the E-commerce database on
+    that server is wiped and refilled, and training runs as a child process
+    so its peak memory is measured on its own.
+
+    Each cohort sends ``requests`` requests spread over ``users_per_cohort``
+    users, so after the first round the history cache is warm as it would
+    be for returning visitors. mongomock has no indexes, so cold history
+    lookups cost a full scan of the events; use a real mongod for numbers
+    that reflect production lookups.
+
+    ``serving`` lists the modes to load-test (``SERVING_MODES``); the asgi
+    mode uses the async pymongo driver and therefore needs ``mongo_uri``.
+    The served model is trained with ``engine``; ``compare_engines`` also
+    trains each listed engine on an 80/20 split of the same ratings and
+    reports its wall time, RMSE and recall@10. ``compare_sources`` exports
+    the events to Parquet snapshots and times training from each source
+    (needs pyarrow).
+    """
+    if 'asgi' in serving and not mongo_uri:
+        raise ValueError('The asgi serving mode needs a real MongoDB (--mongo-uri); the async driver has no mongomock')
+    workdir = workdir or tempfile.mkdtemp(prefix=f'bench-{scale}-')
+    os.environ.setdefault('JWT_SECRET_KEY', ObjectId().binary.hex() * 3)
+    os.environ['MODEL_DIR'] = os.path.join(workdir, 'models')
+    os.environ['HISTORY_CHANGE_STREAM'] = 'false'
+    os.environ['INCREMENTAL_UPDATE_SECONDS'] = '0'
+    os.environ['POPULARITY_REFRESH_SECONDS'] = '0'
+
+    if mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_uri)
+        os.environ['MONGO_URI'] = mongo_uri
+    else:
+        import mongomock
+        import pymongo
+        client = mongomock.MongoClient()
+        pymongo.MongoClient = lambda *args, **kwargs: client
+        os.environ['MONGO_URI'] = 'mongodb://localhost:27017'
+
+    db = client['E-commerce']
+    db.products.drop()
+    db.events.drop()
+
+    started = time.perf_counter()
+    product_ids = generate_catalog(db.products, products, seed=seed)
+    generate_events(db.events, product_ids, users, events, seed=seed)
+    generate_seconds = time.perf_counter() - started
+
+    from model_store import ModelStore
+    store = ModelStore(os.environ['MODEL_DIR'])
+    version = store.create_version()
+    rss_before_train = peak_rss_mb()
+    started = time.perf_counter()
+    if mongo_uri:
+        subprocess.run(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train.py'),
+             '--output-dir', store.path(version), '--engine', engine],
+            check=True, cwd=workdir
+        )
+        train_peak_rss = _children_peak_rss_mb()
+    else:
+        import train
+        train.main(output_dir=store.path(version), engine_name=engine)
+        train_peak_rss = peak_rss_mb()
+    train_seconds = time.perf_counter() - started
+    store.activate(version)
+
+    trainers = None
+    if compare_engines:
+        event_log = load_events(db.events)
+        pair_users, pair_items, pair_ratings = event_log.aggregate()
+        trainers = compare_trainers(
+            Ratings(pair_users, pair_items, pair_ratings, event_log.user_ids, event_log.product_ids),
+            engines=compare_engines, seed=seed
+        )
+
+    sources = None
+    if compare_sources:
+        sources = compare_event_sources(db, store, os.path.join(workdir, 'event_snapshots'), engine)
+
+    started = time.perf_counter()
+    import app as service
+    startup_seconds = time.perf_counter() - started
+    service.catalog_watcher.current(timeout=60)
+
+    # Users who bought something after training: not in the model, so they
+    # take the collaborative path
+    rng = random.Random(seed)
+    collaborative_users = [ObjectId() for _ in range(users_per_cohort)]
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    db.events.insert_many([
+        {'userId': uid, 'productId': pid, 'action': 'purchase', 'value': None, 'createdAt': now}
+        for uid in collaborative_users for pid in rng.sample(product_ids[:100], 3)
+    ])
+    trained_users = service.bundle.user_ids
+    cohort_users = {
+        'ml': rng.sample(trained_users, min(users_per_cohort, len(trained_users))),
+        'collaborative': [str(uid) for uid in collaborative_users],
+        'popular': [str(ObjectId()) for _ in range(users_per_cohort)],
+        'random': [str(ObjectId()) for _ in range(users_per_cohort)],
+    }
+
+    from flask_jwt_extended import create_access_token
+    from model_store import ModelBundle
+    endpoints = {mode: {} for mode in serving}
+    for cohort in COHORTS:
+        with service.app.app_context():
+            tokens = [create_access_token(identity=uid) for uid in cohort_users[cohort]]
+        serving_bundle = service.bundle
+        removed_products = []
+        if cohort == 'random':
+            # Brand-new users only fall through to the random catalog sample
+            # when nothing else has candidates: no popular products, no item
+            # neighbours and no untrained products for the exploration slots.
+            # The untrained products leave the collection itself, so the
+            # running catalog watcher keeps the smaller catalog
+            b = serving_bundle
+            service.bundle = ModelBundle(
+                b.model, b.metadata, [], b.engine, ann_index=b.ann_index, item_neighbors=None,
+                topk_table=b.topk_table, version=b.version, events_watermark=b.events_watermark, popularity=None
+            )
+            untrained = {'_id': {'$in': [ObjectId(pid) for pid in service.catalog_watcher.snapshot.new_product_ids]}}
+            removed_products = list(db.products.find(untrained))
+            db.products.delete_many(untrained)
+            service.catalog_watcher.full_refresh()
+        try:
+            for mode in serving:
+                if mode == 'asgi':
+                    endpoints[mode][cohort] = load_test_asgi(mongo_uri, tokens, requests, concurrency)
+                else:
+                    endpoints[mode][cohort] = load_test(service.app, tokens, requests, concurrency)
+        finally:
+            service.bundle = serving_bundle
+            if removed_products:
+                db.products.insert_many(removed_products)
+                service.catalog_watcher.full_refresh()
+
+    for mode in serving:
+        strategies = endpoints[mode]['random']['strategies']
+        if set(strategies) != {'random'}:
+            raise RuntimeError(f'The random cohort was served by {strategies} ({mode}), not the random fallback')
+
+    metadata = service.bundle.metadata
+    return {
+        'scale': scale,
+        'backend': 'mongod' if mongo_uri else 'mongomock',
+        'dataset': {
+            'products': products,
+            'users': users,
+            'events': events,
+            'trained_users': len(trained_users),
+            'trained_products': len(service.bundle.product_ids),
+            'generate_seconds': round(generate_seconds, 3)
+        },
+        'train': {
+            'engine': engine,
+            'seconds': round(train_seconds, 3),
+            'peak_rss_mb': train_peak_rss,
+            'rss_before_mb': None if mongo_uri else rss_before_train,
+            'load_stats': metadata.get('load_stats'),
+            'topk_table': metadata.get('topk_table')
+        },
+        'trainers': trainers,
+        'sources': sources,
+        'app_startup_seconds': round(startup_seconds, 3),
+        'load': {'requests_per_cohort': requests, 'users_per_cohort': users_per_cohort, 'concurrency': concurrency},
+        'endpoints': endpoints
+    }
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'started_at': datetime.now().isoformat()
+    }
+
+
+def _children_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark training and the recommendations endpoint')
+    parser.add_argument('--scale', nargs='+', default=['smoke'], choices=sorted(SCALES),
+                        help='dataset sizes to run, each in its own process')
+    parser.add_argument('--products', type=int, help='override the number of products')
+    parser.add_argument('--events', type=int, help='override the number of events')
+    parser.add_argument('--users', type=int, help='override the number of users (default: events / 50)')
+    parser.add_argument('--requests', type=int, default=500, help='requests per strategy cohort')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent client threads')
+    parser.add_argument('--users-per-cohort', type=int, default=50, help='distinct users per strategy cohort')
+    parser.add_argument('--mongo-uri', help='use this MongoDB instead of mongomock (its E-commerce db is wiped)')
+    parser.add_argument('--serving', nargs='+', default=['flask'], choices=SERVING_MODES,
+                        help='serving modes to load-test (asgi needs --mongo-uri)')
+    parser.add_argument('--engine', default='svd', choices=sorted(TRAINERS), help='engine of the served model')
+    parser.add_argument('--compare-engines', nargs='*', default=[], choices=sorted(TRAINERS),
+                        help='also compare these training engines on an 80/20 split')
+    parser.add_argument('--compare-sources', action='store_true',
+                        help='also time training from a MongoDB scan against a Parquet snapshot (needs pyarrow)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the JSON results')
+    args = parser.parse_args()
+
+    runs = []
+    for scale in args.scale:
+        products = args.products or SCALES[scale]['products']
+        events = args.events or SCALES[scale]['events']
+        users = args.users or max(1, events // 50)
+        if len(args.scale) == 1:
+            runs.append(run_scale(scale, products, events, users, args.requests, args.concurrency,
+                                  users_per_cohort=args.users_per_cohort, mongo_uri=args.mongo_uri, seed=args.seed,
+                                  serving=args.serving, engine=args.engine, compare_engines=args.compare_engines,
+                                  compare_sources=args.compare_sources))
+            continue
+
+        # mongomock and the app's module state are per process, so every
+        # scale gets a fresh interpreter
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            child_output = f.name
+        command = [sys.executable, os.path.abspath(__file__), '--scale', scale,
+                   '--products', str(products), '--events', str(events), '--users', str(users),
+                   '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+                   '--users-per-cohort', str(args.users_per_cohort), '--serving', *args.serving,
+                   '--engine', args.engine, '--compare-engines', *args.compare_engines,
+                   '--seed', str(args.seed), '--output', child_output]
+        if args.compare_sources:
+            command.append('--compare-sources')
+        if args.mongo_uri:
+            command += ['--mongo-uri', args.mongo_uri]
+        subprocess.run(command, check=True)
+        with open(child_output) as f:
+            runs.extend(json.load(f)['runs'])
+        os.remove(child_output)
+
+    results = {'environment': environment_info(), 'runs': runs}
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    for run in runs:
+        print(f"[{run['scale']}] train {run['train']['seconds']}s, peak RSS {run['train']['peak_rss_mb']} MB")
+        for name, stats in (run.get('trainers') or {}).items():
+            print(f"  {name:<5} fit {stats['seconds']}s  RMSE {stats['rmse']}  recall@10 {stats['recall_at_10']}")
+        if run.get('sources'):
+            sources = run['sources']
+            print(f"  export {sources['export']['events']} events to Parquet in {sources['export']['seconds']}s")
+            for source in ('mongo', 'snapshots'):
+                print(f"  {source:<9} load {sources[source]['load_seconds']}s  train {sources[source]['train_seconds']}s")
+        for mode, cohorts in run['endpoints'].items():
+            for cohort, stats in cohorts.items():
+                print(f"  {mode:<5} {cohort:<13} p50 {stats.get('p50_ms')}ms  p95 {stats.get('p95_ms')}ms  "
+                      f"p99 {stats.get('p99_ms')}ms  {stats.get('requests_per_second')} req/s  {stats['strategies']}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import threading
+from datetime import datetime
+
+import numpy as np
+from pymongo.errors import ConnectionFailure
+
+
+class CatalogSnapshot:
+    """Immutable view of the active product catalog.
+
+    ``active_mask`` is aligned with the scoring engine's item index so the ML
+    strategy can filter removed products without touching MongoDB.
+    """
+
+    def __init__(self, product_ids, engine=None, refreshed_at=None):
+        self.ordered_ids = tuple(product_ids)
+        self.product_ids = frozenset(self.ordered_ids)
+        self.refreshed_at = refreshed_at or datetime.now()
+        self.engine = engine
+
+        if engine is not None:
+            rows = engine.item_ids.codes(self.ordered_ids)
+            self.active_mask = np.zeros(engine.n_items, dtype=bool)
+            self.active_mask[rows[rows >= 0]] = True
+            self.new_product_ids = tuple(pid for pid, row in zip(self.ordered_ids, rows) if row < 0)
+        else:
+            self.active_mask = np.zeros(0, dtype=bool)
+            self.new_product_ids = self.ordered_ids
+
+    def __len__(self):
+        return len(self.ordered_ids)
+
+    def __contains__(self, product_id):
+        return product_id in self.product_ids
+
+    def aligned(self, engine):
+        """This snapshot, realigned if it was built for a different engine"""
+        if engine is self.engine:
+            return self
+        return CatalogSnapshot(self.ordered_ids, engine, self.refreshed_at)
+
+
+class CatalogWatcher:
+    """Keeps a CatalogSnapshot fresh from a background thread.
+
+    Uses a change stream when the deployment supports one (replica sets and
+    Atlas) and otherwise polls for products whose ``updatedAt`` moved past the
+    last watermark. Each refresh publishes a new snapshot with a single
+    reference assignment, so readers never see a half-built catalog.
+    """
+
+    def __init__(self, collection, engine=None, interval=30):
+        self.collection = collection
+        self.engine = engine
+        self.interval = interval
+        self.mode = None
+        self.snapshot = CatalogSnapshot([], engine)
+        self.last_error = None
+        self.checked_at = None
+        self._watermark = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='catalog-watcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def ready(self):
+        """Whether the first full load has completed"""
+        return self._ready.is_set()
+
+    def current(self, timeout=0):
+        """Latest snapshot; empty until the first load unless ``timeout`` waits for it.
+
+        Requests call this without a timeout and check ``ready`` instead, so an
+        unreachable products collection fails them fast rather than stalling
+        every one of them.
+        """
+        if timeout:
+            self._ready.wait(timeout)
+        return self.snapshot
+
+    def rebind(self, engine):
+        """Realign the active mask with a newly loaded model"""
+        with self._lock:
+            self.engine = engine
+            self._publish(self.snapshot.ordered_ids)
+
+    def full_refresh(self):
+        """Re-read every product id and reset the updatedAt watermark"""
+        product_ids = []
+        watermark = None
+        for product in self.collection.find({}, {'_id': 1, 'updatedAt': 1}):
+            product_ids.append(str(product['_id']))
+            updated_at = product.get('updatedAt')
+            if updated_at is not None and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+
+        with self._lock:
+            self._watermark = watermark
+            self._publish(product_ids)
+        self.checked_at = datetime.now()
+        self._ready.set()
+
+    def poll(self):
+        """Pick up products added or updated since the watermark"""
+        query = {} if self._watermark is None else {'updatedAt': {'$gt': self._watermark}}
+        changed = list(self.collection.find(query, {'_id': 1, 'updatedAt': 1}))
+
+        with self._lock:
+            known = self.snapshot.product_ids
+            added = [str(p['_id']) for p in changed if str(p['_id']) not in known]
+            for product in changed:
+                updated_at = product.get('updatedAt')
+                if updated_at is not None and (self._watermark is None or updated_at > self._watermark):
+                    self._watermark = updated_at
+            expected_count = len(known) + len(added)
+        self.checked_at = datetime.now()
+
+        # Deletions never move the watermark, so fall back to a full re-read
+        # whenever the collection size disagrees with the snapshot
+        if self.collection.estimated_document_count() != expected_count:
+            self.full_refresh()
+        elif added:
+            with self._lock:
+                self._publish(self.snapshot.ordered_ids + tuple(added))
+
+    def _publish(self, product_ids):
+        self.snapshot = CatalogSnapshot(product_ids, self.engine)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._watch_changes()
+            except ConnectionFailure as e:
+                self.last_error = str(e)
+                self._stop.wait(self.interval)
+            except Exception as e:
+                # Standalone servers reject $changeStream and stand-ins such as
+                # mongomock do not implement it at all
+                self.last_error = str(e)
+                self._poll_forever()
+
+    def _watch_changes(self):
+        pipeline = [{'$match': {'operationType': {'$in': ['insert', 'delete', 'replace', 'update']}}}]
+        with self.collection.watch(pipeline, max_await_time_ms=int(self.interval * 1000)) as stream:
+            # Open the stream before the full read so no change falls in between
+            self.mode = 'change_stream'
+            self.full_refresh()
+            while not self._stop.is_set() and stream.alive:
+                added, removed = [], set()
+                change = stream.try_next()
+                while change is not None:
+                    product_id = str(change['documentKey']['_id'])
+                    if change['operationType'] == 'delete':
+                        removed.add(product_id)
+                    else:
+                        added.append(product_id)
+                    change = stream.try_next()
+
+                self.checked_at = datetime.now()
+                if added or removed:
+                    with self._lock:
+                        known = self.snapshot.product_ids
+                        product_ids = [pid for pid in self.snapshot.ordered_ids if pid not in removed]
+                        product_ids.extend(pid for pid in dict.fromkeys(added) if pid not in known and pid not in removed)
+                        self._publish(product_ids)
+
+    def _poll_forever(self):
+        self.mode = 'poll'
+        refresh = self.full_refresh
+        while not self._stop.is_set():
+            try:
+                refresh()
+                refresh = self.poll
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            self._stop.wait(self.interval)
+
+    def status(self):
+        snapshot = self.snapshot
+        return {
+            "mode": self.mode,
+            "refresh_interval_seconds": self.interval,
+            "product_count": len(snapshot),
+            "refreshed_at": snapshot.refreshed_at.isoformat(),
+            "checked_at": self.checked_at.isoformat() if self.checked_at else None,
+            "last_error": self.last_error
+        }
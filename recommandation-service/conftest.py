@@ -0,0 +1,44 @@
+import importlib
+import sys
+
+import mongomock
+import pymongo
+import pytest
+
+from synthetic_data import generate_catalog, generate_events
+
+
+@pytest.fixture(scope='module')
+def service(tmp_path_factory):
+    """The Flask app trained on a small synthetic catalog, backed by mongomock"""
+    workdir = tmp_path_factory.mktemp('service')
+    client = mongomock.MongoClient()
+    db = client['E-commerce']
+    product_ids = generate_catalog(db.products, 60, seed=1)
+    user_ids = generate_events(db.events, product_ids, 40, 1500, seed=1)
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(pymongo, 'MongoClient', lambda *args, **kwargs: client)
+        mp.setenv('MONGO_URI', 'mongodb://localhost:27017')
+        mp.setenv('JWT_SECRET_KEY', 'test-secret-key-that-is-long-enough-for-hs256')
+        mp.setenv('MODEL_DIR', str(workdir / 'models'))
+        mp.setenv('SERVICE_API_KEY', 'service-key')
+        mp.setenv('HISTORY_CHANGE_STREAM', 'false')
+        mp.setenv('POPULARITY_REFRESH_SECONDS', '0')
+        mp.chdir(workdir)
+        for name in ('train', 'app', 'asgi'):
+            sys.modules.pop(name, None)
+
+        train = importlib.import_module('train')
+        from model_store import ModelStore
+        store = ModelStore(str(workdir / 'models'))
+        version = store.create_version()
+        train.main(output_dir=store.path(version))
+        store.activate(version)
+
+        app_module = importlib.import_module('app')
+        app_module.catalog_watcher.current(timeout=10)
+        yield app_module, db, user_ids
+        app_module.catalog_watcher.stop()
+        sys.modules.pop('app', None)
+        sys.modules.pop('asgi', None)
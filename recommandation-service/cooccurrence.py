@@ -0,0 +1,258 @@
+import os
+
+import numpy as np
+from bson import ObjectId
+from scipy import sparse
+
+from history_cache import POSITIVE_ACTIONS
+from id_registry import IdRegistry
+
+ITEM_NEIGHBORS_FILE = 'item_neighbors.npz'
+
+
+class ItemNeighborIndex:
+    """Sparse item-item co-occurrence matrix with the top-N neighbours per item.
+
+    ``matrix[i, j]`` counts the users who purchased or carted both ``i`` and
+    ``j``. Summing the rows of a user's own liked items scores every product
+    "users like you bought", without touching the events collection.
+    """
+
+    def __init__(self, product_ids, matrix):
+        self.product_ids = IdRegistry.of(product_ids)
+        self.item_index = self.product_ids.index
+        self.matrix = matrix.tocsr()
+
+    @classmethod
+    def build(cls, user_ids, product_ids, top_n=50):
+        """Build from parallel sequences of (user, product) positive interactions"""
+        user_codes, unique_users = _factorize(user_ids)
+        item_codes, unique_items = _factorize(product_ids)
+        return cls.from_codes(user_codes, item_codes, unique_items, n_users=len(unique_users), top_n=top_n)
+
+    @classmethod
+    def from_codes(cls, user_codes, item_codes, product_ids, n_users=None, top_n=50):
+        """Build from integer-coded interactions; ``product_ids`` decodes item codes"""
+        if n_users is None:
+            n_users = int(user_codes.max()) + 1 if len(user_codes) else 0
+
+        interactions = sparse.csr_matrix(
+            (np.ones(len(user_codes), dtype=np.float32), (user_codes, item_codes)),
+            shape=(n_users, len(product_ids))
+        )
+        # Repeated purchases of the same item by one user count once
+        interactions.data[:] = 1.0
+
+        cooccurrence = (interactions.T @ interactions).tocsr()
+        cooccurrence = (cooccurrence - sparse.diags(cooccurrence.diagonal())).tocsr()
+        cooccurrence.eliminate_zeros()
+        return cls(product_ids, _keep_top_n(cooccurrence, top_n))
+
+    @property
+    def n_items(self):
+        return len(self.product_ids)
+
+    def recommend(self, liked_products, seen_products, limit=5):
+        """Products most co-liked with ``liked_products``, excluding seen ones"""
+        rows = self.product_ids.codes(list(liked_products))
+        rows = rows[rows >= 0]
+        if len(rows) == 0:
+            return []
+
+        indptr = self.matrix.indptr
+        neighbors = np.concatenate([self.matrix.indices[indptr[r]:indptr[r + 1]] for r in rows])
+        weights = np.concatenate([self.matrix.data[indptr[r]:indptr[r + 1]] for r in rows])
+        if len(neighbors) == 0:
+            return []
+
+        candidates, inverse = np.unique(neighbors, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        # Highest score first, ties broken by item order
+        order = np.lexsort((candidates, -scores))
+
+        recommendations = []
+        for position in order:
+            product_id = self.product_ids[candidates[position]]
+            if product_id not in seen_products:
+                recommendations.append(product_id)
+                if len(recommendations) >= limit:
+                    break
+        return recommendations
+
+    def save(self, path=ITEM_NEIGHBORS_FILE):
+        np.savez(
+            path,
+            product_ids=np.array(list(self.product_ids)),
+            data=self.matrix.data,
+            indices=self.matrix.indices,
+            indptr=self.matrix.indptr
+        )
+
+    @classmethod
+    def load(cls, path=ITEM_NEIGHBORS_FILE):
+        with np.load(path) as data:
+            product_ids = data['product_ids'].tolist()
+            n = len(product_ids)
+            matrix = sparse.csr_matrix((data['data'], data['indices'], data['indptr']), shape=(n, n))
+        return cls(product_ids, matrix)
+
+
+def load_item_neighbors(path=ITEM_NEIGHBORS_FILE):
+    if not os.path.exists(path):
+        return None
+    return ItemNeighborIndex.load(path)
+
+
+def aggregate_similar_user_products(events_collection, user_id, liked_products, seen_products, limit=5,
+                                    max_time_ms=None):
+    """Collaborative recommendations straight from the events collection.
+
+    Finds the ten users with the most events on the user's liked products and
+    returns what they purchased or carted most often. This is the fallback
+    when no item_neighbors artifact has been trained. With ``max_time_ms``
+    the server abandons each aggregation after that long.
+    """
+    options = {'maxTimeMS': max_time_ms} if max_time_ms else {}
+    similar_users = events_collection.aggregate(_similar_users_pipeline(user_id, liked_products), **options)
+
+    similar_user_ids = [str(u['_id']) for u in similar_users]
+
+    if not similar_user_ids:
+        return []
+
+    # Get products these similar users liked
+    similar_user_products = events_collection.aggregate(_liked_products_pipeline(similar_user_ids, limit), **options)
+    return _unseen_products(similar_user_products, seen_products, limit)
+
+
+async def aggregate_similar_user_products_async(events_collection, user_id, liked_products, seen_products, limit=5):
+    """``aggregate_similar_user_products`` for an asyncio (AsyncMongoClient) collection"""
+    cursor = await events_collection.aggregate(_similar_users_pipeline(user_id, liked_products))
+    similar_user_ids = [str(u['_id']) for u in await cursor.to_list(None)]
+
+    if not similar_user_ids:
+        return []
+
+    cursor = await events_collection.aggregate(_liked_products_pipeline(similar_user_ids, limit))
+    return _unseen_products(await cursor.to_list(None), seen_products, limit)
+
+
+def aggregate_similar_user_products_many(events_collection, liked_by_user, seen_by_user, limit=5):
+    """``aggregate_similar_user_products`` for many users in two aggregations.
+
+    ``liked_by_user``/``seen_by_user`` map user ids to their product ids.
+    The per-pair counts of the users' liked products and of their similar
+    users' positive events are read once for all of them and ranked here;
+    returns {user_id: product ids}.
+    """
+    liked_by_user = {uid: liked for uid, liked in liked_by_user.items() if liked}
+    if not liked_by_user:
+        return {}
+
+    liked_ids = set().union(*liked_by_user.values())
+    events_by_product = {}
+    for pair in events_collection.aggregate(_pair_counts_pipeline(
+            {'productId': {'$in': [ObjectId(pid) for pid in liked_ids]}})):
+        if pair['_id'].get('userId') is not None:
+            events_by_product.setdefault(str(pair['_id']['productId']), []).append(
+                (str(pair['_id']['userId']), pair['count']))
+
+    similar_by_user = {}
+    for user_id, liked in liked_by_user.items():
+        counts = {}
+        for product_id in liked:
+            for other, count in events_by_product.get(product_id, ()):
+                if other != user_id:
+                    counts[other] = counts.get(other, 0) + count
+        similar_by_user[user_id] = sorted(counts, key=lambda other: (-counts[other], other))[:10]
+
+    similar_ids = set().union(*similar_by_user.values())
+    if not similar_ids:
+        return {user_id: [] for user_id in liked_by_user}
+    liked_by_similar = {}
+    for pair in events_collection.aggregate(_pair_counts_pipeline({
+            'userId': {'$in': [ObjectId(uid) for uid in similar_ids]},
+            'action': {'$in': list(POSITIVE_ACTIONS)}})):
+        liked_by_similar.setdefault(str(pair['_id']['userId']), []).append((pair['_id']['productId'], pair['count']))
+
+    results = {}
+    for user_id, similar in similar_by_user.items():
+        scores = {}
+        for other in similar:
+            for product_id, count in liked_by_similar.get(other, ()):
+                scores[product_id] = scores.get(product_id, 0) + count
+        ranked = sorted(scores, key=lambda pid: (-scores[pid], str(pid)))[:limit * 2]
+        results[user_id] = _unseen_products(({'_id': pid} for pid in ranked), seen_by_user.get(user_id, ()), limit)
+    return results
+
+
+def _similar_users_pipeline(user_id, liked_products):
+    return [
+        {'$match': {'productId': {'$in': [ObjectId(pid) for pid in liked_products]}}},
+        {'$group': {'_id': '$userId', 'count': {'$sum': 1}}},
+        {'$match': {'_id': {'$ne': ObjectId(user_id)}}},
+        {'$sort': {'count': -1}},
+        {'$limit': 10}
+    ]
+
+
+def _liked_products_pipeline(user_ids, limit):
+    return [
+        {'$match': {
+            'userId': {'$in': [ObjectId(uid) for uid in user_ids]},
+            'action': {'$in': list(POSITIVE_ACTIONS)}
+        }},
+        {'$group': {'_id': '$productId', 'score': {'$sum': 1}}},
+        {'$sort': {'score': -1}},
+        {'$limit': limit * 2}
+    ]
+
+
+def _pair_counts_pipeline(match):
+    return [
+        {'$match': match},
+        {'$group': {'_id': {'userId': '$userId', 'productId': '$productId'}, 'count': {'$sum': 1}}}
+    ]
+
+
+def _unseen_products(products, seen_products, limit):
+    recommendations = []
+    for product in products:
+        product_id = str(product['_id'])
+        if product_id not in seen_products:
+            recommendations.append(product_id)
+            if len(recommendations) >= limit:
+                break
+
+    return recommendations
+
+
+def _factorize(values):
+    """Integer codes in order of first appearance, plus the unique values"""
+    index = {}
+    codes = np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int64)
+    return codes, list(index)
+
+
+def _keep_top_n(matrix, top_n):
+    """Keep only the ``top_n`` largest entries of each CSR row"""
+    data, indices, indptr = [], [], [0]
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        row_data = matrix.data[start:end]
+        row_indices = matrix.indices[start:end]
+        if len(row_data) > top_n:
+            keep = np.argpartition(-row_data, top_n - 1)[:top_n]
+            keep.sort()
+            row_data = row_data[keep]
+            row_indices = row_indices[keep]
+        data.append(row_data)
+        indices.append(row_indices)
+        indptr.append(indptr[-1] + len(row_data))
+
+    return sparse.csr_matrix(
+        (np.concatenate(data) if data else np.zeros(0, dtype=np.float32),
+         np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32),
+         np.array(indptr)),
+        shape=matrix.shape
+    )
@@ -0,0 +1,405 @@
+"""Offline evaluation: a time-based holdout, ranked the way GET /api/recommendations ranks
+
+    python evaluation.py                        # active version's engine and parameters, last 7 days held out
+    python evaluation.py --holdout-days 14 --k 20 --version 20250601-120000-000000
+    python evaluation.py --forward              # the active version as trained vs the events since
+    python evaluation.py --compare              # one line per version that has a report
+
+Holdout: the events before the cutoff train a model with the version's
+engine and parameters (train.prepare_ratings, as a full training does); the
+events from the cutoff on are the test set. Forward: the version's own
+artifacts are scored on the events after its watermark. Either way a test
+user's relevant items are the products they purchased or carted in the test
+period and had not interacted with before it, which is what the endpoint
+could still have recommended them.
+
+- model: recall@k, NDCG@k and hit rate@k of the factor model's top k (earlier
+  interactions and inactive products excluded) for the test users it knows,
+  scored in blocks of users with one matrix product each; RMSE and MAE on
+  the test pairs it knows.
+- cascade: every test user's list as the endpoint assembles it (ml,
+  collaborative, exploration and popular fills, ...), with histories, item
+  neighbours and popularity as of the cutoff; hit rate and recall per
+  strategy.
+- coverage: share of the catalog recommended to at least one test user.
+
+The report is written to the version's directory as evaluation.json.
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from scipy import sparse
+
+from catalog import CatalogSnapshot
+from cooccurrence import ItemNeighborIndex
+from event_loader import ACTIONS, MISSING_TIMESTAMP, _to_millis
+from history_cache import ACTION_WEIGHTS, POSITIVE_ACTIONS
+from incremental import events_watermark
+from model_store import ModelBundle
+from popularity import PopularityIndex
+from recommender import BATCH_SCORE_CELLS, ML_CANDIDATES, assemble_recommendations
+from scoring import top_k_rows
+from trainers import make_trainer
+
+EVALUATION_FILE = 'evaluation.json'
+# Days of the most recent events held out as the test set
+EVAL_HOLDOUT_DAYS = float(os.getenv("EVAL_HOLDOUT_DAYS", "7"))
+# Length of the evaluated recommendation lists
+EVAL_K = int(os.getenv("EVAL_K", "10"))
+
+# History weight of every action code, as history_cache scores them
+_HISTORY_WEIGHTS = np.array([ACTION_WEIGHTS.get(action, 1) for action in ACTIONS] + [1], dtype=np.float64)
+
+
+def default_cutoff(events, holdout_days=EVAL_HOLDOUT_DAYS):
+    """``holdout_days`` before the latest event"""
+    latest = events_watermark(events)
+    return latest - timedelta(days=holdout_days) if latest is not None else None
+
+
+def split_at(events, cutoff):
+    """(train, test): the events before ``cutoff`` and from it on; undated ones train"""
+    dated = events.timestamps != MISSING_TIMESTAMP
+    test = dated & (events.timestamps >= _to_millis(cutoff))
+    return events.subset(~test), events.subset(test)
+
+
+def evaluate_holdout(events, cutoff, engine_name='svd', params=None, k=EVAL_K, catalog_ids=None, seed=0,
+                     popularity_half_life_days=7.0):
+    """Train ``engine_name`` on the events before ``cutoff`` and evaluate it on the rest"""
+    from train import prepare_ratings
+
+    started = time.perf_counter()
+    train_events, test_events = split_at(events, cutoff)
+    ratings = prepare_ratings(train_events, now=cutoff)
+    if ratings is None:
+        raise ValueError(f"Too few events before {cutoff.isoformat()} to train a model")
+    trainer = make_trainer(engine_name, **dict(params or {}, random_state=seed))
+    fit_started = time.perf_counter()
+    engine = trainer.fit(ratings)
+    fit_seconds = time.perf_counter() - fit_started
+
+    current = holdout_bundle(engine, train_events, popularity_half_life_days)
+    report = evaluate_bundle(current, train_events, test_events, k=k, catalog_ids=catalog_ids, seed=seed)
+    report.update(mode='holdout', engine=engine_name, params=trainer.params, cutoff=cutoff.isoformat())
+    report['train']['ratings'] = len(ratings)
+    report['seconds'].update(fit=round(fit_seconds, 3), total=round(time.perf_counter() - started, 3))
+    return report
+
+
+def evaluate_forward(current, events, k=EVAL_K, catalog_ids=None, seed=0):
+    """Evaluate a loaded version on the events after its watermark"""
+    started = time.perf_counter()
+    if current.events_watermark is None:
+        raise ValueError("The version has no events watermark to split at")
+    cutoff = current.events_watermark + timedelta(milliseconds=1)
+    train_events, test_events = split_at(events, cutoff)
+    report = evaluate_bundle(current, train_events, test_events, k=k, catalog_ids=catalog_ids, seed=seed)
+    report.update(mode='forward', engine=current.metadata.get('model_params', {}).get('engine', 'svd'),
+                  params=current.metadata.get('model_params'), cutoff=cutoff.isoformat())
+    report['seconds']['total'] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def holdout_bundle(engine, train_events, popularity_half_life_days=7.0):
+    """The serving state train.py would build from ``train_events`` around ``engine``"""
+    popularity = PopularityIndex(half_life_days=popularity_half_life_days)
+    popularity.update(train_events)
+    item_neighbors = None
+    positive = train_events.action_mask(POSITIVE_ACTIONS)
+    if positive.any():
+        item_neighbors = ItemNeighborIndex.from_codes(
+            train_events.user_codes[positive], train_events.item_codes[positive], train_events.product_ids,
+            n_users=len(train_events.user_ids)
+        )
+    return ModelBundle(None, {}, popularity.top_k(20), engine, item_neighbors=item_neighbors, popularity=popularity)
+
+
+def evaluate_bundle(current, train_events, test_events, k=EVAL_K, catalog_ids=None, seed=0,
+                    max_cells=BATCH_SCORE_CELLS):
+    """Model and cascade metrics of ``current`` (a ModelBundle) on ``test_events``.
+
+    Both event sets must share their id lists (``split_at``); the train
+    events are the users' histories.
+    """
+    started = time.perf_counter()
+    engine = current.engine
+    product_ids = train_events.product_ids
+    shape = (len(train_events.user_ids), len(product_ids))
+
+    seen = _pairs(train_events, shape)
+    positive = test_events.action_mask(POSITIVE_ACTIONS)
+    relevant = _pairs(test_events, shape, mask=positive)
+    relevant = (relevant - relevant.multiply(seen)).tocsr()
+    relevant.eliminate_zeros()
+    n_relevant = relevant.getnnz(axis=1)
+    test_users = np.flatnonzero(n_relevant)
+
+    catalog = CatalogSnapshot(product_ids if catalog_ids is None else catalog_ids, engine)
+    user_rows = engine.user_ids.codes(train_events.user_ids)
+    item_rows = engine.item_ids.codes(product_ids)
+    # Engine item row -> event product code
+    product_codes = np.full(engine.n_items, -1, dtype=np.int64)
+    product_codes[item_rows[item_rows >= 0]] = np.flatnonzero(item_rows >= 0)
+
+    known_users = test_users[user_rows[test_users] >= 0]
+    top, model = _rank_known_users(engine, catalog, seen, relevant, n_relevant, known_users, user_rows, item_rows,
+                                   product_codes, k, max_cells)
+    model.update(_rating_errors(engine, test_events, user_rows, item_rows))
+    model['coverage'] = _coverage(np.unique(top[:, :k][top[:, :k] >= 0]), catalog)
+    model_seconds = time.perf_counter() - started
+
+    cascade_started = time.perf_counter()
+    cascade = _replay_cascade(current, catalog, train_events, seen, relevant, test_users, user_rows,
+                              dict(zip(known_users.tolist(), top)), k, seed)
+    return {
+        'k': k,
+        'relevant_actions': list(POSITIVE_ACTIONS),
+        'train': {'events': len(train_events), 'users': int((seen.getnnz(axis=1) > 0).sum()),
+                  'products': int((seen.getnnz(axis=0) > 0).sum())},
+        'test': {'events': len(test_events), 'users': len(test_users), 'relevant_pairs': int(relevant.nnz),
+                 'users_in_model': len(known_users)},
+        'catalog': len(catalog),
+        'model': model,
+        'cascade': cascade,
+        'seconds': {'model': round(model_seconds, 3), 'cascade': round(time.perf_counter() - cascade_started, 3)},
+        'evaluated_at': datetime.now().isoformat()
+    }
+
+
+def summary(report):
+    """The headline numbers of a report, as kept in the version metadata"""
+    k = report['k']
+    return {
+        'mode': report['mode'],
+        'cutoff': report['cutoff'],
+        'k': k,
+        'test_users': report['test']['users'],
+        f'recall_at_{k}': report['model'][f'recall_at_{k}'],
+        f'ndcg_at_{k}': report['model'][f'ndcg_at_{k}'],
+        'coverage': report['model']['coverage'],
+        'cascade_hit_rate': report['cascade']['hit_rate'],
+        'seconds': report['seconds'].get('total')
+    }
+
+
+def save_report(report, path):
+    with open(os.path.join(path, EVALUATION_FILE + '.tmp'), 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(os.path.join(path, EVALUATION_FILE + '.tmp'), os.path.join(path, EVALUATION_FILE))
+
+
+def load_report(path):
+    try:
+        with open(os.path.join(path, EVALUATION_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _pairs(events, shape, mask=None, weights=None):
+    """Sparse users x products matrix of the events (1 per pair, or summed ``weights``)"""
+    users, items = events.user_codes, events.item_codes
+    if mask is not None:
+        users, items = users[mask], items[mask]
+    if weights is None:
+        matrix = sparse.csr_matrix((np.ones(len(users), dtype=np.float32), (users, items)), shape=shape)
+        matrix.data[:] = 1
+        return matrix
+    return sparse.csr_matrix((weights, (users, items)), shape=shape)
+
+
+def _rank_known_users(engine, catalog, seen, relevant, n_relevant, users, user_rows, item_rows, product_codes, k,
+                      max_cells):
+    """Top items (as product codes, -1 past the end) and ranking metrics of ``users``"""
+    depth = max(k, ML_CANDIDATES)
+    top = np.full((len(users), depth), -1, dtype=np.int64)
+    hits = np.zeros((len(users), k), dtype=bool)
+    discounts = 1 / np.log2(np.arange(k) + 2)
+    inactive = ~catalog.active_mask
+
+    block_size = max(1, max_cells // max(engine.n_items, relevant.shape[1], 1))
+    for start in range(0, len(users), block_size):
+        block = users[start:start + block_size]
+        scores = engine.score_users(user_rows[block])
+        scores[:, inactive] = -np.inf
+        # Items the user interacted with before are never recommended
+        seen_users, seen_items = seen[block].nonzero()
+        known = item_rows[seen_items] >= 0
+        scores[seen_users[known], item_rows[seen_items[known]]] = -np.inf
+
+        rows = top_k_rows(scores, depth)
+        codes = product_codes[rows]
+        codes[~np.isfinite(np.take_along_axis(scores, rows, axis=1))] = -1
+        top[start:start + len(block), :codes.shape[1]] = codes
+
+        wanted = relevant[block].toarray().astype(bool)
+        first = codes[:, :k]
+        hits[start:start + len(block), :first.shape[1]] = (
+            np.take_along_axis(wanted, np.maximum(first, 0), axis=1) & (first >= 0)
+        )
+
+    counts = n_relevant[users]
+    ideal = np.cumsum(discounts)[np.minimum(counts, k) - 1] if len(users) else np.zeros(0)
+    return top, {
+        'users': len(users),
+        f'recall_at_{k}': _mean(hits.sum(axis=1) / np.maximum(counts, 1)),
+        f'ndcg_at_{k}': _mean((hits * discounts).sum(axis=1) / np.where(ideal > 0, ideal, 1)),
+        f'hit_rate_at_{k}': _mean(hits.any(axis=1))
+    }
+
+
+def _rating_errors(engine, test_events, user_rows, item_rows):
+    """RMSE and MAE of the predicted ratings of the test pairs the model knows"""
+    pair_users, pair_items, pair_ratings = test_events.aggregate(events_watermark(test_events))
+    users, items = user_rows[pair_users], item_rows[pair_items]
+    known = (users >= 0) & (items >= 0)
+    if not known.any():
+        return {'rmse': None, 'mae': None, 'rated_pairs': 0}
+    errors = engine.predict_pairs(users[known], items[known]) - pair_ratings[known]
+    return {
+        'rmse': round(float(np.sqrt(np.mean(errors ** 2))), 6),
+        'mae': round(float(np.mean(np.abs(errors))), 6),
+        'rated_pairs': int(known.sum())
+    }
+
+
+def _replay_cascade(current, catalog, train_events, seen, relevant, users, user_rows, top_by_user, k, seed):
+    """Every test user's list as get_recommendations assembles it, scored per strategy"""
+    product_ids = train_events.product_ids
+    scores = _pairs(train_events, seen.shape, weights=_HISTORY_WEIGHTS[train_events.action_codes])
+    liked = _pairs(train_events, seen.shape, mask=train_events.action_mask(POSITIVE_ACTIONS))
+
+    strategies = {}
+    recommended = set()
+    discounts = 1 / np.log2(np.arange(k) + 2)
+    state = random.getstate()
+    # Exploration slots are shuffled; seeded so that reports are comparable
+    random.seed(seed)
+    try:
+        for user in users.tolist():
+            start, end = scores.indptr[user], scores.indptr[user + 1]
+            product_scores = {product_ids[i]: float(w) for i, w in zip(scores.indices[start:end], scores.data[start:end])}
+            seen_products = set(product_scores)
+
+            ml_recommendations, similar_user_recs = None, None
+            if user_rows[user] >= 0:
+                ml_recommendations = [product_ids[code] for code in top_by_user[user][:ML_CANDIDATES] if code >= 0]
+            else:
+                liked_products = {product_ids[i] for i in liked.indices[liked.indptr[user]:liked.indptr[user + 1]]}
+                similar_user_recs = []
+                if liked_products and current.item_neighbors is not None:
+                    similar_user_recs = current.item_neighbors.recommend(liked_products, seen_products, limit=5)
+
+            recommendations, strategy = assemble_recommendations(
+                current, catalog, seen_products, product_scores,
+                ml_recommendations=ml_recommendations, similar_user_recs=similar_user_recs
+            )
+            recommendations = recommendations[:k]
+            recommended.update(recommendations)
+
+            wanted = {product_ids[i] for i in relevant.indices[relevant.indptr[user]:relevant.indptr[user + 1]]}
+            hits = np.array([pid in wanted for pid in recommendations] + [False] * (k - len(recommendations)))
+            ideal = discounts[:min(len(wanted), k)].sum()
+            totals = strategies.setdefault(strategy, {'users': 0, 'hits': 0, 'recall': 0.0, 'ndcg': 0.0})
+            totals['users'] += 1
+            totals['hits'] += int(hits.any())
+            totals['recall'] += hits.sum() / len(wanted)
+            totals['ndcg'] += (hits * discounts).sum() / ideal
+    finally:
+        random.setstate(state)
+
+    n_users = max(len(users), 1)
+    return {
+        'users': len(users),
+        'hit_rate': _ratio(sum(s['hits'] for s in strategies.values()), len(users)),
+        f'recall_at_{k}': _ratio(sum(s['recall'] for s in strategies.values()), len(users)),
+        f'ndcg_at_{k}': _ratio(sum(s['ndcg'] for s in strategies.values()), len(users)),
+        'coverage': _coverage(recommended, catalog),
+        'strategies': {
+            name: {
+                'users': s['users'],
+                'share': round(s['users'] / n_users, 6),
+                'hit_rate': _ratio(s['hits'], s['users']),
+                f'recall_at_{k}': _ratio(s['recall'], s['users']),
+                f'ndcg_at_{k}': _ratio(s['ndcg'], s['users'])
+            }
+            for name, s in sorted(strategies.items(), key=lambda item: -item[1]['users'])
+        }
+    }
+
+
+def _coverage(recommended, catalog):
+    return round(len(recommended) / len(catalog), 6) if len(catalog) else None
+
+
+def _mean(values):
+    return round(float(np.mean(values)), 6) if len(values) else None
+
+
+def _ratio(total, count):
+    return round(float(total) / count, 6) if count else None
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    from model_store import ModelStore
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Evaluate a model version offline on a time-based holdout')
+    parser.add_argument('--version', help='model version (default: the active one)')
+    parser.add_argument('--holdout-days', type=float, default=EVAL_HOLDOUT_DAYS,
+                        help='hold out the events of the last N days')
+    parser.add_argument('--k', type=int, default=EVAL_K, help='length of the evaluated lists')
+    parser.add_argument('--forward', action='store_true',
+                        help="score the version's own artifacts on the events after its watermark instead")
+    parser.add_argument('--from-snapshots', action='store_true', help='read the events from the Parquet snapshots')
+    parser.add_argument('--compare', action='store_true', help='print the saved report of every version')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    store = ModelStore(os.getenv('MODEL_DIR', 'models'))
+    if args.compare:
+        for version in store.versions():
+            report = load_report(store.path(version))
+            if report is not None:
+                print(f"{version}  {json.dumps(summary(report))}")
+        raise SystemExit(0)
+
+    version = args.version or store.current_version()
+    if version is None:
+        raise SystemExit("No trained model version found")
+
+    from train import connect_to_database
+    db = connect_to_database()
+    if args.from_snapshots:
+        from snapshots import load_snapshot_events
+        events = load_snapshot_events()
+    else:
+        from event_loader import load_events
+        events = load_events(db.events)
+    catalog_ids = [str(p['_id']) for p in db.products.find({}, {'_id': 1})]
+
+    if args.forward:
+        report = evaluate_forward(store.load(version), events, k=args.k, catalog_ids=catalog_ids, seed=args.seed)
+    else:
+        metadata = store.load(version).metadata
+        model_params = dict(metadata.get('model_params', {}))
+        engine_name = model_params.pop('engine', 'svd')
+        params = {name: model_params[name] for name in make_trainer(engine_name).params if name in model_params}
+        cutoff = default_cutoff(events, args.holdout_days)
+        if cutoff is None:
+            raise SystemExit("No dated events to split")
+        report = evaluate_holdout(events, cutoff, engine_name, params, k=args.k, catalog_ids=catalog_ids,
+                                  seed=args.seed)
+    report['version'] = version
+    save_report(report, store.path(version))
+    print(json.dumps(summary(report), indent=2))
+    for name, stats in report['cascade']['strategies'].items():
+        print(f"  {name:<13} {stats['users']:>7} users  hit rate {stats['hit_rate']}")
@@ -0,0 +1,181 @@
+import sys
+from datetime import datetime, timedelta
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Known actions get a small integer code; anything else shares the last code
+ACTIONS = ('view', 'add_to_cart', 'purchase', 'rating')
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+OTHER_ACTION = len(ACTIONS)
+RATING_ACTION = ACTION_CODES['rating']
+
+# Base rating of each action code (the last entry is for unknown actions)
+ACTION_RATINGS = np.array([1.0, 3.5, 5.0, 4.0, 1.0])
+DEFAULT_RATING_VALUE = 3.0
+
+# Interactions from the last RECENCY_DAYS get up to RECENCY_BOOST extra weight
+RECENCY_DAYS = 30
+RECENCY_BOOST = 0.3
+
+MISSING_TIMESTAMP = np.iinfo(np.int64).min
+EVENT_PROJECTION = {'_id': 0, 'userId': 1, 'productId': 1, 'action': 1, 'value': 1, 'createdAt': 1}
+COLUMN_DTYPES = {
+    'user_codes': np.int32,
+    'item_codes': np.int32,
+    'action_codes': np.int8,
+    'values': np.float32,
+    'timestamps': np.int64,
+}
+
+_EPOCH = datetime(1970, 1, 1)
+_ONE_MS = timedelta(milliseconds=1)
+_MS_PER_DAY = 86_400_000
+
+
+class IdCodec:
+    """Assigns dense integer codes to ids in order of first appearance"""
+
+    def __init__(self):
+        self.codes = {}
+        self.ids = []
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.ids)
+            self.ids.append(str(value))
+        return code
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class EventColumns:
+    """Events as compact parallel arrays.
+
+    ``user_codes``/``item_codes`` index into ``user_ids``/``product_ids``,
+    ``timestamps`` are milliseconds since the epoch (MISSING_TIMESTAMP when
+    unknown) and ``values`` is NaN when the event carried no value.
+    """
+
+    def __init__(self, user_codes, item_codes, action_codes, values, timestamps, user_ids, product_ids):
+        self.user_codes = user_codes
+        self.item_codes = item_codes
+        self.action_codes = action_codes
+        self.values = values
+        self.timestamps = timestamps
+        self.user_ids = user_ids
+        self.product_ids = product_ids
+
+    def __len__(self):
+        return len(self.user_codes)
+
+    def subset(self, mask):
+        """The events selected by ``mask``, with the same id lists (and codes)"""
+        return EventColumns(self.user_codes[mask], self.item_codes[mask], self.action_codes[mask], self.values[mask],
+                            self.timestamps[mask], self.user_ids, self.product_ids)
+
+    def action_mask(self, actions):
+        codes = [ACTION_CODES[action] for action in actions if action in ACTION_CODES]
+        return np.isin(self.action_codes, codes)
+
+    def action_weights(self):
+        """Base weight of every event's action, without rating values or recency"""
+        return ACTION_RATINGS[self.action_codes]
+
+    def ratings(self, now=None):
+        """Implicit rating of every event: action weight times recency boost"""
+        ratings = ACTION_RATINGS[self.action_codes]
+
+        # Rating events use the submitted value when there is one
+        rating_events = self.action_codes == RATING_ACTION
+        values = self.values[rating_events].astype(np.float64)
+        ratings[rating_events] = np.where(np.isnan(values), DEFAULT_RATING_VALUE, values)
+
+        now_ms = _to_millis(now or datetime.now())
+        known = self.timestamps != MISSING_TIMESTAMP
+        days_ago = np.zeros(len(self), dtype=np.int64)
+        days_ago[known] = (now_ms - self.timestamps[known]) // _MS_PER_DAY
+        boost = 1 + (RECENCY_DAYS - np.clip(days_ago, 0, RECENCY_DAYS)) / RECENCY_DAYS * RECENCY_BOOST
+        boost[~known] = 1.0
+        return ratings * boost
+
+    def aggregate(self, now=None):
+        """Mean rating per (user, product) pair as (user_codes, item_codes, ratings)"""
+        if len(self) == 0:
+            empty = np.zeros(0, dtype=np.int32)
+            return empty, empty, np.zeros(0, dtype=np.float32)
+
+        n_items = max(len(self.product_ids), 1)
+        keys = self.user_codes.astype(np.int64) * n_items + self.item_codes
+        pair_keys, inverse = np.unique(keys, return_inverse=True)
+        sums = np.bincount(inverse, weights=self.ratings(now))
+        counts = np.bincount(inverse)
+
+        pair_users = (pair_keys // n_items).astype(np.int32)
+        pair_items = (pair_keys % n_items).astype(np.int32)
+        return pair_users, pair_items, (sums / counts).astype(np.float32)
+
+
+def load_events(collection, query=None, batch_size=50000):
+    """Stream events from MongoDB into EventColumns, one batch at a time.
+
+    Only one batch of decoded documents is alive at any moment; everything
+    else is kept as int32/int8/float32/int64 columns. Events without a userId
+    or productId (anonymous views, searches) are skipped.
+    """
+    users, products = IdCodec(), IdCodec()
+    chunks = {name: [] for name in COLUMN_DTYPES}
+    cursor = collection.find(query or {}, EVENT_PROJECTION, batch_size=batch_size)
+
+    while True:
+        batch = list(islice(cursor, batch_size))
+        if not batch:
+            break
+        batch = [e for e in batch if e.get('userId') is not None and e.get('productId') is not None]
+
+        columns = {
+            'user_codes': _encode_all(users, [e['userId'] for e in batch]),
+            'item_codes': _encode_all(products, [e['productId'] for e in batch]),
+            'action_codes': [ACTION_CODES.get(e.get('action'), OTHER_ACTION) for e in batch],
+            # None becomes NaN in the float column
+            'values': [e.get('value') for e in batch],
+            # Missing dates become NaT, which is the same int64 as MISSING_TIMESTAMP
+            'timestamps': pd.to_datetime([e.get('createdAt') for e in batch]).as_unit('ms').asi8,
+        }
+        for name, dtype in COLUMN_DTYPES.items():
+            chunks[name].append(np.asarray(columns[name], dtype=dtype))
+
+    columns = {
+        name: np.concatenate(parts) if parts else np.zeros(0, dtype=COLUMN_DTYPES[name])
+        for name, parts in chunks.items()
+    }
+    return EventColumns(user_ids=users.ids, product_ids=products.ids, **columns)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def _encode_all(codec, values):
+    lookup = codec.codes.get
+    codes = [lookup(value) for value in values]
+    return [codec.encode(value) if code is None else code for code, value in zip(codes, values)]
+
+
+def _to_millis(moment):
+    if moment.tzinfo is not None:
+        moment = moment.replace(tzinfo=None) - moment.utcoffset()
+    return (moment - _EPOCH) // _ONE_MS
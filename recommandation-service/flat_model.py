@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from id_registry import IdRegistry
+from scoring import ScoringEngine
+
+# Directory (inside a model version) holding the flat factor artifact
+FLAT_MODEL_DIR = 'svd_factors'
+MANIFEST_FILE = 'manifest.json'
+FORMAT_NAME = 'svd-factors'
+FORMAT_VERSION = 2
+# Version 1 stored the id tables as unicode arrays; it is still readable
+READABLE_VERSIONS = (1, 2)
+ARRAY_NAMES = ('pu', 'qi', 'bu', 'bi', 'user_ids', 'item_ids', 'user_order', 'item_order')
+# Id table -> the array that sorts it, saved only when the table is not
+# already in id order (see IdRegistry)
+ID_TABLES = {'user_ids': 'user_order', 'item_ids': 'item_order'}
+
+
+def save_flat_model(engine, path):
+    """Write the engine as plain .npy files plus a JSON manifest.
+
+    Factors and biases are stored as float64 so scores match the pickled
+    Surprise model exactly; ids are the engine's IdRegistry tables (12-byte
+    ObjectIds, plus their sort order if codes do not follow it). The manifest is written last, so a
+    directory without one is never loaded.
+    """
+    os.makedirs(path, exist_ok=True)
+    arrays = {
+        'pu': np.ascontiguousarray(engine.pu, dtype=np.float64),
+        'qi': np.ascontiguousarray(engine.qi, dtype=np.float64),
+        'bu': np.ascontiguousarray(engine.bu, dtype=np.float64),
+        'bi': np.ascontiguousarray(engine.bi, dtype=np.float64),
+        'user_ids': np.ascontiguousarray(engine.user_ids.ids),
+        'item_ids': np.ascontiguousarray(engine.item_ids.ids),
+    }
+    for name, order in ID_TABLES.items():
+        if getattr(engine, name).order is not None:
+            arrays[order] = np.ascontiguousarray(getattr(engine, name).order, dtype=np.int32)
+
+    files = {}
+    for name, array in arrays.items():
+        file_name = f'{name}.npy'
+        np.save(os.path.join(path, file_name), array)
+        files[name] = {
+            'file': file_name,
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'sha256': _sha256(os.path.join(path, file_name))
+        }
+
+    manifest = {
+        'format': FORMAT_NAME,
+        'format_version': FORMAT_VERSION,
+        'n_users': len(engine.user_ids),
+        'n_items': len(engine.item_ids),
+        'n_factors': int(arrays['pu'].shape[1]),
+        'global_mean': engine.global_mean,
+        'rating_scale': list(engine.rating_scale),
+        'id_kinds': {'user_ids': engine.user_ids.kind, 'item_ids': engine.item_ids.kind},
+        'files': files
+    }
+    with open(os.path.join(path, MANIFEST_FILE + '.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(path, MANIFEST_FILE + '.tmp'), os.path.join(path, MANIFEST_FILE))
+    return manifest
+
+
+def has_flat_model(path):
+    return os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+
+def load_flat_model(path, verify=False):
+    """Open a flat artifact as a ScoringEngine backed by read-only memory maps.
+
+    Pages are shared through the OS page cache, so every worker process that
+    opens the same files uses one copy of the factors and id tables. Shapes
+    and dtypes are
+    always checked against the manifest; ``verify`` also re-hashes each file,
+    which reads it fully and is meant for offline checks.
+    """
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    version = manifest.get('format_version')
+    if manifest.get('format') != FORMAT_NAME or version not in READABLE_VERSIONS:
+        raise ValueError(f"Unsupported model format {manifest.get('format')} v{version}")
+
+    arrays = {}
+    for name in ARRAY_NAMES:
+        entry = manifest['files'].get(name)
+        if entry is None and name in ID_TABLES.values():
+            continue
+        file_path = os.path.join(path, entry['file'])
+        if verify and _sha256(file_path) != entry['sha256']:
+            raise ValueError(f"Checksum mismatch for {entry['file']}")
+        # Version 1 id tables are unicode and re-encoded, so read them normally
+        array = np.load(file_path, mmap_mode=None if version == 1 and name in ID_TABLES else 'r')
+        if array.dtype.str != entry['dtype'] or list(array.shape) != entry['shape']:
+            raise ValueError(f"{entry['file']} does not match the manifest")
+        arrays[name] = array
+
+    registries = {}
+    for name, order in ID_TABLES.items():
+        if version == 1:
+            registries[name] = IdRegistry.of(arrays[name].tolist())
+        else:
+            registries[name] = IdRegistry(arrays[name], manifest['id_kinds'][name], arrays.get(order))
+
+    return ScoringEngine(
+        pu=arrays['pu'],
+        qi=arrays['qi'],
+        bu=arrays['bu'],
+        bi=arrays['bi'],
+        global_mean=manifest['global_mean'],
+        user_ids=registries['user_ids'],
+        item_ids=registries['item_ids'],
+        rating_scale=tuple(manifest['rating_scale'])
+    )
+
+
+def _sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
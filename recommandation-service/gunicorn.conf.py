@@ -0,0 +1,41 @@
+"""Production serving: ``gunicorn -c gunicorn.conf.py`` (see prefork.py)"""
+import os
+
+import prefork
+
+# app.py checks this at import to defer threads and connections until after the fork
+os.environ["PREFORK_SERVING"] = "true"
+
+wsgi_app = "app:app"
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+# Old workers finish in-flight requests for this long after a model reload
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+# Load the model once in the master; workers inherit it copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    prefork.master_ready(server)
+
+
+def pre_fork(server, worker):
+    prefork.before_fork()
+
+
+def post_fork(server, worker):
+    prefork.worker_started(worker)
+
+
+def worker_exit(server, worker):
+    prefork.worker_exited(worker)
+
+
+def on_reload(server):
+    prefork.reload_model(server)
+
+
+def on_exit(server):
+    prefork.master_exiting(server)
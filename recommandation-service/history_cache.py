@@ -0,0 +1,208 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Engagement weight of each action in a user's history
+ACTION_WEIGHTS = {'purchase': 10, 'add_to_cart': 5, 'rating': 4, 'view': 1}
+# Actions that count as "liked" for collaborative filtering
+POSITIVE_ACTIONS = ('purchase', 'add_to_cart')
+
+
+class UserHistory:
+    """Compact interaction history of one user"""
+
+    __slots__ = ('seen_products', 'product_scores', 'liked_products')
+
+    def __init__(self, product_scores, liked_products):
+        self.product_scores = product_scores
+        self.seen_products = frozenset(product_scores)
+        self.liked_products = frozenset(liked_products)
+
+    @classmethod
+    def from_events(cls, events):
+        product_scores = {}
+        liked_products = set()
+        for event in events:
+            product_id = str(event['productId'])
+            action = event.get('action')
+            product_scores[product_id] = product_scores.get(product_id, 0) + ACTION_WEIGHTS.get(action, 1)
+            if action in POSITIVE_ACTIONS:
+                liked_products.add(product_id)
+        return cls(product_scores, liked_products)
+
+    @classmethod
+    def from_interactions(cls, interactions):
+        """Same history from pre-aggregated user_item_interactions documents"""
+        product_scores = {}
+        liked_products = set()
+        for doc in interactions:
+            product_id = str(doc['productId'])
+            product_scores[product_id] = doc.get('score', 0)
+            counts = doc.get('counts') or {}
+            if any(counts.get(action) for action in POSITIVE_ACTIONS):
+                liked_products.add(product_id)
+        return cls(product_scores, liked_products)
+
+
+class HistoryCache:
+    """Bounded LRU cache of UserHistory entries with a time-to-live.
+
+    Entries are dropped when they expire, when the cache is full (least
+    recently used first) or when ``invalidate`` is called because new events
+    arrived for the user.
+    """
+
+    def __init__(self, loader, max_size=10000, ttl=300):
+        self.loader = loader
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # user_id -> [invalidation generation, loads in progress], kept while
+        # the user's history is being loaded
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, user_id):
+        user_id = str(user_id)
+        now = time.monotonic()
+        history, generation = self._lookup(user_id, now)
+        if history is not None:
+            return history
+
+        try:
+            history = self.loader(user_id)
+        except Exception:
+            self._abandon(user_id)
+            raise
+        return self._store(user_id, history, now, generation)
+
+    async def get_async(self, user_id, loader):
+        """Like ``get``, awaiting ``loader(user_id)`` on a miss (asyncio serving)"""
+        user_id = str(user_id)
+        now = time.monotonic()
+        history, generation = self._lookup(user_id, now)
+        if history is not None:
+            return history
+
+        try:
+            history = await loader(user_id)
+        except BaseException:
+            self._abandon(user_id)
+            raise
+        return self._store(user_id, history, now, generation)
+
+    def get_many(self, user_ids, loader):
+        """Histories of several users; ``loader(missing_ids)`` reads all misses at once.
+
+        ``loader`` returns a dict of user id -> UserHistory; users it leaves
+        out have no events.
+        """
+        now = time.monotonic()
+        histories = {}
+        missing = {}
+        for user_id in dict.fromkeys(str(uid) for uid in user_ids):
+            history, generation = self._lookup(user_id, now)
+            if history is None:
+                missing[user_id] = generation
+            else:
+                histories[user_id] = history
+        if not missing:
+            return histories
+
+        try:
+            loaded = loader(list(missing))
+        except Exception:
+            for user_id in missing:
+                self._abandon(user_id)
+            raise
+        for user_id, generation in missing.items():
+            histories[user_id] = self._store(user_id, loaded.get(user_id) or UserHistory({}, []), now, generation)
+        return histories
+
+    def _lookup(self, user_id, now):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                history, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return history, None
+                del self._entries[user_id]
+                self.expirations += 1
+            self.misses += 1
+            loading = self._loading.setdefault(user_id, [0, 0])
+            loading[1] += 1
+            return None, loading[0]
+
+    def _abandon(self, user_id):
+        with self._lock:
+            self._finish_load(user_id)
+
+    def _finish_load(self, user_id):
+        """Generation of the user's history now; forgotten after its last load"""
+        loading = self._loading[user_id]
+        loading[1] -= 1
+        if not loading[1]:
+            del self._loading[user_id]
+        return loading[0]
+
+    def _store(self, user_id, history, now, generation):
+        with self._lock:
+            if self._finish_load(user_id) != generation:
+                # New events arrived mid-load; serve this result but don't keep it
+                return history
+            self._entries[user_id] = (history, now + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return history
+
+    def invalidate(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            if user_id in self._loading:
+                self._loading[user_id][0] += 1
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+                return True
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+
+def watch_events(collection, on_user_event, stop_event=None):
+    """Call ``on_user_event(user_id)`` for every event inserted from now on.
+
+    Runs until the change stream fails (e.g. on a standalone server, where
+    change streams are unavailable) or ``stop_event`` is set.
+    """
+    pipeline = [{'$match': {'operationType': 'insert', 'fullDocument.userId': {'$exists': True}}}]
+    with collection.watch(pipeline, max_await_time_ms=1000) as stream:
+        while stream.alive and not (stop_event and stop_event.is_set()):
+            change = stream.try_next()
+            if change is not None:
+                on_user_event(str(change['fullDocument']['userId']))
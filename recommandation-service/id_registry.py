@@ -0,0 +1,178 @@
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+from bson import ObjectId
+
+OBJECT_ID = 'objectid'
+UTF8 = 'utf-8'
+
+
+class IdRegistry(Sequence):
+    """Dense int32 codes for a fixed list of string ids, without Python objects per id.
+
+    ``ids`` holds every id as fixed-width bytes in code order: the 12 raw
+    bytes of an ObjectId when all ids are 24-character hex strings, UTF-8
+    otherwise. Finding an id's code is a binary search. Training assigns
+    codes in sorted id order, so the table is its own search index; when ids
+    were appended afterwards (incremental updates) ``order`` sorts it and a
+    sorted copy is kept for the search. The arrays can be memory maps, so
+    the id tables of a model version are shared by every process that
+    serves it.
+
+    Behaves like the list of ids (``registry[code]``, ``len``, iteration);
+    ``index`` is the matching read-only {id: code} mapping.
+    """
+
+    def __init__(self, ids, kind, order=None):
+        self.ids = ids
+        self.kind = kind
+        if order is None and not _is_sorted(ids):
+            order = np.argsort(ids, kind='stable').astype(np.int32)
+        # None when codes already follow the id order
+        self.order = order
+        self._sorted = ids if order is None else ids[order]
+        self.index = _CodeLookup(self)
+
+    @classmethod
+    def of(cls, ids):
+        """Registry of ``ids`` in the given order (an IdRegistry is returned as is)"""
+        if isinstance(ids, IdRegistry):
+            return ids
+        ids = [str(value) for value in ids]
+        encoded = _encode_object_ids(ids)
+        if encoded is not None:
+            return cls(encoded, OBJECT_ID)
+        encoded = [value.encode('utf-8') for value in ids]
+        width = max((len(value) for value in encoded), default=1)
+        return cls(np.array(encoded, dtype=f'S{max(width, 1)}'), UTF8)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, code):
+        if isinstance(code, slice):
+            return [self._decode(value) for value in self.ids[code]]
+        return self._decode(self.ids[code])
+
+    def __iter__(self):
+        for value in self.ids:
+            yield self._decode(value)
+
+    def __contains__(self, value):
+        return self.code(value) >= 0
+
+    def __eq__(self, other):
+        if isinstance(other, IdRegistry):
+            return self.kind == other.kind and np.array_equal(self.ids, other.ids)
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and list(self) == [str(value) for value in other]
+        return NotImplemented
+
+    __hash__ = None
+
+    def __add__(self, other):
+        return self.extended(other)
+
+    def code(self, value):
+        """Code of one id, or -1 if it is not registered"""
+        key = _encode(str(value), self.kind)
+        if key is None or len(key) > self.ids.dtype.itemsize or len(self.ids) == 0:
+            return -1
+        position = int(np.searchsorted(self._sorted, key))
+        if position == len(self.ids) or self._sorted[position] != key.rstrip(b'\0'):
+            return -1
+        return position if self.order is None else int(self.order[position])
+
+    def codes(self, values):
+        """Codes of many ids at once, -1 for unregistered ones"""
+        codes = np.full(len(values), -1, dtype=np.int64)
+        if len(values) == 0 or len(self.ids) == 0:
+            return codes
+        values = [str(value) for value in values]
+        keys = _encode_object_ids(values) if self.kind == OBJECT_ID else None
+        if keys is not None:
+            valid = np.ones(len(values), dtype=bool)
+        else:
+            keys = [_encode(value, self.kind) for value in values]
+            valid = np.array([key is not None and len(key) <= self.ids.dtype.itemsize for key in keys])
+            if not valid.any():
+                return codes
+            keys = np.array([key for key, ok in zip(keys, valid) if ok], dtype=self.ids.dtype)
+        positions = np.minimum(np.searchsorted(self._sorted, keys), len(self.ids) - 1)
+        found = self._sorted[positions] == keys
+        rows = np.flatnonzero(valid)
+        codes[rows[found]] = positions[found] if self.order is None else self.order[positions[found]]
+        return codes
+
+    def extended(self, ids):
+        """New registry with ``ids`` appended after the existing codes"""
+        ids = [str(value) for value in ids]
+        if not ids:
+            return self
+        encoded = _encode_object_ids(ids) if self.kind == OBJECT_ID else None
+        if encoded is not None:
+            return IdRegistry(np.concatenate([self.ids, encoded]), OBJECT_ID)
+        return IdRegistry.of(list(self) + ids)
+
+    def tolist(self):
+        return list(self)
+
+    def _decode(self, value):
+        if self.kind == OBJECT_ID:
+            # Fixed-width bytes drop trailing zero bytes when read back
+            return value.ljust(12, b'\0').hex()
+        return value.decode('utf-8')
+
+
+class _CodeLookup(Mapping):
+    """{id: code} view of an IdRegistry"""
+
+    def __init__(self, registry):
+        self._registry = registry
+
+    def __getitem__(self, value):
+        code = self._registry.code(value)
+        if code < 0:
+            raise KeyError(value)
+        return code
+
+    def __contains__(self, value):
+        return self._registry.code(value) >= 0
+
+    def __iter__(self):
+        return iter(self._registry)
+
+    def __len__(self):
+        return len(self._registry)
+
+
+def _is_object_id(value):
+    # Lowercase only, so decoding gives back the exact string
+    return len(value) == 24 and ObjectId.is_valid(value) and value == value.lower()
+
+
+def _encode_object_ids(ids):
+    """All ids as one S12 array, or None unless every one is a lowercase ObjectId"""
+    if any(len(value) != 24 for value in ids):
+        return None
+    joined = ''.join(ids)
+    if joined != joined.lower():
+        return None
+    try:
+        raw = bytes.fromhex(joined)
+    except ValueError:
+        return None
+    # fromhex skips whitespace, so a short result means some id was not hex
+    if len(raw) != 12 * len(ids):
+        return None
+    return np.frombuffer(raw, dtype='S12').copy()
+
+
+def _is_sorted(ids):
+    return len(ids) < 2 or bool(np.all(ids[1:] >= ids[:-1]))
+
+
+def _encode(value, kind):
+    if kind == OBJECT_ID:
+        return bytes.fromhex(value) if _is_object_id(value) else None
+    return value.encode('utf-8')
@@ -0,0 +1,178 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from event_loader import MISSING_TIMESTAMP
+from scoring import ScoringEngine
+
+# Defaults matching the SVD settings train.py uses for full retrains
+DEFAULT_LR = 0.005
+DEFAULT_REG = 0.02
+DEFAULT_EPOCHS = 3
+
+
+def fold_in(engine, events, lr=DEFAULT_LR, reg=DEFAULT_REG, n_epochs=DEFAULT_EPOCHS, now=None):
+    """Fold new events into a trained model without retraining it.
+
+    New users get factors from a ridge least-squares fit against the fixed item
+    factors, then new items get theirs against the (now complete) user
+    factors. A few SGD passes over only the new user-product pairs adjust
+    the users involved and the new items. Factors and biases of existing
+    items stay fixed, so the top-K table rows of other users and the ANN
+    index remain valid. Returns a new ScoringEngine and a summary dict; the
+    input engine is left untouched so it can keep serving requests.
+    """
+    pair_users, pair_items, ratings = events.aggregate(now=now)
+
+    # Engine rows of the events' users and products; unknown ones are
+    # appended to the registries, in order of first appearance
+    user_rows = engine.user_ids.codes(events.user_ids)
+    item_rows = engine.item_ids.codes(events.product_ids)
+    new_users = [events.user_ids[code] for code in np.unique(pair_users) if user_rows[code] < 0]
+    new_items = [events.product_ids[code] for code in np.unique(pair_items) if item_rows[code] < 0]
+    user_registry = engine.user_ids.extended(new_users)
+    item_registry = engine.item_ids.extended(new_items)
+
+    n_factors = engine.pu.shape[1]
+    pu = np.vstack([engine.pu, np.zeros((len(new_users), n_factors))])
+    qi = np.vstack([engine.qi, np.zeros((len(new_items), n_factors))])
+    bu = np.concatenate([engine.bu, np.zeros(len(new_users))])
+    bi = np.concatenate([engine.bi, np.zeros(len(new_items))])
+
+    if new_users:
+        user_rows = user_registry.codes(events.user_ids)
+    if new_items:
+        item_rows = item_registry.codes(events.product_ids)
+    users = user_rows[pair_users]
+    items = item_rows[pair_items]
+    ratings = ratings.astype(np.float64)
+    mu = engine.global_mean
+
+    # New users against items that already have factors
+    known_items = np.flatnonzero(items < len(engine.item_ids))
+    for row, pairs in _group_rows(users[known_items], first_row=len(engine.user_ids)):
+        pairs = known_items[pairs]
+        pu[row], bu[row] = _solve(qi[items[pairs]], ratings[pairs] - mu - bi[items[pairs]], reg)
+
+    # New items against every user, including the ones just folded in
+    for row, pairs in _group_rows(items, first_row=len(engine.item_ids)):
+        qi[row], bi[row] = _solve(pu[users[pairs]], ratings[pairs] - mu - bu[users[pairs]], reg)
+
+    # A few SGD passes (Surprise's update rule) over the new pairs only;
+    # existing items are frozen
+    n_known_items = len(engine.item_ids)
+    for _ in range(n_epochs):
+        for u, i, r in zip(users, items, ratings):
+            err = r - (mu + bu[u] + bi[i] + qi[i] @ pu[u])
+            bu[u] += lr * (err - reg * bu[u])
+            pu_u = pu[u].copy()
+            pu[u] += lr * (err * qi[i] - reg * pu[u])
+            if i >= n_known_items:
+                bi[i] += lr * (err - reg * bi[i])
+                qi[i] += lr * (err * pu_u - reg * qi[i])
+
+    updated = ScoringEngine(
+        pu=pu, qi=qi, bu=bu, bi=bi,
+        global_mean=mu,
+        user_ids=user_registry,
+        item_ids=item_registry,
+        rating_scale=engine.rating_scale
+    )
+    summary = {
+        'events': len(events),
+        'pairs': len(ratings),
+        'new_users': len(new_users),
+        'new_items': len(new_items),
+        'events_watermark': events_watermark(events)
+    }
+    return updated, summary
+
+
+def fold_in_options(model_params):
+    """fold_in keyword arguments matching how the model was trained.
+
+    ALS models take only the ridge solves, with their own penalty: their
+    ``reg_all`` is per solve rather than the per-rating weight of SGD.
+    """
+    if model_params.get('engine') == 'als':
+        return {'reg': model_params.get('reg_all', DEFAULT_REG), 'n_epochs': 0}
+    return {'lr': model_params.get('lr_all', DEFAULT_LR), 'reg': model_params.get('reg_all', DEFAULT_REG)}
+
+
+def events_watermark(events):
+    """Latest createdAt among the events, as a naive UTC datetime"""
+    timestamps = events.timestamps[events.timestamps != MISSING_TIMESTAMP]
+    if len(timestamps) == 0:
+        return None
+    return datetime(1970, 1, 1) + timedelta(milliseconds=int(timestamps.max()))
+
+
+def metadata_watermark(metadata):
+    """Where incremental updates should resume reading events from"""
+    watermark = metadata.get('events_watermark')
+    if watermark is None:
+        # Written in UTC with an offset; naive values predate that and are local
+        trained_at = datetime.fromisoformat(metadata['trained_at'])
+        watermark = trained_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return watermark
+
+
+def apply_to_surprise(algo, engine):
+    """Write folded-in factors back into a Surprise SVD so it can be pickled.
+
+    Existing rows are overwritten; new users and items are registered in the
+    trainset's raw-to-inner maps and given (empty) ``ur``/``ir`` entries so
+    ``knows_user``/``knows_item`` accept them in ``predict``.
+    """
+    trainset = algo.trainset
+    user_rows = [_inner_id(trainset._raw2inner_id_users, trainset, 'users', uid) for uid in engine.user_ids]
+    item_rows = [_inner_id(trainset._raw2inner_id_items, trainset, 'items', pid) for pid in engine.item_ids]
+
+    algo.pu = _scatter(algo.pu, user_rows, engine.pu)
+    algo.qi = _scatter(algo.qi, item_rows, engine.qi)
+    algo.bu = _scatter(algo.bu, user_rows, engine.bu)
+    algo.bi = _scatter(algo.bi, item_rows, engine.bi)
+
+    for u in user_rows:
+        trainset.ur.setdefault(u, [])
+    for i in item_rows:
+        trainset.ir.setdefault(i, [])
+
+    trainset._inner2raw_id_users = None
+    trainset._inner2raw_id_items = None
+    return algo
+
+
+def _inner_id(raw2inner, trainset, kind, raw_id):
+    inner = raw2inner.get(raw_id)
+    if inner is None:
+        inner = raw2inner[raw_id] = len(raw2inner)
+        setattr(trainset, f'n_{kind}', len(raw2inner))
+    return inner
+
+
+def _scatter(current, rows, values):
+    size = max(len(current), max(rows, default=-1) + 1)
+    out = np.zeros((size,) + np.shape(current)[1:])
+    out[:len(current)] = current
+    out[rows] = values
+    return out
+
+
+def _group_rows(rows, first_row):
+    """Yield (row, positions in ``rows``) for every row id >= first_row"""
+    positions = np.flatnonzero(rows >= first_row)
+    if len(positions) == 0:
+        return
+    positions = positions[np.argsort(rows[positions], kind='stable')]
+    boundaries = np.flatnonzero(np.diff(rows[positions])) + 1
+    for group in np.split(positions, boundaries):
+        yield rows[group[0]], group
+
+
+def _solve(features, targets, reg):
+    """Ridge fit of targets ~ features @ w + b, returning (w, b)"""
+    augmented = np.hstack([features, np.ones((len(features), 1))])
+    gram = augmented.T @ augmented + reg * np.eye(augmented.shape[1])
+    solution = np.linalg.solve(gram, augmented.T @ targets)
+    return solution[:-1], solution[-1]
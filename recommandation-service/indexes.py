@@ -0,0 +1,200 @@
+"""Indexes behind the service's hot queries, and a check of how those queries run
+
+    python indexes.py            # create missing indexes, then explain every hot query
+    python indexes.py --dry-run  # only report missing indexes and the current plans
+
+The service runs ``provision`` in a background thread at startup and shows
+the report under "indexes" in /api/status. Compound indexes also serve their
+prefixes, so {userId, action, productId} answers plain {userId} lookups and
+{productId, action, userId} answers {productId} ones.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo import ASCENDING
+
+from cooccurrence import _liked_products_pipeline, _similar_users_pipeline
+from event_loader import EVENT_PROJECTION
+from interactions import INTERACTIONS_COLLECTION, PAIR_INDEX
+
+REQUIRED_INDEXES = [
+    # Per-user histories and the liked-products stage of the collaborative
+    # fallback; both are answered from the index alone
+    {'collection': 'events', 'name': 'userId_1_action_1_productId_1',
+     'keys': [('userId', ASCENDING), ('action', ASCENDING), ('productId', ASCENDING)]},
+    # Similar users: the productId $in match grouped by userId
+    {'collection': 'events', 'name': 'productId_1_action_1_userId_1',
+     'keys': [('productId', ASCENDING), ('action', ASCENDING), ('userId', ASCENDING)]},
+    # Watermark reads of the incremental update and popularity refresh
+    {'collection': 'events', 'name': 'createdAt_1', 'keys': [('createdAt', ASCENDING)]},
+    # Catalog polling for changed products
+    {'collection': 'products', 'name': 'updatedAt_1', 'keys': [('updatedAt', ASCENDING)]},
+    {'collection': INTERACTIONS_COLLECTION, 'name': 'userId_1_productId_1', 'keys': PAIR_INDEX,
+     'options': {'unique': True}},
+]
+
+# Plan stages that read an index, and those that read no documents at all
+INDEX_STAGES = {'IXSCAN', 'DISTINCT_SCAN', 'COUNT_SCAN', 'IDHACK', 'EXPRESS_IXSCAN'}
+EMPTY_STAGES = {'EOF'}
+
+
+def hot_queries():
+    """The query shapes served per request or per refresh, with the plan each should get.
+
+    Values are placeholders; only the shape matters to the planner.
+    """
+    user_id, product_ids = ObjectId(), [str(ObjectId()) for _ in range(3)]
+    user_ids = [str(ObjectId()) for _ in range(3)]
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    history_projection = {'_id': 0, 'userId': 1, 'productId': 1, 'action': 1}
+    return [
+        {'name': 'user_history', 'collection': 'events', 'expect': 'covered',
+         'filter': {'userId': user_id}, 'projection': history_projection},
+        {'name': 'user_histories', 'collection': 'events', 'expect': 'covered',
+         'filter': {'userId': {'$in': [ObjectId(uid) for uid in user_ids]}}, 'projection': history_projection},
+        {'name': 'similar_users', 'collection': 'events', 'expect': 'covered',
+         'pipeline': _similar_users_pipeline(str(user_id), product_ids)},
+        {'name': 'liked_products', 'collection': 'events', 'expect': 'covered',
+         'pipeline': _liked_products_pipeline(user_ids, 5)},
+        {'name': 'new_events', 'collection': 'events', 'expect': 'index',
+         'filter': {'createdAt': {'$gt': now}}, 'projection': EVENT_PROJECTION},
+        {'name': 'changed_products', 'collection': 'products', 'expect': 'index',
+         'filter': {'updatedAt': {'$gt': now}}, 'projection': {'_id': 1, 'updatedAt': 1}},
+        {'name': 'interaction_history', 'collection': INTERACTIONS_COLLECTION, 'expect': 'index',
+         'filter': {'userId': user_id}, 'projection': {'_id': 0, 'productId': 1, 'score': 1, 'counts': 1}},
+    ]
+
+
+def ensure_required_indexes(db, create=True):
+    """Create the REQUIRED_INDEXES that are missing.
+
+    An index with the same keys under another name counts as present.
+    ``create=False`` only reports what is missing.
+    """
+    report = {'present': [], 'created': [], 'missing': [], 'errors': {}}
+    for spec in REQUIRED_INDEXES:
+        collection = db[spec['collection']]
+        label = f"{spec['collection']}.{spec['name']}"
+        try:
+            existing = {_key_of(info['key']) for info in collection.index_information().values()}
+            if _key_of(spec['keys']) in existing:
+                report['present'].append(label)
+            elif create:
+                # background is honoured by servers before 4.2; newer ones build
+                # without holding the collection lock for the whole build
+                collection.create_index(spec['keys'], name=spec['name'], background=True, **spec.get('options', {}))
+                report['created'].append(label)
+            else:
+                report['missing'].append(label)
+        except Exception as e:
+            report['errors'][label] = str(e)
+    return report
+
+
+def advise(db):
+    """Explain every hot query and classify its winning plan"""
+    queries = {}
+    for query in hot_queries():
+        try:
+            summary = plan_summary(_explain(db[query['collection']], query))
+        except Exception as e:
+            summary = {'plan': 'error', 'stages': [], 'indexes': [], 'error': str(e)}
+        summary['collection'] = query['collection']
+        summary['expected'] = query['expect']
+        summary['ok'] = summary['plan'] in ('covered', 'empty') or summary['plan'] == query['expect']
+        queries[query['name']] = summary
+    return {
+        'queries': queries,
+        'collection_scans': [name for name, summary in queries.items() if summary['plan'] == 'collscan'],
+        'checked_at': datetime.now().isoformat()
+    }
+
+
+def provision(db, create=True):
+    """``ensure_required_indexes`` followed by ``advise``, as one report"""
+    report = {'indexes': ensure_required_indexes(db, create=create)}
+    report.update(advise(db))
+    return report
+
+
+def plan_summary(explain):
+    """{'plan': covered|index|collscan|empty|unknown, 'stages', 'indexes'} of an explain() result.
+
+    Works for find and aggregate explains, classic and slot-based engines.
+    """
+    stages, indexes = [], []
+    for plan in _values_of(explain, 'winningPlan'):
+        for node in _nodes(plan):
+            if isinstance(node.get('stage'), str):
+                stages.append(node['stage'])
+            if isinstance(node.get('indexName'), str) and node['indexName'] not in indexes:
+                indexes.append(node['indexName'])
+
+    if 'COLLSCAN' in stages:
+        plan = 'collscan'
+    elif INDEX_STAGES.intersection(stages):
+        # EXPRESS_IXSCAN and IDHACK fetch the documents themselves
+        fetches = 'FETCH' in stages or {'EXPRESS_IXSCAN', 'IDHACK'}.intersection(stages)
+        plan = 'index' if fetches else 'covered'
+    elif stages and EMPTY_STAGES.issuperset(stages):
+        plan = 'empty'
+    else:
+        plan = 'unknown'
+    return {'plan': plan, 'stages': stages, 'indexes': indexes}
+
+
+def _explain(collection, query):
+    if 'pipeline' in query:
+        return collection.database.command('aggregate', collection.name, pipeline=query['pipeline'], explain=True)
+    return collection.find(query['filter'], query['projection']).explain()
+
+
+def _key_of(keys):
+    return tuple((field, int(direction) if isinstance(direction, (int, float)) else direction)
+                 for field, direction in keys)
+
+
+def _values_of(document, key):
+    """Every value stored under ``key`` anywhere in a nested explain document"""
+    for node in _nodes(document):
+        if key in node:
+            yield node[key]
+
+
+def _nodes(document):
+    """Every dict nested in ``document``, itself included"""
+    pending = [document]
+    while pending:
+        node = pending.pop(0)
+        if isinstance(node, dict):
+            yield node
+            pending.extend(node.values())
+        elif isinstance(node, list):
+            pending.extend(node)
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Create the indexes the service needs and check its query plans')
+    parser.add_argument('--dry-run', action='store_true', help='report missing indexes without creating them')
+    args = parser.parse_args()
+
+    db = MongoClient(os.getenv('MONGO_URI'))['E-commerce']
+    report = provision(db, create=not args.dry_run)
+    for label in report['indexes']['created']:
+        print(f"created   {label}")
+    for label in report['indexes']['missing']:
+        print(f"missing   {label}")
+    for label, error in report['indexes']['errors'].items():
+        print(f"error     {label}: {error}")
+    for name, summary in report['queries'].items():
+        indexes = ', '.join(summary['indexes']) or '-'
+        print(f"{'ok' if summary['ok'] else 'CHECK':9} {name}: {summary['plan']} via {indexes}"
+              f" (expected {summary['expected']})")
+    sys.exit(1 if report['collection_scans'] or report['indexes']['missing'] else 0)
@@ -0,0 +1,433 @@
+"""Pre-aggregated user-item interactions: one document per (user, product) pair
+
+    python interactions.py backfill            # build from the events collection
+    python interactions.py check --sample 500  # compare against events (--repair fixes)
+
+Each document holds the pair's engagement ``score`` (history weights),
+``ratingTotal`` (sum of the implicit ratings training averages), ``counts``
+per action, the number of ``events`` and ``firstSeen``/``lastSeen``. The
+service keeps it current from POST /api/events/ingest with bulk upserts, so
+histories and training read one document per pair instead of every event.
+
+Backfill and repair run alongside ingest. They only count events older than
+SETTLE_SECONDS, which ingest has already applied, and never overwrite what
+ingest added since: see ``_reconcile``.
+"""
+import argparse
+import math
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+import numpy as np
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+
+from event_loader import (ACTION_RATINGS, ACTIONS, DEFAULT_RATING_VALUE, MISSING_TIMESTAMP, OTHER_ACTION,
+                          RECENCY_BOOST, RECENCY_DAYS, IdCodec, _to_millis)
+from history_cache import ACTION_WEIGHTS
+
+INTERACTIONS_COLLECTION = 'user_item_interactions'
+# Counters kept per pair; actions outside ACTIONS are counted as "other"
+COUNT_FIELDS = ACTIONS + ('other',)
+# Pairs written per bulk_write call
+WRITE_BATCH_SIZE = 1000
+# Fields compared by the consistency check
+CHECKED_FIELDS = ('events', 'score', 'ratingTotal', 'counts', 'firstSeen', 'lastSeen')
+# One document per pair, and a prefix for per-user history reads
+PAIR_INDEX = [('userId', ASCENDING), ('productId', ASCENDING)]
+# Events younger than this may not have reached POST /api/events/ingest yet;
+# backfill and check leave them to it
+SETTLE_SECONDS = 300
+
+_MS_PER_DAY = 86_400_000
+
+
+class InteractionColumns:
+    """Interaction documents as compact per-pair arrays, shaped for train.py.
+
+    ``user_codes``/``item_codes`` index ``user_ids``/``product_ids``;
+    ``timestamps`` hold each pair's lastSeen. ``len()`` is the number of
+    events the pairs summarise, as with EventColumns.
+    """
+
+    def __init__(self, user_codes, item_codes, counts, rating_totals, timestamps, user_ids, product_ids):
+        self.user_codes = user_codes
+        self.item_codes = item_codes
+        self.counts = counts
+        self.rating_totals = rating_totals
+        self.timestamps = timestamps
+        self.user_ids = user_ids
+        self.product_ids = product_ids
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def action_mask(self, actions):
+        """Pairs with at least one of ``actions``"""
+        columns = [COUNT_FIELDS.index(action) for action in actions if action in COUNT_FIELDS]
+        return self.counts[:, columns].sum(axis=1) > 0
+
+    def action_weights(self):
+        """Base action weight of every pair's events, summed"""
+        return self.counts @ ACTION_RATINGS
+
+    def aggregate(self, now=None):
+        """(user_codes, item_codes, ratings) like EventColumns.aggregate.
+
+        The rating is the pair's mean implicit rating with the recency boost
+        of its last interaction; EventColumns boosts every event by its own
+        age, so the two agree unless a pair's events span several days of
+        the last RECENCY_DAYS.
+        """
+        events = self.counts.sum(axis=1)
+        ratings = self.rating_totals / np.maximum(events, 1)
+
+        now_ms = _to_millis(now or datetime.now())
+        known = self.timestamps != MISSING_TIMESTAMP
+        days_ago = np.zeros(len(ratings), dtype=np.int64)
+        days_ago[known] = (now_ms - self.timestamps[known]) // _MS_PER_DAY
+        boost = 1 + (RECENCY_DAYS - np.clip(days_ago, 0, RECENCY_DAYS)) / RECENCY_DAYS * RECENCY_BOOST
+        boost[~known] = 1.0
+        return self.user_codes, self.item_codes, (ratings * boost).astype(np.float32)
+
+
+def ensure_indexes(collection):
+    """The unique pair index that upserts rely on"""
+    collection.create_index(PAIR_INDEX, unique=True)
+
+
+def apply_events(collection, events, batch_size=WRITE_BATCH_SIZE):
+    """Fold raw events (dicts shaped like the events collection) into the pair documents.
+
+    Events of the same pair are merged first, so each pair costs one upsert.
+    Events without a valid userId or productId, or with a rating value that
+    is not a number, are skipped and counted as ``rejected``.
+    """
+    pairs = {}
+    rejected = 0
+    for event in events:
+        user_id, product_id = _object_id(event.get('userId')), _object_id(event.get('productId'))
+        action = event.get('action')
+        rating = _rating(action, event.get('value'))
+        if user_id is None or product_id is None or rating is None:
+            rejected += 1
+            continue
+        field = action if action in ACTIONS else 'other'
+        created_at = _timestamp(event.get('createdAt'))
+
+        pair = pairs.setdefault((user_id, product_id), {'inc': {}, 'first': created_at, 'last': created_at})
+        inc = pair['inc']
+        for name, amount in (('events', 1), ('score', ACTION_WEIGHTS.get(action, 1)),
+                             ('ratingTotal', rating), (f'counts.{field}', 1)):
+            inc[name] = inc.get(name, 0) + amount
+        pair['first'] = min(pair['first'], created_at)
+        pair['last'] = max(pair['last'], created_at)
+
+    operations = [
+        UpdateOne(
+            {'userId': user_id, 'productId': product_id},
+            {'$inc': pair['inc'], '$min': {'firstSeen': pair['first']}, '$max': {'lastSeen': pair['last']}},
+            upsert=True
+        )
+        for (user_id, product_id), pair in pairs.items()
+    ]
+    _write(collection, operations, batch_size)
+    return {'events': sum(pair['inc']['events'] for pair in pairs.values()), 'pairs': len(pairs),
+            'users': len({user_id for user_id, _ in pairs}), 'rejected': rejected}
+
+
+def backfill(events_collection, collection, batch_size=WRITE_BATCH_SIZE, settle_seconds=SETTLE_SECONDS, now=None):
+    """Build every pair document from the events collection.
+
+    Grouping runs on the server; each pair is then reconciled with its
+    stored document, so the command can be re-run safely while ingest keeps
+    writing. Pairs that no longer have events are reported by ``check`` and
+    removed by its repair.
+    """
+    ensure_indexes(collection)
+    cutoff = _cutoff(settle_seconds, now)
+    report = {'pairs': 0, 'written': 0, 'active': 0}
+    cursor = events_collection.aggregate(_pairs_pipeline(cutoff=cutoff), allowDiskUse=True)
+    while True:
+        expected = {(doc['userId'], doc['productId']): doc for doc in map(_from_group, islice(cursor, batch_size))}
+        if not expected:
+            break
+        stored = {
+            (doc['userId'], doc['productId']): doc
+            for doc in collection.find({
+                'userId': {'$in': list({user_id for user_id, _ in expected})},
+                'productId': {'$in': list({product_id for _, product_id in expected})}
+            }, {'_id': 0})
+        }
+        found, operations, _ = _reconcile(expected, {key: stored[key] for key in expected if key in stored}, cutoff)
+        _write(collection, operations, batch_size)
+        report['pairs'] += len(expected)
+        report['written'] += len(operations)
+        report['active'] += len(found['active'])
+    return report
+
+
+def check(events_collection, collection, user_ids=None, sample=1000, repair=False, settle_seconds=SETTLE_SECONDS,
+          now=None):
+    """Compare the pair documents of some users against their raw events.
+
+    ``user_ids`` defaults to ``sample`` random users from the events. With
+    ``repair`` the documents of every inconsistent pair are fixed from the
+    events, unless ingest changes them in the meantime. Pairs with events on
+    both sides of the settle cutoff can't be checked and are counted as
+    ``active``; a later run covers them.
+    """
+    if user_ids is None:
+        users = events_collection.aggregate([
+            {'$match': {'userId': {'$ne': None}}},
+            {'$group': {'_id': '$userId'}},
+            {'$sample': {'size': sample}}
+        ])
+        user_ids = [doc['_id'] for doc in users]
+    user_ids = [oid for oid in map(_object_id, user_ids) if oid is not None]
+
+    cutoff = _cutoff(settle_seconds, now)
+    expected = {
+        (doc['userId'], doc['productId']): doc
+        for doc in map(_from_group, events_collection.aggregate(_pairs_pipeline(user_ids, cutoff)))
+    }
+    stored = {
+        (doc['userId'], doc['productId']): doc
+        for doc in collection.find({'userId': {'$in': user_ids}}, {'_id': 0})
+    }
+
+    found, operations, deletions = _reconcile(expected, stored, cutoff)
+    inconsistent = found['missing'] + found['extra'] + found['mismatched']
+    report = {
+        'users': len(user_ids),
+        'pairs': len(expected),
+        'missing': len(found['missing']),
+        'extra': len(found['extra']),
+        'mismatched': len(found['mismatched']),
+        'active': len(found['active']),
+        'consistent': not inconsistent,
+        'examples': [{'userId': str(u), 'productId': str(p)} for u, p in inconsistent[:10]]
+    }
+    if repair:
+        _write(collection, operations, WRITE_BATCH_SIZE)
+        for query in deletions:
+            collection.delete_one(query)
+        report['repaired'] = len(operations) + len(deletions)
+    return report
+
+
+def load_interactions(collection, batch_size=50000):
+    """Stream every pair document into InteractionColumns"""
+    users, products = IdCodec(), IdCodec()
+    user_codes, item_codes, counts, rating_totals, timestamps = [], [], [], [], []
+    projection = {'_id': 0, 'userId': 1, 'productId': 1, 'counts': 1, 'ratingTotal': 1, 'lastSeen': 1}
+    for doc in collection.find({}, projection, batch_size=batch_size):
+        user_codes.append(users.encode(doc['userId']))
+        item_codes.append(products.encode(doc['productId']))
+        doc_counts = doc.get('counts') or {}
+        counts.append([doc_counts.get(field, 0) for field in COUNT_FIELDS])
+        rating_totals.append(doc.get('ratingTotal', 0.0))
+        last_seen = doc.get('lastSeen')
+        timestamps.append(MISSING_TIMESTAMP if last_seen is None else _to_millis(last_seen))
+
+    return InteractionColumns(
+        user_codes=np.array(user_codes, dtype=np.int32),
+        item_codes=np.array(item_codes, dtype=np.int32),
+        counts=np.array(counts, dtype=np.int64).reshape(-1, len(COUNT_FIELDS)),
+        rating_totals=np.array(rating_totals, dtype=np.float64),
+        timestamps=np.array(timestamps, dtype=np.int64),
+        user_ids=users.ids,
+        product_ids=products.ids
+    )
+
+
+def _reconcile(expected, stored, cutoff):
+    """Compare stored pair documents with their events up to ``cutoff`` and plan the fixes.
+
+    Ingest only ever adds to a document, and by the cutoff it has seen
+    every older event. A document whose events all came after the cutoff
+    (or no document) is missing the older ones: their counts are added to
+    it, as ingest would. A document with only older events is replaced or
+    deleted, on condition that ingest has not changed it since it was read.
+    One with events on both sides can't be split and is left alone.
+    Returns ({missing, extra, mismatched, active: [keys]}, operations,
+    deletion filters).
+    """
+    found = {'missing': [], 'extra': [], 'mismatched': [], 'active': []}
+    operations, deletions = [], []
+    for key in sorted(expected.keys() | stored.keys()):
+        want, have = expected.get(key), stored.get(key)
+        if have is None or _after(have.get('firstSeen'), cutoff):
+            if want is not None:
+                found['missing'].append(key)
+                operations.append(_merge(want, have, cutoff))
+        elif _after(have.get('lastSeen'), cutoff):
+            found['active'].append(key)
+        elif want is None:
+            found['extra'].append(key)
+            deletions.append(_unchanged(have))
+        elif not _same(want, have):
+            found['mismatched'].append(key)
+            operations.append(ReplaceOne(_unchanged(have), want))
+    return found, operations, deletions
+
+
+def _merge(doc, stored, cutoff):
+    """Add a pair's counts to its document, creating it if ``stored`` is None"""
+    query = {'userId': doc['userId'], 'productId': doc['productId']}
+    if stored is not None:
+        # Not twice, should another run merge first
+        query['firstSeen'] = {'$gt': cutoff}
+    inc = {name: doc[name] for name in ('events', 'score', 'ratingTotal')}
+    inc.update((f'counts.{field}', count) for field, count in doc['counts'].items() if count)
+    return UpdateOne(query, {'$inc': inc, '$min': {'firstSeen': doc['firstSeen']},
+                             '$max': {'lastSeen': doc['lastSeen']}}, upsert=stored is None)
+
+
+def _unchanged(stored):
+    """Filter matching a pair document only while ingest has not updated it"""
+    return {'userId': stored['userId'], 'productId': stored['productId'], 'events': stored.get('events'),
+            'lastSeen': stored.get('lastSeen')}
+
+
+def _after(timestamp, cutoff):
+    return timestamp is not None and timestamp > cutoff
+
+
+def _cutoff(settle_seconds, now=None):
+    return (now or datetime.now(timezone.utc).replace(tzinfo=None)) - timedelta(seconds=settle_seconds)
+
+
+def _pairs_pipeline(user_ids=None, cutoff=None):
+    match = {'userId': {'$ne': None}, 'productId': {'$ne': None}}
+    if user_ids is not None:
+        match['userId'] = {'$in': user_ids}
+    if cutoff is not None:
+        match['$or'] = [{'createdAt': {'$lte': cutoff}}, {'createdAt': None}]
+    group = {
+        '_id': {'userId': '$userId', 'productId': '$productId'},
+        'events': {'$sum': 1},
+        'score': {'$sum': _by_action({a: w for a, w in ACTION_WEIGHTS.items()}, 1)},
+        'ratingTotal': {'$sum': _by_action(
+            dict(zip(ACTIONS, ACTION_RATINGS.tolist()), rating={'$ifNull': ['$value', DEFAULT_RATING_VALUE]}),
+            float(ACTION_RATINGS[OTHER_ACTION])
+        )},
+        'firstSeen': {'$min': '$createdAt'},
+        'lastSeen': {'$max': '$createdAt'}
+    }
+    for field in ACTIONS:
+        group[field] = {'$sum': {'$cond': [{'$eq': ['$action', field]}, 1, 0]}}
+    group['other'] = {'$sum': {'$cond': [{'$in': ['$action', list(ACTIONS)]}, 0, 1]}}
+    return [{'$match': match}, {'$group': group}]
+
+
+def _by_action(values, default):
+    """Aggregation expression picking ``values[$action]``, else ``default``"""
+    expression = default
+    for action, value in values.items():
+        expression = {'$cond': [{'$eq': ['$action', action]}, value, expression]}
+    return expression
+
+
+def _from_group(doc):
+    return {
+        'userId': doc['_id']['userId'],
+        'productId': doc['_id']['productId'],
+        'events': doc['events'],
+        'score': doc['score'],
+        'ratingTotal': float(doc['ratingTotal']),
+        'counts': {field: doc[field] for field in COUNT_FIELDS},
+        'firstSeen': doc['firstSeen'],
+        'lastSeen': doc['lastSeen']
+    }
+
+
+def _same(expected, stored):
+    for field in CHECKED_FIELDS:
+        a, b = expected.get(field), stored.get(field)
+        if field == 'counts':
+            b = {name: (b or {}).get(name, 0) for name in COUNT_FIELDS}
+        if isinstance(a, float) or isinstance(b, float):
+            if a is None or b is None or not math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6):
+                return False
+        elif isinstance(a, datetime) and isinstance(b, datetime):
+            # MongoDB keeps milliseconds
+            if abs(_to_millis(a) - _to_millis(b)) > 1:
+                return False
+        elif a != b:
+            return False
+    return True
+
+
+def _rating(action, value):
+    """Implicit rating of one event; None for a rating value that is not a number"""
+    if action == 'rating':
+        if value is None:
+            return DEFAULT_RATING_VALUE
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None
+        return value if math.isfinite(value) else None
+    return float(ACTION_RATINGS[ACTIONS.index(action) if action in ACTIONS else OTHER_ACTION])
+
+
+def _object_id(value):
+    if isinstance(value, ObjectId):
+        return value
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def _timestamp(value):
+    """createdAt from a stored event or a JSON payload, as naive UTC"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            value = None
+    if not isinstance(value, datetime):
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _write(collection, operations, batch_size):
+    for start in range(0, len(operations), batch_size):
+        collection.bulk_write(operations[start:start + batch_size], ordered=False)
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        description='Maintain the user_item_interactions collection',
+        epilog='Both commands can run while the service ingests events: they only count events older than '
+               '--settle-seconds and never overwrite what ingest added since'
+    )
+    parser.add_argument('--settle-seconds', type=float, default=SETTLE_SECONDS,
+                        help='leave events younger than this to ingest (longest ingest delay)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('backfill', help='build every pair document from the events collection')
+    check_parser = commands.add_parser('check', help='compare a sample of users against their raw events')
+    check_parser.add_argument('--sample', type=int, default=1000, help='random users to check')
+    check_parser.add_argument('--user', action='append', help='check this user id (repeatable)')
+    check_parser.add_argument('--repair', action='store_true', help='rewrite inconsistent pairs from the events')
+    args = parser.parse_args()
+
+    db = MongoClient(os.getenv('MONGO_URI'))['E-commerce']
+    if args.command == 'backfill':
+        print(backfill(db.events, db[INTERACTIONS_COLLECTION], settle_seconds=args.settle_seconds))
+    else:
+        report = check(db.events, db[INTERACTIONS_COLLECTION], user_ids=args.user, sample=args.sample,
+                       repair=args.repair, settle_seconds=args.settle_seconds)
+        print(report)
+        sys.exit(0 if report['consistent'] or args.repair else 1)
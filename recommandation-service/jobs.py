@@ -0,0 +1,241 @@
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+# Under the store's jobs directory: id of the last job started, and the lock
+# held by the process running a trainer
+ACTIVE_FILE = 'active'
+LOCK_FILE = 'retrain.lock'
+# How long submit waits for a job started by another process to be recorded
+SUBMIT_WAIT_SECONDS = 2.0
+
+
+class RetrainJob:
+    """Progress and timings of one background training run"""
+
+    def __init__(self, job_id, version, command, pid=None):
+        self.id = job_id
+        self.version = version
+        self.command = command
+        # Process running the trainer
+        self.pid = pid or os.getpid()
+        self.status = 'queued'
+        self.error = None
+        self.returncode = None
+        self.created_at = datetime.now(timezone.utc)
+        self.started_at = None
+        self.finished_at = None
+        self.timings = {}
+
+    @property
+    def finished(self):
+        return self.status in ('succeeded', 'failed')
+
+    def to_dict(self):
+        elapsed_since = self.started_at or self.created_at
+        elapsed_until = self.finished_at or datetime.now(timezone.utc)
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "version": self.version,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "elapsed_seconds": round((elapsed_until - elapsed_since).total_seconds(), 3),
+            "timings": self.timings,
+            "returncode": self.returncode,
+            "error": self.error
+        }
+
+    def to_record(self):
+        return dict(self.to_dict(), command=self.command, pid=self.pid)
+
+    @classmethod
+    def from_record(cls, record):
+        job = cls(record['job_id'], record['version'], record['command'], pid=record['pid'])
+        job.status = record['status']
+        job.error = record['error']
+        job.returncode = record['returncode']
+        job.timings = record['timings']
+        job.created_at = _parse(record['created_at'])
+        job.started_at = _parse(record['started_at'])
+        job.finished_at = _parse(record['finished_at'])
+        return job
+
+
+class RetrainJobManager:
+    """Runs train.py in a child process, one job at a time.
+
+    ``submit`` returns immediately. Each job trains into a new version
+    directory of ``store``; when the process succeeds, ``on_success(version)``
+    loads and activates it. Only one job runs at once: submitting while a job
+    is in flight returns that job instead of starting another trainer.
+
+    Jobs are recorded as JSON files in ``store.jobs_dir()`` and the running
+    trainer holds an exclusive lock file there, so every process serving the
+    store (the workers of a pre-fork server) sees the same jobs and shares
+    the one-at-a-time rule. The lock is released by the OS if that process
+    dies; its unfinished job is then reported as failed.
+    """
+
+    def __init__(self, store, on_success, timeout=300, max_jobs=20, script='train.py'):
+        self.store = store
+        self.on_success = on_success
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self.script = script
+        self.directory = store.jobs_dir()
+        # Jobs run by this process, kept current by their threads
+        self._jobs = {}
+        # Reentrant: submit looks up the running job while holding it
+        self._lock = threading.RLock()
+
+    def submit(self):
+        """Start a training job, or return the running one. Returns (job, created)"""
+        deadline = time.monotonic() + SUBMIT_WAIT_SECONDS
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            while True:
+                lock = open(os.path.join(self.directory, LOCK_FILE), 'a')
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    lock.close()
+                # Another trainer holds the lock; it records its job right after taking it
+                running = self.active()
+                if running is not None and not running.finished:
+                    return running, False
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Retraining already in progress in another process")
+                time.sleep(0.05)
+
+            try:
+                version = self.store.create_version()
+                command = [sys.executable, self.script, '--output-dir', self.store.path(version)]
+                job = RetrainJob(uuid.uuid4().hex, version, command)
+                self._jobs[job.id] = job
+                self._save(job)
+                _write_atomic(os.path.join(self.directory, ACTIVE_FILE), job.id)
+                self._prune()
+            except BaseException:
+                lock.close()
+                raise
+
+        threading.Thread(target=self._run, args=(job, lock), name=f'retrain-{job.id[:8]}', daemon=True).start()
+        return job, True
+
+    def get(self, job_id):
+        """The job with ``job_id``, whichever process started it (None if unknown)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+
+        try:
+            with open(self._path(job_id)) as f:
+                job = RetrainJob.from_record(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+        if not job.finished and not _alive(job.pid):
+            if job.status == 'activating' and self.store.current_version() == job.version:
+                # The worker was replaced by the reload its own activation asked for
+                job.status = 'succeeded'
+            else:
+                job.status = 'failed'
+                job.error = job.error or "The process running the job exited"
+        return job
+
+    def active(self):
+        """The last job started by any process, or None"""
+        try:
+            with open(os.path.join(self.directory, ACTIVE_FILE)) as f:
+                job_id = f.read().strip()
+        except OSError:
+            return None
+        return self.get(job_id) if job_id else None
+
+    def _run(self, job, lock):
+        job.status = 'training'
+        job.started_at = datetime.now(timezone.utc)
+        self._save(job)
+        started = time.perf_counter()
+        try:
+            result = subprocess.run(job.command, capture_output=True, text=True, timeout=self.timeout)
+            job.timings['train_seconds'] = round(time.perf_counter() - started, 3)
+            job.returncode = result.returncode
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.strip() or "Unknown training error")
+
+            job.status = 'activating'
+            self._save(job)
+            activate_started = time.perf_counter()
+            self.on_success(job.version)
+            job.timings['activate_seconds'] = round(time.perf_counter() - activate_started, 3)
+            job.status = 'succeeded'
+        except subprocess.TimeoutExpired:
+            self._fail(job, f"Training timed out after {self.timeout} seconds")
+        except Exception as e:
+            self._fail(job, str(e))
+        finally:
+            job.timings['total_seconds'] = round(time.perf_counter() - started, 3)
+            job.finished_at = datetime.now(timezone.utc)
+            try:
+                self._save(job)
+            finally:
+                lock.close()
+
+    def _fail(self, job, error):
+        job.error = error
+        job.status = 'failed'
+        # A failed run must never be picked up as the newest version
+        shutil.rmtree(self.store.path(job.version), ignore_errors=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f'{os.path.basename(job_id)}.json')
+
+    def _save(self, job):
+        _write_atomic(self._path(job.id), json.dumps(job.to_record()))
+
+    def _prune(self):
+        """Keep the records of the newest ``max_jobs`` jobs"""
+        records = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith('.json')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in records[:-self.max_jobs] if self.max_jobs > 0 else records:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+            self._jobs.pop(entry.name[:-len('.json')], None)
+
+
+def _write_atomic(path, text):
+    with open(path + '.tmp', 'w') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
+
+
+def _parse(value):
+    if not value:
+        return None
+    # Records written before the switch to UTC hold naive local times
+    return datetime.fromisoformat(value).astimezone(timezone.utc)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,229 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+# Latency buckets in seconds, from sub-millisecond lookups to slow fallbacks
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Counter:
+    """Monotonic counter, one value per label combination"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one set of buckets per label combination"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    samples.append((self.name + '_bucket', key + (('le', _format_bound(bound)),), cumulative))
+                samples.append((self.name + '_sum', key, total))
+                samples.append((self.name + '_count', key, cumulative))
+        return samples
+
+
+class Gauge:
+    """Point-in-time values read from a callback when metrics are scraped.
+
+    ``callback`` returns a list of (labels dict, value) pairs.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, callback):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+
+    def samples(self):
+        return [(self.name, tuple(sorted(labels.items())), value) for labels, value in self.callback()]
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, callback):
+        return self.register(Gauge(name, help_text, callback))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTrace:
+    """Stage timings and Mongo round trips of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.mongo_round_trips = 0
+        # Filled in by the handler, used as metric labels
+        self.strategy = 'error'
+        self.model_version = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+class RequestTracer:
+    """Per-stage timing of the recommendation hot path.
+
+    ``stage(name)`` feeds the stage histogram and, while a trace is active
+    in the current context (thread or asyncio task), the trace itself. It is
+    also a pymongo command listener: every command sent from a traced
+    context counts as one round trip.
+    """
+
+    def __init__(self, registry):
+        self.stage_seconds = registry.histogram(
+            'recommendation_stage_seconds',
+            'Time spent in each stage of a recommendation request',
+            ('stage',)
+        )
+        self.mongo_commands = registry.counter(
+            'recommendation_mongo_commands_total',
+            'MongoDB commands sent by the recommendation service',
+            ('command',)
+        )
+        self._trace = ContextVar('request_trace', default=None)
+        self.listener = _CommandListener(self)
+
+    def current(self):
+        return self._trace.get()
+
+    @contextmanager
+    def trace(self):
+        trace = RequestTrace()
+        token = self._trace.set(trace)
+        try:
+            yield trace
+        finally:
+            self._trace.reset(token)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.stage_seconds.observe(seconds, stage=name)
+            trace = self.current()
+            if trace is not None:
+                trace.stages[name] = trace.stages.get(name, 0.0) + seconds
+
+    def _command_started(self, command_name):
+        self.mongo_commands.inc(command=command_name)
+        trace = self.current()
+        if trace is not None:
+            trace.mongo_round_trips += 1
+
+
+class _CommandListener(monitoring.CommandListener):
+    # pymongo publishes started events from the thread or task that sends the command
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    def started(self, event):
+        self.tracer._command_started(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _label_key(labelnames, labels):
+    return tuple((name, str(labels.get(name, ''))) for name in labelnames)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def _format_value(value):
+    if isinstance(value, bool) or not isinstance(value, float):
+        return str(int(value))
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
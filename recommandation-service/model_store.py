@@ -0,0 +1,207 @@
+import os
+import shutil
+from datetime import datetime
+
+import joblib
+
+from ann_index import ANN_INDEX_FILE, load_ann_index
+from cooccurrence import ITEM_NEIGHBORS_FILE, load_item_neighbors
+from flat_model import FLAT_MODEL_DIR, has_flat_model, load_flat_model
+from incremental import metadata_watermark
+from popularity import POPULARITY_FILE, load_popularity
+from scoring import ScoringEngine
+from topk_table import TOPK_TABLE_FILE, load_topk_table
+
+MODEL_FILE = 'recommendation_model.joblib'
+METADATA_FILE = 'model_metadata.joblib'
+POPULAR_PRODUCTS_FILE = 'popular_products.joblib'
+# A version directory is usable once all of these have been written, plus
+# either the flat factor artifact or the pickled Surprise model
+REQUIRED_FILES = (METADATA_FILE, POPULAR_PRODUCTS_FILE)
+# Pointer to the active version, so rollbacks survive a restart
+CURRENT_FILE = 'CURRENT'
+# Models trained before versioned directories were introduced
+LEGACY_VERSION = 'legacy'
+# Retraining job records, shared by every process serving the store
+JOBS_DIR = '.jobs'
+
+
+class ModelBundle:
+    """One trained model version and everything derived from it.
+
+    Requests take a single reference to the active bundle and read all model
+    state through it, so a retrain or rollback (one reference assignment)
+    never exposes a mix of old and new state. Bundles are not modified after
+    construction; ``with_engine`` returns a new one.
+
+    ``model`` is the unpickled Surprise SVD, and is only loaded when the
+    version has no flat factor artifact; requests only ever use ``engine``.
+    ``popularity`` is the exception: the PopularityIndex keeps absorbing new
+    events while the bundle serves, and is carried over by ``with_engine``.
+    """
+
+    def __init__(self, model, metadata, popular_products, engine, ann_index=None, item_neighbors=None,
+                 topk_table=None, version=None, events_watermark=None, last_incremental_update=None,
+                 popularity=None):
+        self.model = model
+        self.metadata = metadata
+        self.popular_products = popular_products
+        self.engine = engine
+        self.ann_index = ann_index
+        self.item_neighbors = item_neighbors
+        self.topk_table = topk_table
+        self.version = version
+        self.events_watermark = events_watermark
+        self.last_incremental_update = last_incremental_update
+        self.popularity = popularity
+
+    @classmethod
+    def empty(cls):
+        """Placeholder served until a model has been trained"""
+        return cls(None, None, [], None)
+
+    @classmethod
+    def load(cls, path, version=None):
+        metadata = joblib.load(os.path.join(path, METADATA_FILE))
+        popular_products = joblib.load(os.path.join(path, POPULAR_PRODUCTS_FILE))
+        if has_flat_model(os.path.join(path, FLAT_MODEL_DIR)):
+            model = None
+            engine = load_flat_model(os.path.join(path, FLAT_MODEL_DIR))
+        else:
+            # Versions trained before the flat format existed
+            model = joblib.load(os.path.join(path, MODEL_FILE))
+            engine = ScoringEngine.from_surprise(model, metadata['product_ids'], metadata['user_ids'])
+        return cls(
+            model, metadata, popular_products, engine,
+            ann_index=load_ann_index(engine, os.path.join(path, ANN_INDEX_FILE)),
+            item_neighbors=load_item_neighbors(os.path.join(path, ITEM_NEIGHBORS_FILE)),
+            topk_table=load_topk_table(engine, os.path.join(path, TOPK_TABLE_FILE)),
+            version=version,
+            events_watermark=metadata_watermark(metadata),
+            popularity=load_popularity(os.path.join(path, POPULARITY_FILE))
+        )
+
+    @property
+    def loaded(self):
+        return self.engine is not None
+
+    @property
+    def product_ids(self):
+        return self.engine.item_ids if self.engine is not None else []
+
+    @property
+    def user_ids(self):
+        return self.engine.user_ids if self.engine is not None else []
+
+    def with_engine(self, engine, events_watermark, last_incremental_update, changed_users=()):
+        """Copy of this bundle serving an incrementally updated engine.
+
+        Precomputed top-K rows of ``changed_users`` no longer match their
+        factors, so those users are scored online from now on.
+        """
+        topk_table = self.topk_table
+        if topk_table is not None:
+            rows = engine.user_ids.codes(list(changed_users))
+            topk_table = topk_table.excluding(rows[rows >= 0].tolist())
+        return ModelBundle(
+            self.model, self.metadata, self.popular_products, engine,
+            ann_index=self.ann_index,
+            item_neighbors=self.item_neighbors,
+            topk_table=topk_table,
+            version=self.version,
+            events_watermark=events_watermark,
+            last_incremental_update=last_incremental_update,
+            popularity=self.popularity
+        )
+
+
+class ModelStore:
+    """Versioned model artifacts under ``root/<version>/``.
+
+    Every training run writes into a fresh version directory; the ``CURRENT``
+    file names the version being served. Older versions are kept (up to
+    ``keep``) so a bad model can be rolled back.
+    """
+
+    def __init__(self, root='models', keep=5):
+        self.root = root
+        self.keep = keep
+
+    def path(self, version):
+        if version == LEGACY_VERSION:
+            return '.'
+        return os.path.join(self.root, version)
+
+    def jobs_dir(self):
+        return os.path.join(self.root, JOBS_DIR)
+
+    def create_version(self):
+        """Make an empty directory for a new training run and return its version"""
+        os.makedirs(self.root, exist_ok=True)
+        version = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        os.makedirs(self.path(version))
+        return version
+
+    def is_complete(self, version):
+        path = self.path(version)
+        if not all(os.path.exists(os.path.join(path, name)) for name in REQUIRED_FILES):
+            return False
+        return has_flat_model(os.path.join(path, FLAT_MODEL_DIR)) or os.path.exists(os.path.join(path, MODEL_FILE))
+
+    def versions(self):
+        """Complete versions, oldest first"""
+        if not os.path.isdir(self.root):
+            versions = []
+        else:
+            versions = sorted(
+                name for name in os.listdir(self.root)
+                if os.path.isdir(os.path.join(self.root, name)) and self.is_complete(name)
+            )
+        if not versions and self.is_complete(LEGACY_VERSION):
+            versions = [LEGACY_VERSION]
+        return versions
+
+    def current_version(self):
+        """The active version, or the newest complete one if none was activated"""
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE)) as f:
+                version = f.read().strip()
+            if self.is_complete(version):
+                return version
+        except FileNotFoundError:
+            pass
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def previous_version(self, version):
+        """The newest complete version older than ``version``"""
+        older = [v for v in self.versions() if v < version]
+        return older[-1] if older else None
+
+    def activate(self, version):
+        """Record ``version`` as the one to serve, then drop the oldest extras"""
+        os.makedirs(self.root, exist_ok=True)
+        pointer = os.path.join(self.root, CURRENT_FILE)
+        with open(pointer + '.tmp', 'w') as f:
+            f.write(version)
+        os.replace(pointer + '.tmp', pointer)
+        self.prune(keep_versions=(version,))
+
+    def prune(self, keep_versions=()):
+        """Remove all but the newest ``keep`` versions (never ``keep_versions``)"""
+        if not os.path.isdir(self.root):
+            return
+        versions = sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isdir(os.path.join(self.root, name)) and name != JOBS_DIR
+        )
+        for version in versions[:-self.keep] if self.keep > 0 else versions:
+            if version not in keep_versions:
+                shutil.rmtree(os.path.join(self.root, version), ignore_errors=True)
+
+    def load(self, version=None):
+        """Load ``version`` (default: the active one) as a ModelBundle"""
+        version = version or self.current_version()
+        if version is None:
+            raise FileNotFoundError(f"No trained model found in {self.root}")
+        return ModelBundle.load(self.path(version), version=version)
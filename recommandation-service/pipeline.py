@@ -0,0 +1,194 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from profiling import run_profiled
+
+# Why a source contributed no candidates to a response
+SKIPPED = 'skipped'
+TIMED_OUT = 'timed_out'
+FAILED = 'failed'
+
+
+class Deadline:
+    """Time budget of one request; ``seconds=0`` means no budget"""
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds if seconds > 0 else None
+
+    def remaining(self):
+        """Seconds left (0 once passed), or None without a budget"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def remaining_ms(self):
+        """Milliseconds left as a MongoDB ``maxTimeMS`` (at least 1), or None"""
+        remaining = self.remaining()
+        return None if remaining is None else max(1, int(remaining * 1000))
+
+
+class CandidateRequest:
+    """What the candidate sources of one recommendation request read"""
+
+    __slots__ = ('current', 'catalog', 'user_id', 'history', 'deadline')
+
+    def __init__(self, current, catalog, user_id, history, deadline):
+        self.current = current
+        self.catalog = catalog
+        self.user_id = user_id
+        self.history = history
+        self.deadline = deadline
+
+
+class Source:
+    """One candidate source of the recommendation cascade.
+
+    ``fetch(request)`` returns product ids, best first. Only sources for which
+    ``applies(request)`` holds run. Expensive ones run on the worker pool
+    and are shed under load; the others run inline.
+    """
+
+    def __init__(self, name, fetch, applies=None, expensive=None):
+        self.name = name
+        self.fetch = fetch
+        self.applies = applies or (lambda request: True)
+        self.expensive = expensive or (lambda request: False)
+
+
+class CandidatePipeline:
+    """Runs the sources of a request concurrently, keeping what arrives by its deadline.
+
+    Late sources are dropped rather than waited for. A dropped call still
+    holds its pool thread until it returns, so it stays pending; once
+    ``max_pending`` calls are, expensive sources are skipped (load shedding)
+    until the pool drains again.
+    """
+
+    def __init__(self, sources, workers=8, max_pending=0):
+        self.sources = list(sources)
+        self.workers = workers
+        self.max_pending = max_pending or workers
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='candidate-source')
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.shed_requests = 0
+        self.outcomes = {source.name: dict.fromkeys(('ok', SKIPPED, TIMED_OUT, FAILED), 0) for source in self.sources}
+
+    def run(self, request):
+        """``(candidates, dropped)``: {source: product ids} of the sources that
+        answered in time and {source: reason} of the others"""
+        concurrent, inline, dropped = self._plan(request)
+        futures = {self._submit(source.fetch, request): source.name for source in concurrent}
+        candidates = self._run_inline(inline, request, dropped)
+
+        if futures:
+            done, late = wait(futures, timeout=request.deadline.remaining())
+            for future in done:
+                try:
+                    candidates[futures[future]] = future.result()
+                except Exception:
+                    dropped[futures[future]] = FAILED
+            for future in late:
+                future.cancel()
+                dropped[futures[future]] = TIMED_OUT
+        self._record(candidates, dropped)
+        return candidates, dropped
+
+    async def run_async(self, request, async_fetchers=None):
+        """``run`` for asyncio serving.
+
+        ``async_fetchers`` maps source names to replacements of their fetch
+        returning awaitables (e.g. reading through an async MongoDB client);
+        they run as tasks, which are cancelled when late.
+        """
+        async_fetchers = async_fetchers or {}
+        concurrent, inline, dropped = self._plan(request, async_fetchers)
+
+        tasks = {}
+        for source in concurrent:
+            if source.name in async_fetchers:
+                task = asyncio.ensure_future(async_fetchers[source.name](request))
+                self._track(task)
+            else:
+                task = asyncio.wrap_future(self._submit(source.fetch, request))
+            tasks[task] = source.name
+        candidates = self._run_inline(inline, request, dropped)
+
+        if tasks:
+            done, late = await asyncio.wait(tasks, timeout=request.deadline.remaining())
+            for task in done:
+                if task.exception() is None:
+                    candidates[tasks[task]] = task.result()
+                else:
+                    dropped[tasks[task]] = FAILED
+            for task in late:
+                task.cancel()
+                dropped[tasks[task]] = TIMED_OUT
+        self._record(candidates, dropped)
+        return candidates, dropped
+
+    def _plan(self, request, tasks=()):
+        """Applicable sources split into (concurrent, inline), plus the ones shed"""
+        with self._lock:
+            overloaded = self._pending >= self.max_pending
+        concurrent, inline, dropped = [], [], {}
+        for source in self.sources:
+            if not source.applies(request):
+                continue
+            expensive = source.expensive(request)
+            if expensive and overloaded:
+                dropped[source.name] = SKIPPED
+            elif expensive or source.name in tasks:
+                concurrent.append(source)
+            else:
+                inline.append(source)
+        return concurrent, inline, dropped
+
+    def _run_inline(self, sources, request, dropped):
+        candidates = {}
+        for source in sources:
+            try:
+                candidates[source.name] = source.fetch(request)
+            except Exception:
+                dropped[source.name] = FAILED
+        return candidates
+
+    def _submit(self, fetch, request):
+        # The request's trace context and profile follow the call onto the pool
+        context = contextvars.copy_context()
+        return self._track(self.executor.submit(context.run, run_profiled, fetch, request))
+
+    def _track(self, future):
+        with self._lock:
+            self._pending += 1
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def _record(self, candidates, dropped):
+        with self._lock:
+            self.requests += 1
+            if SKIPPED in dropped.values():
+                self.shed_requests += 1
+            for name in candidates:
+                self.outcomes[name]['ok'] += 1
+            for name, reason in dropped.items():
+                self.outcomes[name][reason] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "requests": self.requests,
+                "shed_requests": self.shed_requests,
+                "sources": {name: dict(outcomes) for name, outcomes in self.outcomes.items()}
+            }
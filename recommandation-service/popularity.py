@@ -0,0 +1,287 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from event_loader import MISSING_TIMESTAMP
+from incremental import events_watermark
+
+POPULARITY_FILE = 'popularity.npz'
+# Products kept ranked per category; deeper queries walk a full ordering,
+# sorted at most once per update
+RANKED_DEPTH = 1000
+# Re-anchor the scores once the newest event is this many half-lives past the anchor
+REBASE_HALF_LIVES = 256
+
+_EPOCH = datetime(1970, 1, 1)
+_MS_PER_DAY = 86_400_000
+
+
+class PopularityIndex:
+    """Exponentially time-decayed, action-weighted popularity of every product.
+
+    Each event adds its action weight times ``2 ** ((t - anchor) / half_life)``
+    to its product (forward decay). Decaying every score to "now" multiplies
+    them all by the same factor, so rankings never have to be recomputed
+    just because time passed, and ``update`` only touches the products in
+    the new events. The best ``depth`` products overall and per category are
+    kept ranked, and an update only re-ranks the lists its products belong
+    to; ``top_k`` walks that list, so a query costs O(k + len(exclude_ids)).
+    Queries whose exclusions reach past ``depth`` continue on a full ordering
+    of the list, sorted by the first of them after each update.
+    """
+
+    def __init__(self, half_life_days=7.0, depth=RANKED_DEPTH):
+        self.half_life_ms = half_life_days * _MS_PER_DAY
+        self.depth = depth
+        self.product_ids = []
+        self.item_index = {}
+        self.scores = np.zeros(0)
+        self.category_codes = np.zeros(0, dtype=np.int32)
+        self.categories = []
+        self.anchor_ms = None
+        self.watermark = None
+        self._rankings = {None: np.zeros(0, dtype=np.int64)}
+        # (rankings, {category: full ordering}): orderings past ``depth``,
+        # valid as long as those rankings are the published ones
+        self._deep_rankings = (None, {})
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def update(self, events, categories=None):
+        """Add the weights of ``events`` (EventColumns or InteractionColumns).
+
+        ``categories`` maps product ids to their category.
+        """
+        with self._lock:
+            rows = self._rows(events.product_ids)
+            recategorized, vacated = self._set_categories(categories or {})
+            changed = recategorized
+            if len(events):
+                timestamps = events.timestamps.astype(np.float64)
+                known = events.timestamps != MISSING_TIMESTAMP
+                newest = timestamps[known].max() if known.any() else self.anchor_ms
+                if self.anchor_ms is None:
+                    self.anchor_ms = newest if newest is not None else _now_ms()
+                elif newest is not None and newest - self.anchor_ms > REBASE_HALF_LIVES * self.half_life_ms:
+                    self.scores *= 2.0 ** ((self.anchor_ms - newest) / self.half_life_ms)
+                    self.anchor_ms = newest
+
+                # Events without a timestamp count as happening at the anchor
+                timestamps[~known] = self.anchor_ms
+                weights = events.action_weights() * 2.0 ** ((timestamps - self.anchor_ms) / self.half_life_ms)
+                self.scores += np.bincount(rows[events.item_codes], weights=weights, minlength=len(self.scores))
+                changed = np.union1d(changed, rows[events.item_codes])
+
+                watermark = events_watermark(events)
+                if watermark is not None and (self.watermark is None or watermark > self.watermark):
+                    self.watermark = watermark
+            self._rerank(changed, vacated)
+
+    def uncategorized(self, product_ids):
+        """Ids among ``product_ids`` whose category is not known yet"""
+        return [
+            pid for pid in product_ids
+            if pid not in self.item_index or self.category_codes[self.item_index[pid]] < 0
+        ]
+
+    def top_k(self, k, exclude_ids=(), category=None):
+        """The ``k`` most popular product ids, best first, skipping ``exclude_ids``"""
+        rankings = self._rankings
+        ranking = rankings.get(category)
+        if ranking is None or k <= 0:
+            return []
+        results = self._walk(ranking, k, exclude_ids)
+        if len(results) < k and len(ranking) == self.depth:
+            # Exclusions used up the ranked prefix; carry on past it
+            deeper = self._deep_ranking(rankings, category)
+            results += self._walk(deeper[self.depth:], k - len(results), exclude_ids)
+        return results
+
+    def score(self, product_id, now=None):
+        """Decayed score of one product at ``now``"""
+        row = self.item_index.get(product_id)
+        if row is None or self.anchor_ms is None:
+            return 0.0
+        now_ms = _now_ms() if now is None else (now - _EPOCH) / timedelta(milliseconds=1)
+        return float(self.scores[row] * 2.0 ** ((self.anchor_ms - now_ms) / self.half_life_ms))
+
+    def status(self):
+        return {
+            "products": len(self),
+            "categories": len(self.categories),
+            "half_life_days": self.half_life_ms / _MS_PER_DAY,
+            "events_watermark": self.watermark.isoformat() if self.watermark else None
+        }
+
+    def save(self, path=POPULARITY_FILE):
+        np.savez(
+            path,
+            product_ids=np.array(self.product_ids, dtype=str),
+            scores=self.scores,
+            category_codes=self.category_codes,
+            categories=np.array(self.categories, dtype=str),
+            settings=np.array([self.half_life_ms, self.depth,
+                               np.nan if self.anchor_ms is None else self.anchor_ms]),
+            watermark=np.array(self.watermark.isoformat() if self.watermark else '')
+        )
+
+    @classmethod
+    def load(cls, path=POPULARITY_FILE):
+        with np.load(path) as data:
+            half_life_ms, depth, anchor_ms = data['settings'].tolist()
+            index = cls(half_life_ms / _MS_PER_DAY, int(depth))
+            index.product_ids = data['product_ids'].tolist()
+            index.scores = data['scores']
+            index.category_codes = data['category_codes']
+            index.categories = data['categories'].tolist()
+            watermark = data['watermark'].item()
+        index.item_index = {pid: row for row, pid in enumerate(index.product_ids)}
+        index.anchor_ms = None if np.isnan(anchor_ms) else anchor_ms
+        index.watermark = datetime.fromisoformat(watermark) if watermark else None
+        index._rank()
+        return index
+
+    def _rows(self, product_ids):
+        """Rows of ``product_ids``, appending the ones seen for the first time"""
+        rows = np.empty(len(product_ids), dtype=np.int64)
+        added = 0
+        for k, pid in enumerate(product_ids):
+            row = self.item_index.get(pid)
+            if row is None:
+                row = self.item_index[pid] = len(self.product_ids)
+                self.product_ids.append(pid)
+                added += 1
+            rows[k] = row
+        if added:
+            self.scores = np.concatenate([self.scores, np.zeros(added)])
+            self.category_codes = np.concatenate([self.category_codes, np.full(added, -1, dtype=np.int32)])
+        return rows
+
+    def _set_categories(self, categories):
+        """Record categories; returns (rows whose category changed, codes they left)"""
+        codes = {label: code for code, label in enumerate(self.categories)}
+        changed, vacated = [], set()
+        for pid, label in categories.items():
+            row = self.item_index.get(pid)
+            if row is None or label is None:
+                continue
+            if label not in codes:
+                codes[label] = len(self.categories)
+                self.categories.append(label)
+            if self.category_codes[row] != codes[label]:
+                if self.category_codes[row] >= 0:
+                    vacated.add(int(self.category_codes[row]))
+                self.category_codes[row] = codes[label]
+                changed.append(row)
+        return np.array(changed, dtype=np.int64), vacated
+
+    def _rank(self):
+        """Rank every list from scratch (one sort to group the categories)"""
+        rankings = {None: _top_rows(self.scores, np.arange(len(self.scores)), self.depth)}
+        rankings.update((label, np.zeros(0, dtype=np.int64)) for label in self.categories)
+        categorized = np.flatnonzero(self.category_codes >= 0)
+        if len(categorized):
+            by_code = categorized[np.argsort(self.category_codes[categorized], kind='stable')]
+            boundaries = np.flatnonzero(np.diff(self.category_codes[by_code])) + 1
+            for members in np.split(by_code, boundaries):
+                label = self.categories[self.category_codes[members[0]]]
+                rankings[label] = _top_rows(self.scores[members], members, self.depth)
+        # Published with one assignment, so readers never see a partial update
+        self._rankings = rankings
+
+    def _rerank(self, changed, vacated):
+        """Re-rank only the lists holding ``changed`` rows.
+
+        Scores only grow (and rebasing scales them all alike), so a list's new
+        top ``depth`` is among its current ones and the changed rows. Lists
+        that rows left are ranked again from their members.
+        """
+        rankings = dict(self._rankings)
+        if len(changed):
+            rankings[None] = self._top_of(rankings[None], changed)
+            codes = self.category_codes[changed]
+            for code in np.unique(codes[codes >= 0]):
+                label = self.categories[code]
+                if code not in vacated:
+                    rankings[label] = self._top_of(rankings.get(label, np.zeros(0, dtype=np.int64)),
+                                                   changed[codes == code])
+        for code in vacated:
+            members = np.flatnonzero(self.category_codes == code)
+            rankings[self.categories[code]] = _top_rows(self.scores[members], members, self.depth)
+        self._rankings = rankings
+
+    def _top_of(self, ranking, rows):
+        candidates = np.union1d(ranking, rows)
+        return _top_rows(self.scores[candidates], candidates, self.depth)
+
+    def _deep_ranking(self, rankings, category):
+        """Full ordering of a list, sorted once for each published ``rankings``"""
+        ranked_for, orderings = self._deep_rankings
+        if ranked_for is not rankings:
+            orderings = {}
+            self._deep_rankings = (rankings, orderings)
+        ordering = orderings.get(category)
+        if ordering is None:
+            if category is None:
+                members = np.arange(len(self.scores))
+            else:
+                members = np.flatnonzero(self.category_codes == self.categories.index(category))
+            ordering = orderings[category] = _top_rows(self.scores[members], members, len(members))
+        return ordering
+
+    def _walk(self, ranking, k, exclude_ids):
+        results = []
+        for row in ranking:
+            pid = self.product_ids[row]
+            if pid not in exclude_ids:
+                results.append(pid)
+                if len(results) == k:
+                    break
+        return results
+
+
+def load_popularity(path=POPULARITY_FILE):
+    if not os.path.exists(path):
+        return None
+    return PopularityIndex.load(path)
+
+
+def load_product_categories(collection, product_ids=None):
+    """{product_id: category} from the products collection (every product by default)"""
+    query = {}
+    if product_ids is not None:
+        object_ids = []
+        for pid in product_ids:
+            try:
+                object_ids.append(ObjectId(pid))
+            except (InvalidId, TypeError):
+                continue
+        if not object_ids:
+            return {}
+        query = {'_id': {'$in': object_ids}}
+    return {str(p['_id']): p.get('category') for p in collection.find(query, {'_id': 1, 'category': 1})}
+
+
+def _top_rows(scores, rows, depth):
+    """``rows`` ordered by descending score (ties by row), cut to ``depth``; zero scores dropped"""
+    positive = scores > 0
+    scores, rows = scores[positive], rows[positive]
+    if len(scores) > depth:
+        # Ties at the cut go to the lowest rows too, so a ranked prefix is
+        # exactly the start of the list's full ordering
+        threshold = scores[np.argpartition(-scores, depth - 1)[depth - 1]]
+        above = np.flatnonzero(scores > threshold)
+        tied = np.flatnonzero(scores == threshold)
+        keep = np.concatenate([above, tied[np.argsort(rows[tied], kind='stable')][:depth - len(above)]])
+        scores, rows = scores[keep], rows[keep]
+    return rows[np.lexsort((rows, -scores))]
+
+
+def _now_ms():
+    return (datetime.now(timezone.utc).replace(tzinfo=None) - _EPOCH) / timedelta(milliseconds=1)
@@ -0,0 +1,293 @@
+"""Pre-fork serving: one model load in the gunicorn master, shared by every worker
+
+    gunicorn -c gunicorn.conf.py
+
+The master imports app.py once (``preload_app``), so the model bundle, the
+id tables and the catalog are built a single time and inherited copy-on-write
+by the workers; the factor arrays are read-only memory maps and stay shared
+for good. Objects are moved out of the garbage collector's reach before each
+fork (``gc.freeze``), so collections in a worker do not dirty the inherited
+pages. Threads and MongoDB connections are started in each worker after the
+fork.
+
+When a worker activates another version (retrain or rollback) it sends
+SIGHUP to the master, which loads that version once and replaces every
+worker with one forked from the new state. Each process records itself in a
+state directory so /api/status can report every worker's memory and the
+last reload's timings.
+
+Caches are per process, so a worker receiving new events appends the users
+to an invalidation journal in the state directory and every worker follows
+that journal, dropping the same users from its own caches.
+"""
+import fcntl
+import gc
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import traceback
+from datetime import datetime
+
+# Where the master and workers record themselves (one JSON file per process)
+PREFORK_STATE_DIR = os.getenv("PREFORK_STATE_DIR", "")
+# How often workers read the invalidation journal, and its size before it is
+# started afresh
+INVALIDATION_POLL_SECONDS = float(os.getenv("PREFORK_INVALIDATION_POLL_SECONDS", "0.2"))
+INVALIDATION_JOURNAL_MAX_BYTES = int(os.getenv("PREFORK_INVALIDATION_JOURNAL_MAX_BYTES", str(4 * 1024 * 1024)))
+
+# Under the state directory: user ids whose cached state is stale, one per line
+JOURNAL_FILE = 'invalidations.log'
+JOURNAL_LOCK_FILE = 'invalidations.lock'
+
+_MB = 1024 * 1024
+
+# Set in the master and inherited by the workers
+_master_pid = None
+_forked_at = None
+
+
+def master_ready(server):
+    """gunicorn when_ready: the app is loaded, no worker forked yet"""
+    global _master_pid
+    import app as service
+
+    _master_pid = os.getpid()
+    shutil.rmtree(state_dir(), ignore_errors=True)
+    os.makedirs(state_dir())
+    _write_record('master', {
+        'pid': _master_pid,
+        'version': service.bundle.version,
+        'workers': server.cfg.workers,
+        'reloads': 0,
+        'last_reload': None
+    })
+
+
+def before_fork():
+    """gunicorn pre_fork: keep inherited objects out of the workers' collections"""
+    global _forked_at
+    gc.collect()
+    gc.freeze()
+    _forked_at = time.time()
+
+
+def worker_started(worker):
+    """gunicorn post_fork: start this worker's threads and register it"""
+    import app as service
+
+    service.start_background_tasks()
+    threading.Thread(
+        target=follow_invalidations,
+        args=(service.invalidate_user,),
+        name='prefork-invalidation',
+        daemon=True
+    ).start()
+    _write_record(str(os.getpid()), {
+        'pid': os.getpid(),
+        'version': service.bundle.version,
+        'forked_at': datetime.fromtimestamp(_forked_at).isoformat() if _forked_at else None,
+        'ready_at': time.time(),
+        'ready_seconds': round(time.time() - _forked_at, 3) if _forked_at else None
+    })
+
+
+def worker_exited(worker):
+    """gunicorn worker_exit"""
+    _remove_record(str(worker.pid))
+
+
+def reload_model(server):
+    """gunicorn on_reload (SIGHUP): load the active version once, in the master.
+
+    gunicorn forks the replacement workers right after this returns and
+    retires the old ones gracefully.
+    """
+    import app as service
+
+    started_at = time.time()
+    # Let the collector reclaim the outgoing version; re-frozen before each fork
+    gc.unfreeze()
+    service.activate_bundle(service.model_store.load(), publish=False)
+    record = _read_record('master') or {'pid': os.getpid()}
+    record.update(
+        version=service.bundle.version,
+        reloads=record.get('reloads', 0) + 1,
+        last_reload={
+            'version': service.bundle.version,
+            'started_at': started_at,
+            'load_seconds': round(time.time() - started_at, 3)
+        }
+    )
+    _write_record('master', record)
+
+
+def master_exiting(server):
+    """gunicorn on_exit"""
+    shutil.rmtree(state_dir(), ignore_errors=True)
+
+
+def request_reload():
+    """Ask the master to reload the model and re-fork the workers (from a worker only)"""
+    if _master_pid is None or _master_pid == os.getpid():
+        return False
+    os.kill(_master_pid, signal.SIGHUP)
+    return True
+
+
+def publish_invalidations(user_ids):
+    """Have every worker drop these users' cached state (False in single-process mode)"""
+    user_ids = [str(user_id) for user_id in user_ids]
+    if _master_pid is None or not user_ids:
+        return False
+    with open(os.path.join(state_dir(), JOURNAL_LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        path = os.path.join(state_dir(), JOURNAL_FILE)
+        try:
+            if os.path.getsize(path) > INVALIDATION_JOURNAL_MAX_BYTES:
+                # Followers finish reading the old file through their open handle
+                os.remove(path)
+        except OSError:
+            pass
+        with open(path, 'a') as journal:
+            journal.write(''.join(f'{user_id}\n' for user_id in user_ids))
+    return True
+
+
+def follow_invalidations(invalidate, interval=None, stop=None):
+    """Background task: call ``invalidate(user_id)`` for users published after it started"""
+    interval = INVALIDATION_POLL_SECONDS if interval is None else interval
+    path = os.path.join(state_dir(), JOURNAL_FILE)
+    journal = None
+    # Caches start empty in a new worker: only later entries matter
+    whence = os.SEEK_END
+    pending = ''
+    try:
+        while stop is None or not stop.is_set():
+            try:
+                if journal is None:
+                    journal = open(path, 'a+')
+                    journal.seek(0, whence)
+                # Checked before reading, so nothing appended before a rotation is missed
+                rotated = os.stat(path).st_ino != os.fstat(journal.fileno()).st_ino
+            except FileNotFoundError:
+                rotated = True
+            except OSError:
+                traceback.print_exc()
+                rotated = False
+
+            if journal is not None:
+                pending += journal.read()
+                *lines, pending = pending.split('\n')
+                for user_id in lines:
+                    if user_id:
+                        invalidate(user_id)
+                if rotated:
+                    # The new file is reopened and read from its start
+                    journal.close()
+                    journal, whence, pending = None, os.SEEK_SET, ''
+                    continue
+            time.sleep(interval)
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+def serving_status():
+    """Process layout, per-process memory and the last coordinated reload"""
+    if _master_pid is None:
+        return {'mode': 'single', 'pid': os.getpid(), 'memory': process_memory()}
+
+    master = _read_record('master') or {'pid': _master_pid}
+    workers = []
+    names = sorted(os.listdir(state_dir())) if os.path.isdir(state_dir()) else []
+    for name in names:
+        if not name.endswith('.json') or name == 'master.json':
+            continue
+        record = _read_record(name[:-len('.json')])
+        if record is None:
+            continue
+        if not _alive(record['pid']):
+            _remove_record(str(record['pid']))
+            continue
+        workers.append(dict(record, memory=process_memory(record['pid']), current=record['pid'] == os.getpid()))
+
+    last_reload = master.get('last_reload')
+    if last_reload:
+        # From the SIGHUP to the last worker forked from the new version being ready
+        ready = [w['ready_at'] for w in workers if w['version'] == last_reload['version']
+                 and w['ready_at'] >= last_reload['started_at']]
+        last_reload = dict(last_reload, started_at=datetime.fromtimestamp(last_reload['started_at']).isoformat(),
+                           total_seconds=round(max(ready) - last_reload['started_at'], 3) if ready else None)
+    return {
+        'mode': 'prefork',
+        'master': dict(master, last_reload=last_reload, memory=process_memory(_master_pid)),
+        'workers': workers
+    }
+
+
+def process_memory(pid='self'):
+    """Resident memory of a process in MB, split into shared and private pages (Linux)"""
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    except OSError:
+        if pid != 'self' and pid != os.getpid():
+            return None
+        import resource
+        # Peak rather than current RSS where /proc is not available
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'peak_rss_mb': round(peak / 1024, 1)}
+
+    shared = fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)
+    private = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return {
+        'rss_mb': round(fields.get('Rss', 0) / _MB, 1),
+        # Proportional share: shared pages divided among the processes using them
+        'pss_mb': round(fields.get('Pss', 0) / _MB, 1),
+        'shared_mb': round(shared / _MB, 1),
+        'private_mb': round(private / _MB, 1)
+    }
+
+
+def state_dir():
+    return PREFORK_STATE_DIR or os.path.join(tempfile.gettempdir(), f'recommendation-prefork-{_master_pid}')
+
+
+def _write_record(name, record):
+    path = os.path.join(state_dir(), f'{name}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(record, f)
+    os.replace(path + '.tmp', path)
+
+
+def _read_record(name):
+    try:
+        with open(os.path.join(state_dir(), f'{name}.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _remove_record(name):
+    try:
+        os.remove(os.path.join(state_dir(), f'{name}.json'))
+    except OSError:
+        pass
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
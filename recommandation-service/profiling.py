@@ -0,0 +1,151 @@
+import contextvars
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+
+# (profiler, token) of the profile the current request records into
+_active_profile = contextvars.ContextVar('active_profile', default=None)
+
+
+class SamplingProfiler:
+    """Samples the stacks of registered threads from one background thread.
+
+    ``start()`` opens a profile for the calling thread; ``stop(token)``
+    closes it and returns its stacks in the folded format (``outer;inner
+    count``) understood by flamegraph.pl and speedscope. Work the request
+    hands to pool threads lands in the same profile when it runs through
+    ``run_profiled``. Sampling only runs while at least one thread is
+    registered.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        # token -> Counter of folded stacks
+        self._samples = {}
+        # thread id -> token of the profile it is sampled into
+        self._threads = {}
+        self._context = {}
+        self._tokens = itertools.count(1)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        token = next(self._tokens)
+        with self._lock:
+            self._samples[token] = Counter()
+            self._threads[threading.get_ident()] = token
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+        self._context[token] = _active_profile.set((self, token))
+        self._wakeup.set()
+        return token
+
+    def stop(self, token):
+        context = self._context.pop(token, None)
+        if context is not None:
+            _active_profile.reset(context)
+        with self._lock:
+            for thread_id in [t for t, owner in self._threads.items() if owner == token]:
+                del self._threads[thread_id]
+            return self._samples.pop(token, Counter())
+
+    def attach(self, token):
+        """Sample the calling thread into the profile ``token`` until ``detach``"""
+        with self._lock:
+            if token not in self._samples:
+                return
+            self._threads[threading.get_ident()] = token
+        self._wakeup.set()
+
+    def detach(self, token):
+        with self._lock:
+            if self._threads.get(threading.get_ident()) == token:
+                del self._threads[threading.get_ident()]
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                targets = dict(self._threads)
+            if not targets:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, token in targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None and thread_id != own_id and token in self._samples:
+                        self._samples[token][_fold(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+def run_profiled(fn, *args):
+    """``fn(*args)`` on a pool thread, sampled into the caller's profile if it has one.
+
+    Call it inside a copy of the caller's context (``contextvars.copy_context``).
+    """
+    active = _active_profile.get()
+    if active is None:
+        return fn(*args)
+    profiler, token = active
+    profiler.attach(token)
+    try:
+        return fn(*args)
+    finally:
+        profiler.detach(token)
+
+
+class SlowRequestRecorder:
+    """Keeps folded stacks of the ``keep`` slowest requests as files"""
+
+    def __init__(self, directory, keep=10):
+        self.directory = directory
+        self.keep = keep
+        self._slowest = []
+        self._lock = threading.Lock()
+
+    def offer(self, seconds, stacks, label=''):
+        """Write the profile if the request is among the slowest; returns the path or None"""
+        if not stacks:
+            return None
+        with self._lock:
+            if len(self._slowest) >= self.keep and seconds <= self._slowest[0][0]:
+                return None
+
+            os.makedirs(self.directory, exist_ok=True)
+            name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{seconds * 1000:.0f}ms{label}.folded"
+            path = os.path.join(self.directory, name)
+            with open(path, 'w') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f'{stack} {count}\n')
+
+            self._slowest.append((seconds, path))
+            self._slowest.sort()
+            while len(self._slowest) > self.keep:
+                _, evicted = self._slowest.pop(0)
+                if os.path.exists(evicted):
+                    os.remove(evicted)
+            return path
+
+    def profiles(self):
+        with self._lock:
+            return [{'seconds': round(seconds, 4), 'path': path} for seconds, path in reversed(self._slowest)]
+
+
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
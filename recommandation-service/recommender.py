@@ -0,0 +1,171 @@
+import random
+from contextlib import nullcontext
+from itertools import islice
+
+import numpy as np
+
+from scoring import top_k_rows
+
+# Candidates requested from the model for a trained user
+ML_CANDIDATES = 6
+# Upper bound on user x item scores held at once when ranking many users
+BATCH_SCORE_CELLS = 8_000_000
+
+
+def get_popular_products(current, exclude_ids=None, limit=10):
+    """Get popular products as fallback"""
+    if exclude_ids is None:
+        exclude_ids = set()
+
+    if current.popularity is not None:
+        return current.popularity.top_k(limit, exclude_ids)
+    available_popular = [pid for pid in current.popular_products if pid not in exclude_ids]
+    return available_popular[:limit]
+
+
+def rank_for_trained_user(current, catalog, user_id, seen_products, retrieval_mode="exact", n_probe=8,
+                          k=ML_CANDIDATES, tracer=None):
+    """Strategy 1: ML-based predictions for a user in the training data"""
+    engine = current.engine
+
+    # Skip seen and removed products
+    allowed = catalog.active_mask & ~engine.item_mask(seen_products)
+
+    # Precomputed top-K row first; score online only if too few survive
+    rows = None
+    if current.topk_table is not None:
+        with _stage(tracer, 'topk_table'):
+            rows = current.topk_table.recommend(engine.user_index[str(user_id)], allowed, k, engine=engine)
+    if rows is not None:
+        return [engine.item_ids[row] for row in rows]
+
+    with _stage(tracer, 'scoring'):
+        if retrieval_mode == "ann" and current.ann_index is not None:
+            predictions = current.ann_index.search(engine, user_id, k, allowed_mask=allowed, n_probe=n_probe)
+        else:
+            predictions = engine.top_k(user_id, k, allowed_mask=allowed)
+    return [pid for pid, score in predictions]
+
+
+def rank_for_trained_users(current, catalog, seen_by_user, k=ML_CANDIDATES, max_cells=BATCH_SCORE_CELLS):
+    """Strategy 1 for many trained users at once; returns {user_id: [product_id, ...]}.
+
+    Users the top-K table can answer are served from it, the rest are scored
+    in blocks with one user x item matrix product each, sized so that no
+    block holds more than ``max_cells`` scores. Rankings match
+    ``rank_for_trained_user`` with exact retrieval.
+    """
+    engine = current.engine
+    results = {}
+    pending = []
+    for user_id, seen_products in seen_by_user.items():
+        user_row = engine.user_index[str(user_id)]
+        seen_rows = engine.item_rows(seen_products)
+        rows = None
+        if current.topk_table is not None:
+            rows = current.topk_table.recommend(user_row, catalog.active_mask, k, excluded_rows=seen_rows,
+                                                engine=engine)
+        if rows is not None:
+            results[user_id] = [engine.item_ids[row] for row in rows]
+        else:
+            pending.append((user_id, user_row, seen_rows))
+
+    block_size = max(1, max_cells // max(engine.n_items, 1))
+    inactive = ~catalog.active_mask
+    for start in range(0, len(pending), block_size):
+        block = pending[start:start + block_size]
+        scores = engine.score_users(np.array([user_row for _, user_row, _ in block], dtype=np.int64))
+        scores[:, inactive] = -np.inf
+        for i, (_, _, seen_rows) in enumerate(block):
+            scores[i, seen_rows] = -np.inf
+        top = top_k_rows(scores, k)
+        for i, (user_id, _, _) in enumerate(block):
+            rows = top[i][np.isfinite(scores[i, top[i]])]
+            results[user_id] = [engine.item_ids[row] for row in rows]
+    return results
+
+
+def assemble_recommendations(current, catalog, seen_products, product_scores, ml_recommendations=None,
+                             similar_user_recs=None, tracer=None):
+    """Fill personalised candidates up with the fallback strategies.
+
+    ``ml_recommendations`` is None for users outside the training data (or
+    when the ML source missed its deadline), who get ``similar_user_recs``
+    (strategy 2) instead. Returns the de-duplicated recommendations and the
+    strategy that produced them: an untrained user is only reported as
+    "collaborative" when ``similar_user_recs`` has candidates, and otherwise
+    by the fallback that filled the list.
+    """
+    recommendations = []
+    strategy_used = "none"
+
+    if ml_recommendations is not None:
+        strategy_used = "ml"
+        recommendations.extend(ml_recommendations)
+    elif similar_user_recs:
+        strategy_used = "collaborative"
+        recommendations.extend(similar_user_recs)
+
+    # Strategy 3: Add new products (not in training data) - exploration
+    with _stage(tracer, 'exploration'):
+        if len(recommendations) < 10:
+            slots_available = min(3, 10 - len(recommendations))
+            recommendations.extend(_sample_unseen(catalog.new_product_ids, seen_products, slots_available))
+
+    # Strategy 4: Fill with popular products if needed
+    if len(recommendations) < 8:
+        needed = 10 - len(recommendations)
+        with _stage(tracer, 'popular'):
+            popular_recs = get_popular_products(
+                current,
+                exclude_ids=set(recommendations) | seen_products,
+                limit=needed
+            )
+        recommendations.extend(popular_recs)
+        if not strategy_used or strategy_used == "none":
+            strategy_used = "popular"
+
+    # Strategy 5: Last resort - show user's favorites (re-engagement)
+    if not recommendations and product_scores:
+        strategy_used = "favorites"
+        favorite_products = sorted(
+            product_scores.items(),
+            key=lambda x: x[1],
+            reverse=True
+        )[:10]
+        recommendations = [pid for pid, score in favorite_products]
+
+    # Final fallback - completely random (shouldn't happen often)
+    if not recommendations:
+        strategy_used = "random"
+        available_products = [
+            pid for pid in catalog.ordered_ids
+            if pid not in seen_products
+        ]
+        random.shuffle(available_products)
+        recommendations = available_products[:10]
+
+    # Remove duplicates while preserving order
+    seen = set()
+    unique_recommendations = []
+    for pid in recommendations:
+        if pid not in seen:
+            seen.add(pid)
+            unique_recommendations.append(pid)
+    return unique_recommendations, strategy_used
+
+
+def _sample_unseen(product_ids, seen_products, count):
+    """Up to ``count`` random ids of ``product_ids`` that are not in ``seen_products``.
+
+    At most len(seen_products) of the drawn ids can be seen ones, so drawing
+    that many more than needed suffices, without filtering or shuffling the
+    whole list on every request.
+    """
+    drawn = random.sample(range(len(product_ids)), min(len(product_ids), count + len(seen_products)))
+    unseen = (product_ids[i] for i in drawn if product_ids[i] not in seen_products)
+    return list(islice(unseen, count))
+
+
+def _stage(tracer, name):
+    return tracer.stage(name) if tracer is not None else nullcontext()
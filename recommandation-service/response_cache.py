@@ -0,0 +1,181 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class _Flight:
+    """One computation in progress, shared by every request for the same key"""
+
+    __slots__ = ('future', 'stale', 'seconds')
+
+    def __init__(self):
+        self.future = Future()
+        # Set when the user's events or the model changed mid-computation
+        self.stale = False
+        self.seconds = 0.0
+
+
+class ResponseCache:
+    """Single-flight coalescing and a short-lived LRU of recommendation payloads.
+
+    Requests are keyed by user id and model state. Concurrent requests for
+    the same key share one computation, and its payload is then served for
+    ``ttl`` seconds (``ttl=0`` only coalesces). ``invalidate`` drops a user's
+    entry when new events arrive and ``clear`` drops everything when the
+    model changes; a computation running at that moment still answers the
+    requests waiting on it but is not stored, nor is a payload for which
+    ``keep(payload)`` is false.
+    """
+
+    def __init__(self, max_size=10000, ttl=5):
+        self.max_size = max_size
+        self.ttl = ttl
+        # user_id -> (model state, payload, expires_at, compute seconds)
+        self._entries = OrderedDict()
+        # (user_id, model state) -> _Flight
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.computed = 0
+        self.hits = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.compute_seconds = 0.0
+        self.saved_seconds = 0.0
+        self._completed = 0
+
+    def get(self, user_id, state, compute, keep=None):
+        """``(payload, source)`` where source is "cached", "coalesced" or "computed" """
+        started = time.monotonic()
+        key = (str(user_id), state)
+        payload, flight, leader = self._join(key, started)
+        if flight is None:
+            return payload, 'cached'
+        if not leader:
+            payload = flight.future.result()
+            self._waited(flight, time.monotonic() - started)
+            return payload, 'coalesced'
+
+        try:
+            payload = compute()
+        except BaseException as e:
+            self._fail(key, flight, e)
+            raise
+        return self._finish(key, flight, payload, time.monotonic() - started, keep), 'computed'
+
+    async def get_async(self, user_id, state, compute, keep=None):
+        """Like ``get``, awaiting ``compute()`` and the shared result (asyncio serving)"""
+        started = time.monotonic()
+        key = (str(user_id), state)
+        payload, flight, leader = self._join(key, started)
+        if flight is None:
+            return payload, 'cached'
+        if not leader:
+            payload = await asyncio.wrap_future(flight.future)
+            self._waited(flight, time.monotonic() - started)
+            return payload, 'coalesced'
+
+        try:
+            payload = await compute()
+        except BaseException as e:
+            self._fail(key, flight, e)
+            raise
+        return self._finish(key, flight, payload, time.monotonic() - started, keep), 'computed'
+
+    def _join(self, key, now):
+        user_id, state = key
+        with self._lock:
+            self.requests += 1
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry_state, payload, expires_at, seconds = entry
+                if entry_state == state and expires_at > now:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    self.saved_seconds += seconds
+                    return payload, None, False
+                del self._entries[user_id]
+                self.expirations += 1
+
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return None, flight, False
+            flight = self._flights[key] = _Flight()
+            self.computed += 1
+            return None, flight, True
+
+    def _waited(self, flight, seconds):
+        with self._lock:
+            self.saved_seconds += max(0.0, flight.seconds - seconds)
+
+    def _fail(self, key, flight, error):
+        with self._lock:
+            self.failures += 1
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        if not isinstance(error, Exception):
+            # A cancelled leader must not cancel the requests waiting on it
+            error = RuntimeError('Shared recommendation computation was cancelled')
+        flight.future.set_exception(error)
+
+    def _finish(self, key, flight, payload, seconds, keep=None):
+        user_id, state = key
+        with self._lock:
+            flight.seconds = seconds
+            self.compute_seconds += seconds
+            self._completed += 1
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if not flight.stale and self.ttl > 0 and (keep is None or keep(payload)):
+                self._entries[user_id] = (state, payload, time.monotonic() + self.ttl, seconds)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        flight.future.set_result(payload)
+        return payload
+
+    def invalidate(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            for key in [key for key in self._flights if key[0] == user_id]:
+                self._flights.pop(key).stale = True
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+                return True
+        return False
+
+    def clear(self):
+        with self._lock:
+            for flight in self._flights.values():
+                flight.stale = True
+            self._flights.clear()
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            shared = self.hits + self.coalesced
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "in_flight": len(self._flights),
+                "requests": self.requests,
+                "computed": self.computed,
+                "hits": self.hits,
+                "coalesced": self.coalesced,
+                "dedup_ratio": round(shared / self.requests, 4) if self.requests else 0.0,
+                "failures": self.failures,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "avg_compute_ms": round(1000 * self.compute_seconds / self._completed, 3) if self._completed else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3)
+            }
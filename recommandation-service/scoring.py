@@ -0,0 +1,173 @@
+import numpy as np
+
+from id_registry import IdRegistry
+
+
+class ScoringEngine:
+    """In-memory SVD scorer built once at model-load time.
+
+    Holds the factor matrices and biases of a trained model as NumPy arrays,
+    with item rows ordered like ``metadata['product_ids']`` so that ties are
+    broken exactly as the old per-product ``model.predict`` loop did.
+
+    ``user_ids``/``item_ids`` are IdRegistry tables (list-like, row order)
+    and ``user_index``/``item_index`` their {id: row} lookups.
+    """
+
+    def __init__(self, pu, qi, bu, bi, global_mean, user_ids, item_ids, rating_scale=(1, 5)):
+        self.pu = pu
+        self.qi = qi
+        self.bu = bu
+        self.bi = bi
+        self.global_mean = float(global_mean)
+        self.rating_scale = rating_scale
+        self.user_ids = IdRegistry.of(user_ids)
+        self.item_ids = IdRegistry.of(item_ids)
+        self.user_index = self.user_ids.index
+        self.item_index = self.item_ids.index
+
+    @classmethod
+    def from_surprise(cls, algo, product_ids, user_ids):
+        """Extract pu/qi/bu/bi from a fitted Surprise SVD.
+
+        Ids the trainset never saw (e.g. cold-start catalogs larger than the
+        dummy training data) get zero factors and biases, which is exactly
+        how ``SVD.estimate`` treats unknown users and items.
+        """
+        trainset = algo.trainset
+        user_rows = _inner_rows(trainset._raw2inner_id_users, user_ids)
+        item_rows = _inner_rows(trainset._raw2inner_id_items, product_ids)
+
+        if getattr(algo, 'biased', True):
+            bu = _take(algo.bu, user_rows)
+            bi = _take(algo.bi, item_rows)
+            global_mean = trainset.global_mean
+        else:
+            bu = np.zeros(len(user_rows))
+            bi = np.zeros(len(item_rows))
+            global_mean = 0.0
+
+        return cls(
+            pu=_take(algo.pu, user_rows),
+            qi=_take(algo.qi, item_rows),
+            bu=bu,
+            bi=bi,
+            global_mean=global_mean,
+            user_ids=user_ids,
+            item_ids=product_ids,
+            rating_scale=trainset.rating_scale
+        )
+
+    @property
+    def n_items(self):
+        return len(self.item_ids)
+
+    def has_user(self, user_id):
+        return str(user_id) in self.user_index
+
+    def item_mask(self, product_ids):
+        """Boolean mask over the item index for the given product ids"""
+        mask = np.zeros(self.n_items, dtype=bool)
+        rows = self.item_rows(product_ids)
+        mask[rows] = True
+        return mask
+
+    def item_rows(self, product_ids):
+        """Item rows of the trained ``product_ids``; unknown ids are skipped"""
+        rows = self.item_ids.codes(list(product_ids))
+        return rows[rows >= 0]
+
+    def score_user(self, user_id, rows=None):
+        """Estimated rating of every trained item (or only ``rows``) for one user"""
+        u = self.user_index[str(user_id)]
+        qi = self.qi if rows is None else self.qi[rows]
+        bi = self.bi if rows is None else self.bi[rows]
+        # Same summation order as SVD.estimate, then the same clipping as predict()
+        scores = (self.global_mean + self.bu[u]) + bi + qi @ self.pu[u]
+        lower_bound, higher_bound = self.rating_scale
+        return np.clip(scores, lower_bound, higher_bound)
+
+    def score_users(self, user_rows):
+        """Estimated ratings of every item for several user rows, one matrix product"""
+        scores = (self.global_mean + self.bu[user_rows, None]) + self.bi[None, :] + self.pu[user_rows] @ self.qi.T
+        lower_bound, higher_bound = self.rating_scale
+        np.clip(scores, lower_bound, higher_bound, out=scores)
+        return scores
+
+    def predict_pairs(self, user_rows, item_rows):
+        """Estimated rating of each (user row, item row) pair"""
+        scores = (self.global_mean + self.bu[user_rows]) + self.bi[item_rows] + \
+            np.einsum('ij,ij->i', self.pu[user_rows], self.qi[item_rows])
+        lower_bound, higher_bound = self.rating_scale
+        np.clip(scores, lower_bound, higher_bound, out=scores)
+        return scores
+
+    def top_k(self, user_id, k, allowed_mask=None, candidates=None):
+        """Top-k (product_id, score) pairs for a user among allowed items
+
+        ``candidates`` restricts scoring to a subset of item rows (e.g. the
+        output of an ANN index); by default the whole catalog is scored.
+        """
+        if candidates is None:
+            candidates = np.arange(self.n_items) if allowed_mask is None else np.flatnonzero(allowed_mask)
+            candidate_scores = self.score_user(user_id)[candidates]
+        else:
+            candidates = np.sort(np.asarray(candidates, dtype=np.int64))
+            if allowed_mask is not None:
+                candidates = candidates[allowed_mask[candidates]]
+            candidate_scores = self.score_user(user_id, rows=candidates)
+        return self._select_top_k(candidates, candidate_scores, k)
+
+    def _select_top_k(self, candidates, candidate_scores, k):
+        if k <= 0 or len(candidates) == 0:
+            return []
+
+        if k < len(candidates):
+            # argpartition finds the k-th best score; keep every tie at that score
+            # so the stable sort below can break ties by item index
+            kth = np.argpartition(-candidate_scores, k - 1)[k - 1]
+            keep = candidate_scores >= candidate_scores[kth]
+            candidates = candidates[keep]
+            candidate_scores = candidate_scores[keep]
+
+        order = np.argsort(-candidate_scores, kind='stable')[:k]
+        return [(self.item_ids[candidates[i]], float(candidate_scores[i])) for i in order]
+
+
+def _inner_rows(raw2inner, raw_ids):
+    """Trainset rows of the given raw ids, -1 where the id is unknown"""
+    return np.array([raw2inner.get(raw_id, -1) for raw_id in raw_ids], dtype=np.int64)
+
+
+def _take(values, rows):
+    """Rows of a Surprise parameter array, zero-filled for unknown (-1) rows"""
+    values = np.asarray(values, dtype=np.float64)
+    out = np.zeros((len(rows),) + values.shape[1:])
+    known = rows >= 0
+    out[known] = values[rows[known]]
+    return out
+
+
+def top_k_rows(scores, k):
+    """Best ``k`` column indices of every row of ``scores``, best first.
+
+    Ties are broken by column index, as ``ScoringEngine.top_k`` does.
+    """
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int32)
+    negated = -scores
+    top = np.argpartition(negated, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(negated, top, axis=1)
+    # Best score first, ties broken by item row, as top_k does
+    order = np.lexsort((top, top_scores), axis=1)
+    rows = np.take_along_axis(top, order, axis=1).astype(np.int32)
+
+    # Where more items tie with the k-th score than fit, argpartition picked
+    # an arbitrary subset of them; redo those users with every tied item
+    kth = top_scores.max(axis=1)
+    tied = np.flatnonzero((negated <= kth[:, None]).sum(axis=1) > k)
+    for i in tied:
+        candidates = np.flatnonzero(negated[i] <= kth[i])
+        rows[i] = candidates[np.argsort(negated[i, candidates], kind='stable')[:k]]
+    return rows
@@ -0,0 +1,342 @@
+"""Columnar snapshots of the events collection, so training does not scan MongoDB
+
+    python snapshots.py export    # append the events created since the last export
+    python snapshots.py compact   # merge each day's part files into one
+    python snapshots.py status
+    python train.py --from-snapshots --window-days 90
+
+Events are stored as Parquet under EVENT_SNAPSHOT_DIR, one directory per UTC
+day of createdAt (day=2025-06-01/), with dictionary-encoded ids and typed
+columns. An export reads only the events after the snapshot's watermark and
+at least SETTLE_SECONDS old, in createdAt order (the createdAt_1 index), and
+adds one part file per day it touches. manifest.json lists the committed files and is written last, so an
+export that fails half way leaves nothing that a reader would pick up.
+Events without a createdAt can only be picked up by the first export (like
+every watermark read of the service); they go to day=undated.
+
+Reads project the columns training needs and push time windows down to the
+day directories and to the createdAt statistics of each row group. Needs
+pyarrow (pip install pyarrow).
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pymongo import ASCENDING
+
+from event_loader import ACTION_CODES, EVENT_PROJECTION, MISSING_TIMESTAMP, OTHER_ACTION, EventColumns
+from interactions import SETTLE_SECONDS
+
+# Directory holding the day partitions and manifest.json
+SNAPSHOT_DIR = os.getenv("EVENT_SNAPSHOT_DIR", "event_snapshots")
+# Rows per Parquet row group, the unit that createdAt filters can skip
+ROW_GROUP_SIZE = int(os.getenv("EVENT_SNAPSHOT_ROW_GROUP_SIZE", "100000"))
+
+FORMAT_NAME = 'event-snapshot'
+FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+UNDATED = 'undated'
+COMPRESSION = 'zstd'
+SCHEMA = pa.schema([
+    ('userId', pa.dictionary(pa.int32(), pa.string())),
+    ('productId', pa.dictionary(pa.int32(), pa.string())),
+    # Action names as sent, so codes can change without rewriting snapshots
+    ('action', pa.dictionary(pa.int8(), pa.string())),
+    ('value', pa.float32()),
+    ('createdAt', pa.timestamp('ms')),
+])
+PARTITIONING = ds.partitioning(pa.schema([('day', pa.string())]), flavor='hive')
+
+_MS_PER_DAY = 86_400_000
+
+
+def export_events(collection, path=SNAPSHOT_DIR, batch_size=50000, settle_seconds=SETTLE_SECONDS, now=None):
+    """Append the events created after the snapshot's watermark; returns a report.
+
+    Events younger than ``settle_seconds`` are left to the next export, and
+    the cutoff becomes the watermark, so an event written late with a
+    createdAt before it is still exported.
+    """
+    started = time.perf_counter()
+    manifest = read_manifest(path) or _new_manifest()
+    watermark = datetime.fromisoformat(manifest['watermark']) if manifest['watermark'] else None
+    cutoff = _naive_utc(now or datetime.now(timezone.utc)) - timedelta(seconds=settle_seconds)
+    if watermark is None:
+        query = {'$or': [{'createdAt': {'$lte': cutoff}}, {'createdAt': None}]}
+    else:
+        query = {'createdAt': {'$gt': watermark, '$lte': cutoff}}
+    run = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+
+    writers, written = {}, {}
+    cursor = collection.find(query, EVENT_PROJECTION, batch_size=batch_size).sort('createdAt', ASCENDING)
+    try:
+        while True:
+            batch = list(islice(cursor, batch_size))
+            if not batch:
+                break
+            table, days = _batch_table(batch)
+            for day in days.unique().tolist():
+                rows = np.flatnonzero((days == day).to_numpy())
+                if day not in writers:
+                    name = f'day={day}/part-{run}-{len(written)}.parquet'
+                    os.makedirs(os.path.join(path, f'day={day}'), exist_ok=True)
+                    writers[day] = (name, pq.ParquetWriter(os.path.join(path, name + '.tmp'), SCHEMA,
+                                                           compression=COMPRESSION))
+                    written[name] = {'day': day, 'rows': 0}
+                name, writer = writers[day]
+                writer.write_table(table.take(rows), row_group_size=ROW_GROUP_SIZE)
+                written[name]['rows'] += len(rows)
+            # The cursor is in createdAt order, so earlier days are complete
+            batch_days = set(days)
+            for day in [day for day in writers if day not in batch_days]:
+                writers.pop(day)[1].close()
+    finally:
+        for _, writer in writers.values():
+            writer.close()
+
+    if watermark is None or cutoff > watermark:
+        watermark = cutoff
+    for name, entry in written.items():
+        os.replace(os.path.join(path, name + '.tmp'), os.path.join(path, name))
+        entry['bytes'] = os.path.getsize(os.path.join(path, name))
+    exported = sum(entry['rows'] for entry in written.values())
+    report = {
+        'events': exported,
+        'files': len(written),
+        'days': sorted({entry['day'] for entry in written.values()}),
+        'watermark': watermark.isoformat() if watermark else None,
+        'seconds': round(time.perf_counter() - started, 3),
+        'exported_at': datetime.now(timezone.utc).isoformat()
+    }
+    manifest['files'].update(written)
+    manifest['watermark'] = report['watermark']
+    manifest['events'] += exported
+    manifest['last_export'] = dict(report, days=len(report['days']))
+    _write_manifest(path, manifest)
+    return report
+
+
+def scan(path=SNAPSHOT_DIR, columns=None, since=None, until=None):
+    """The snapshot as a pyarrow Table, only ``columns`` and createdAt in [since, until).
+
+    Day directories outside the window are not opened, and row groups whose
+    createdAt statistics fall outside it are not read.
+    """
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise FileNotFoundError(f"No event snapshot in {path}; run python snapshots.py export")
+    files = [os.path.join(path, name) for name in sorted(manifest['files'])]
+    if not files:
+        return SCHEMA.empty_table().select(columns or SCHEMA.names)
+    dataset = ds.dataset(files, schema=SCHEMA.append(pa.field('day', pa.string())), format='parquet',
+                         partitioning=PARTITIONING, partition_base_dir=path)
+    return dataset.to_table(columns=columns or SCHEMA.names, filter=_window(since, until))
+
+
+def load_snapshot_events(path=SNAPSHOT_DIR, since=None, until=None):
+    """Snapshot events as EventColumns, like event_loader.load_events reads them from MongoDB"""
+    table = scan(path, SCHEMA.names, since, until)
+    user_codes, user_ids = _codes(table['userId'])
+    item_codes, product_ids = _codes(table['productId'])
+
+    action_codes, actions = _codes(table['action'])
+    # Unknown and missing actions (code -1) share OTHER_ACTION
+    lookup = np.array([ACTION_CODES.get(action, OTHER_ACTION) for action in actions] + [OTHER_ACTION], dtype=np.int8)
+
+    timestamps = pc.fill_null(table['createdAt'].cast(pa.int64()), MISSING_TIMESTAMP)
+    return EventColumns(
+        user_codes=user_codes,
+        item_codes=item_codes,
+        action_codes=lookup[action_codes],
+        # Nulls become NaN
+        values=table['value'].to_numpy().astype(np.float32),
+        timestamps=timestamps.to_numpy().astype(np.int64),
+        user_ids=user_ids,
+        product_ids=product_ids
+    )
+
+
+def compact(path=SNAPSHOT_DIR):
+    """Rewrite every day that has several part files as one file sorted by createdAt.
+
+    Files that are not in the manifest (left by a failed export) are removed.
+    Do not run while an export is writing to the same directory.
+    """
+    started = time.perf_counter()
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise FileNotFoundError(f"No event snapshot in {path}")
+    run = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+
+    by_day = {}
+    for name, entry in manifest['files'].items():
+        by_day.setdefault(entry['day'], []).append(name)
+    replaced, files_before = [], len(manifest['files'])
+    for day, names in sorted(by_day.items()):
+        if len(names) < 2:
+            continue
+        table = pa.concat_tables([pq.read_table(os.path.join(path, name), schema=SCHEMA) for name in names])
+        table = table.unify_dictionaries().combine_chunks().sort_by('createdAt')
+        merged = f'day={day}/part-{run}-compacted.parquet'
+        pq.write_table(table, os.path.join(path, merged + '.tmp'), row_group_size=ROW_GROUP_SIZE,
+                       compression=COMPRESSION)
+        os.replace(os.path.join(path, merged + '.tmp'), os.path.join(path, merged))
+        for name in names:
+            manifest['files'].pop(name)
+        manifest['files'][merged] = {'day': day, 'rows': len(table),
+                                     'bytes': os.path.getsize(os.path.join(path, merged))}
+        replaced.extend(names)
+
+    manifest['last_compaction'] = {
+        'days': len([names for names in by_day.values() if len(names) > 1]),
+        'files_before': files_before,
+        'files_after': len(manifest['files']),
+        'seconds': round(time.perf_counter() - started, 3),
+        'compacted_at': datetime.now(timezone.utc).isoformat()
+    }
+    _write_manifest(path, manifest)
+    for name in replaced:
+        os.remove(os.path.join(path, name))
+    orphans = _orphans(path, manifest)
+    for name in orphans:
+        os.remove(os.path.join(path, name))
+    for entry in os.scandir(path):
+        if entry.is_dir() and not os.listdir(entry.path):
+            shutil.rmtree(entry.path)
+    return dict(manifest['last_compaction'], orphans_removed=len(orphans))
+
+
+def status(path=SNAPSHOT_DIR):
+    manifest = read_manifest(path)
+    if manifest is None:
+        return {'exists': False, 'path': path}
+    files = manifest['files'].values()
+    return {
+        'exists': True,
+        'path': path,
+        'events': manifest['events'],
+        'watermark': manifest['watermark'],
+        'days': len({entry['day'] for entry in files}),
+        'files': len(files),
+        'mb': round(sum(entry['bytes'] for entry in files) / (1024 * 1024), 1),
+        'last_export': manifest.get('last_export'),
+        'last_compaction': manifest.get('last_compaction')
+    }
+
+
+def read_manifest(path=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get('format') != FORMAT_NAME or manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {manifest.get('format')} v{manifest.get('format_version')}")
+    return manifest
+
+
+def _new_manifest():
+    return {'format': FORMAT_NAME, 'format_version': FORMAT_VERSION, 'watermark': None, 'events': 0, 'files': {}}
+
+
+def _write_manifest(path, manifest):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, MANIFEST_FILE + '.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(path, MANIFEST_FILE + '.tmp'), os.path.join(path, MANIFEST_FILE))
+
+
+def _batch_table(batch):
+    """One batch of event documents as a Table, plus the day partition of every row"""
+    batch = [e for e in batch if e.get('userId') is not None and e.get('productId') is not None]
+    # Missing dates become NaT, which is the same int64 as MISSING_TIMESTAMP
+    timestamps = pd.to_datetime([e.get('createdAt') for e in batch]).as_unit('ms').asi8
+    missing = timestamps == MISSING_TIMESTAMP
+    table = pa.table({
+        'userId': pa.array([str(e['userId']) for e in batch], pa.string()).dictionary_encode(),
+        'productId': pa.array([str(e['productId']) for e in batch], pa.string()).dictionary_encode(),
+        'action': pa.array([e.get('action') for e in batch], pa.string()).dictionary_encode()
+                    .cast(SCHEMA.field('action').type),
+        'value': pa.array([e.get('value') for e in batch], pa.float64()).cast(pa.float32()),
+        'createdAt': pa.array(np.where(missing, 0, timestamps), pa.int64(), mask=missing).cast(pa.timestamp('ms')),
+    }, schema=SCHEMA)
+    days = pd.Series(timestamps // _MS_PER_DAY * _MS_PER_DAY).astype('datetime64[ms]').dt.strftime('%Y-%m-%d')
+    return table, days.where(~missing, UNDATED)
+
+
+def _window(since, until):
+    """Filter on createdAt, plus the matching day directories so the others are skipped"""
+    expression = None
+    for bound, op in ((since, 'ge'), (until, 'lt')):
+        if bound is None:
+            continue
+        bound = _naive_utc(bound)
+        moment = pa.scalar(bound, pa.timestamp('ms'))
+        day = bound.date().isoformat()
+        if op == 'ge':
+            # "undated" sorts after every date; its rows fail the createdAt test
+            condition = (ds.field('day') >= day) & (ds.field('createdAt') >= moment)
+        else:
+            condition = (ds.field('day') <= day) & (ds.field('createdAt') < moment)
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def _codes(column):
+    """int32 codes and the used values of a dictionary column (-1 for nulls)"""
+    values = column.to_pandas()
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype('category')
+    values = values.cat.remove_unused_categories()
+    return values.cat.codes.to_numpy().astype(np.int32), [str(value) for value in values.cat.categories]
+
+
+def _naive_utc(moment):
+    if moment.tzinfo is not None:
+        moment = moment.replace(tzinfo=None) - moment.utcoffset()
+    return moment
+
+
+def _orphans(path, manifest):
+    names = []
+    for directory in os.scandir(path):
+        if directory.is_dir() and directory.name.startswith('day='):
+            names.extend(f'{directory.name}/{entry.name}' for entry in os.scandir(directory.path))
+    return [name for name in names if name not in manifest['files']]
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Maintain the Parquet snapshots of the events collection')
+    parser.add_argument('--path', default=SNAPSHOT_DIR, help='snapshot directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='append the events created since the last export')
+    export_parser.add_argument('--batch-size', type=int, default=50000, help='events decoded from the cursor at a time')
+    export_parser.add_argument('--settle-seconds', type=int, default=SETTLE_SECONDS,
+                               help='leave events younger than this to the next export')
+    commands.add_parser('compact', help="merge each day's part files into one")
+    commands.add_parser('status', help='show what the snapshot holds')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        db = MongoClient(os.getenv('MONGO_URI'))['E-commerce']
+        report = export_events(db.events, args.path, batch_size=args.batch_size, settle_seconds=args.settle_seconds)
+        print(f"Exported {report['events']} events to {report['files']} files in {report['seconds']}s "
+              f"(watermark {report['watermark']})")
+    elif args.command == 'compact':
+        print(compact(args.path))
+    else:
+        print(json.dumps(status(args.path), indent=2))
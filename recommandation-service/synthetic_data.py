@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from bson import ObjectId
+
+CATEGORIES = ('Men', 'Women', 'Kids')
+SUB_CATEGORIES = ('Topwear', 'Bottomwear', 'Winterwear')
+# Share of each action in the generated event log
+ACTION_MIX = {'view': 0.7, 'add_to_cart': 0.15, 'purchase': 0.1, 'rating': 0.05}
+
+
+def power_law_sampler(n, alpha, rng):
+    """Sample indices in [0, n) with P(i) proportional to (i + 1) ** -alpha"""
+    weights = np.arange(1, n + 1, dtype=np.float64) ** -alpha
+    cumulative = np.cumsum(weights)
+    cumulative /= cumulative[-1]
+
+    def sample(size):
+        return np.minimum(np.searchsorted(cumulative, rng.random(size)), n - 1)
+    return sample
+
+
+def generate_catalog(collection, n_products, seed=0, batch_size=50000, now=None):
+    """Insert ``n_products`` products shaped like the backend's product model"""
+    rng = np.random.default_rng(seed)
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    product_ids = [ObjectId() for _ in range(n_products)]
+    for start in range(0, n_products, batch_size):
+        batch = product_ids[start:start + batch_size]
+        categories = rng.integers(len(CATEGORIES), size=len(batch))
+        sub_categories = rng.integers(len(SUB_CATEGORIES), size=len(batch))
+        prices = rng.integers(100, 5000, size=len(batch))
+        collection.insert_many([
+            {
+                '_id': pid,
+                'name': f'Product {start + i}',
+                'category': CATEGORIES[categories[i]],
+                'subCategory': SUB_CATEGORIES[sub_categories[i]],
+                'price': int(prices[i]),
+                'createdAt': now,
+                'updatedAt': now
+            }
+            for i, pid in enumerate(batch)
+        ], ordered=False)
+    return product_ids
+
+
+def generate_events(collection, product_ids, n_users, n_events, seed=0, product_alpha=1.1,
+                    user_alpha=0.8, days=60, batch_size=50000, now=None):
+    """Insert a power-law event log and return the user ids that were used.
+
+    A few products and a few users account for most events, as in real
+    traffic: product ``i`` is picked with weight ``(i + 1) ** -product_alpha``
+    and users likewise with ``user_alpha``. Timestamps are spread uniformly
+    over the last ``days`` days.
+    """
+    rng = np.random.default_rng(seed)
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    user_ids = [ObjectId() for _ in range(n_users)]
+    sample_product = power_law_sampler(len(product_ids), product_alpha, rng)
+    sample_user = power_law_sampler(n_users, user_alpha, rng)
+    actions = list(ACTION_MIX)
+    action_p = np.array(list(ACTION_MIX.values()))
+
+    for start in range(0, n_events, batch_size):
+        size = min(batch_size, n_events - start)
+        users = sample_user(size)
+        products = sample_product(size)
+        action_codes = rng.choice(len(actions), size=size, p=action_p)
+        ratings = rng.integers(1, 6, size=size)
+        seconds_ago = rng.integers(0, days * 86400, size=size)
+        collection.insert_many([
+            {
+                'userId': user_ids[users[i]],
+                'productId': product_ids[products[i]],
+                'action': actions[action_codes[i]],
+                'value': int(ratings[i]) if actions[action_codes[i]] == 'rating' else None,
+                'createdAt': now - timedelta(seconds=int(seconds_ago[i]))
+            }
+            for i in range(size)
+        ], ordered=False)
+    return user_ids
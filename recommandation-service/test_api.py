@@ -0,0 +1,282 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from flask_jwt_extended import create_access_token
+
+
+def get_recommendations(app_module, user_id):
+    with app_module.app.app_context():
+        token = create_access_token(identity=str(user_id))
+    client = app_module.app.test_client()
+    return client.get('/api/recommendations', headers={'Authorization': f'Bearer {token}'})
+
+
+def test_recommendations_require_a_token(service):
+    app_module, db, user_ids = service
+    response = app_module.app.test_client().get('/api/recommendations')
+    assert response.status_code == 401
+    assert response.get_json()['success'] is False
+
+
+def test_trained_user_gets_ml_recommendations(service):
+    app_module, db, user_ids = service
+    user_id = app_module.bundle.user_ids[0]
+    response = get_recommendations(app_module, user_id)
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['success'] is True
+    assert data['metadata']['strategy_used'] == 'ml'
+    assert data['metadata']['dropped_sources'] == {}
+    assert 0 < len(data['recommendations']) <= 10
+    assert len(set(data['recommendations'])) == len(data['recommendations'])
+
+    # Products the user already interacted with are not recommended again
+    seen = {str(e['productId']) for e in db.events.find({'userId': ObjectId(user_id)})}
+    assert not seen & set(data['recommendations'])
+
+
+def test_unknown_user_gets_fallback_recommendations(service):
+    app_module, db, user_ids = service
+    response = get_recommendations(app_module, ObjectId())
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['metadata']['strategy_used'] == 'popular'
+    assert data['metadata']['user_seen_count'] == 0
+    assert len(data['recommendations']) == 10
+
+
+def test_untrained_user_is_labelled_by_the_strategy_that_served_it(service, monkeypatch):
+    app_module, db, user_ids = service
+    user_id = ObjectId()
+    db.events.insert_one({'userId': user_id, 'productId': ObjectId(db.products.find_one()['_id']),
+                          # Before every watermark, so background refreshes ignore it
+                          'action': 'purchase', 'createdAt': datetime(2000, 1, 1)})
+    collaborative = app_module.candidate_pipeline.sources[1]
+
+    # Only "collaborative" when similar users returned candidates; the
+    # baseline reported it for every untrained user
+    monkeypatch.setattr(collaborative, 'fetch', lambda request: [])
+    data = get_recommendations(app_module, user_id).get_json()
+    assert data['metadata']['strategy_used'] == 'popular'
+
+    app_module.response_cache.invalidate(user_id)
+    neighbours = [str(p['_id']) for p in db.products.find().skip(1).limit(3)]
+    monkeypatch.setattr(collaborative, 'fetch', lambda request: neighbours)
+    data = get_recommendations(app_module, user_id).get_json()
+    assert data['metadata']['strategy_used'] == 'collaborative'
+    assert data['recommendations'][:3] == neighbours
+
+
+def test_requests_fail_fast_until_the_catalog_loads(service, monkeypatch):
+    import time
+
+    from catalog import CatalogWatcher
+
+    app_module, db, user_ids = service
+    # Never started, as when the products collection is unreachable at boot
+    monkeypatch.setattr(app_module, 'catalog_watcher', CatalogWatcher(db.products, app_module.bundle.engine))
+    started = time.perf_counter()
+    response = get_recommendations(app_module, app_module.bundle.user_ids[0])
+
+    assert response.status_code == 503
+    assert response.get_json()['success'] is False
+    assert time.perf_counter() - started < 1
+
+
+def test_status_and_ingest(service):
+    app_module, db, user_ids = service
+    client = app_module.app.test_client()
+
+    status = client.get('/api/status').get_json()['status']
+    assert status['model_loaded'] and status['service_ready']
+    assert status['catalog']['total_products'] == 60
+    assert status['model_info']['version'] == app_module.bundle.version
+
+    response = client.post('/api/events/ingest', json={'userIds': [str(user_ids[0])]})
+    assert response.status_code == 401
+    for key in ('service-kex', 'service-key-', 'sérvice-key'):
+        response = client.post('/api/events/ingest', json={'userIds': []}, headers={'X-Service-Key': key})
+        assert response.status_code == 401
+    response = client.post('/api/events/ingest', json={'userIds': [str(user_ids[0])]},
+                           headers={'X-Service-Key': 'service-key'})
+    assert response.get_json()['users'] == 1
+
+
+def test_repeated_requests_reuse_the_response(service):
+    app_module, db, user_ids = service
+    client = app_module.app.test_client()
+    user_id = app_module.bundle.user_ids[2]
+    before = app_module.response_cache.stats()
+
+    first = get_recommendations(app_module, user_id).get_json()
+    assert get_recommendations(app_module, user_id).get_json() == first
+    stats = app_module.response_cache.stats()
+    assert stats['computed'] == before['computed'] + 1 and stats['hits'] == before['hits'] + 1
+
+    # New events for the user drop the cached response
+    response = client.post('/api/events/ingest', json={'userIds': [user_id]}, headers={'X-Service-Key': 'service-key'})
+    assert response.get_json()['invalidated'] == 1
+    get_recommendations(app_module, user_id)
+    status = client.get('/api/status').get_json()['status']
+    assert status['response_cache']['computed'] == before['computed'] + 2
+    assert status['response_cache']['dedup_ratio'] > 0
+
+
+def test_table_answers_run_inline_and_are_never_shed(service, monkeypatch):
+    app_module, db, user_ids = service
+    table = app_module.bundle.topk_table
+    assert table is not None
+    user_id = app_module.bundle.user_ids[3]
+    # Even with every pool thread busy
+    monkeypatch.setattr(app_module.candidate_pipeline, 'max_pending', 0)
+    app_module.response_cache.invalidate(user_id)
+
+    data = get_recommendations(app_module, user_id).get_json()
+    assert data['metadata']['strategy_used'] == 'ml' and data['metadata']['dropped_sources'] == {}
+
+
+def test_late_ml_ranking_degrades_to_the_fallbacks(service, monkeypatch):
+    import threading
+
+    app_module, db, user_ids = service
+    ml_source = app_module.candidate_pipeline.sources[0]
+    release = threading.Event()
+    monkeypatch.setattr(ml_source, 'fetch', lambda request: release.wait(5) and [])
+    monkeypatch.setattr(app_module, 'RECOMMENDATION_DEADLINE_MS', 50)
+    user_id = app_module.bundle.user_ids[3]
+    # Scored online (on the pool) rather than read from the top-K table
+    if app_module.bundle.topk_table is not None:
+        row = app_module.bundle.engine.user_index[user_id]
+        monkeypatch.setattr(app_module.bundle, 'topk_table', app_module.bundle.topk_table.excluding([row]))
+    app_module.response_cache.invalidate(user_id)
+    before = app_module.response_cache.stats()['computed']
+
+    try:
+        data = get_recommendations(app_module, user_id).get_json()
+        assert data['metadata']['dropped_sources'] == {'ml': 'timed_out'}
+        assert data['metadata']['strategy_used'] in ('collaborative', 'popular')
+        assert len(data['recommendations']) == 10
+        # A degraded response is not reused
+        get_recommendations(app_module, user_id)
+        assert app_module.response_cache.stats()['computed'] == before + 2
+    finally:
+        release.set()
+    status = app_module.app.test_client().get('/api/status').get_json()['status']
+    assert status['candidate_pipeline']['sources']['ml']['timed_out'] >= 2
+
+
+def test_ingest_maintains_interactions(service, monkeypatch):
+    from test_interactions import BulkCollection
+
+    app_module, db, user_ids = service
+    monkeypatch.setattr(app_module, 'interactions_collection', BulkCollection(db.user_item_interactions))
+    monkeypatch.setattr(app_module, 'USE_INTERACTIONS_COLLECTION', True)
+    user_id, product_id = ObjectId(), ObjectId()
+    events = [{'userId': str(user_id), 'productId': str(product_id), 'action': action,
+               'createdAt': datetime.now(timezone.utc).isoformat()} for action in ('view', 'purchase')]
+
+    response = app_module.app.test_client().post('/api/events/ingest', json={'events': events},
+                                                 headers={'X-Service-Key': 'service-key'})
+    assert response.get_json()['pairs'] == 1
+    doc = db.user_item_interactions.find_one({'userId': user_id})
+    assert doc['events'] == 2 and doc['counts'] == {'view': 1, 'purchase': 1}
+    history = app_module.load_user_history(str(user_id))
+    assert history.liked_products == {str(product_id)}
+
+    # Not written while histories are read from the events
+    monkeypatch.setattr(app_module, 'USE_INTERACTIONS_COLLECTION', False)
+    response = app_module.app.test_client().post('/api/events/ingest', json={'events': events},
+                                                 headers={'X-Service-Key': 'service-key'})
+    assert response.get_json()['pairs'] == 0
+    assert db.user_item_interactions.find_one({'userId': user_id})['events'] == 2
+
+def test_ingest_rejects_bad_rating_values_but_keeps_the_batch(service, monkeypatch):
+    from test_interactions import BulkCollection
+
+    app_module, db, user_ids = service
+    monkeypatch.setattr(app_module, 'interactions_collection', BulkCollection(db.user_item_interactions))
+    monkeypatch.setattr(app_module, 'USE_INTERACTIONS_COLLECTION', True)
+    user_id = ObjectId()
+    products = [ObjectId() for _ in range(4)]
+    events = [{'userId': str(user_id), 'productId': str(pid), 'action': 'rating', 'value': value}
+              for pid, value in zip(products, (4, 'five', {}, '2.5'))]
+    events.append({'userId': str(user_id), 'productId': str(products[0]), 'action': 'purchase'})
+
+    response = app_module.app.test_client().post('/api/events/ingest', json={'events': events},
+                                                 headers={'X-Service-Key': 'service-key'})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['success'] is True
+    assert (data['pairs'], data['rejected']) == (2, 2)
+    docs = {doc['productId']: doc for doc in db.user_item_interactions.find({'userId': user_id})}
+    assert set(docs) == {products[0], products[3]}
+    assert docs[products[0]]['events'] == 2 and docs[products[3]]['ratingTotal'] == 2.5
+
+def test_metrics_endpoint(service):
+    app_module, db, user_ids = service
+    get_recommendations(app_module, app_module.bundle.user_ids[0])
+
+    response = app_module.app.test_client().get('/api/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    output = response.get_data(as_text=True)
+    version = app_module.bundle.version
+    assert f'recommendation_requests_total{{strategy="ml",model_version="{version}",status="200"}}' in output
+    assert 'recommendation_stage_seconds_count{stage="history"}' in output
+    assert f'recommendation_model_info{{version="{version}"}} 1' in output
+
+
+def test_batch_recommendations_stream_ndjson(service):
+    app_module, db, user_ids = service
+    client = app_module.app.test_client()
+    trained, unknown = app_module.bundle.user_ids[1], str(ObjectId())
+
+    response = client.post('/api/recommendations/batch', json={'userIds': [trained]})
+    assert response.status_code == 401
+    response = client.post('/api/recommendations/batch', json={'userIds': []},
+                           headers={'X-Service-Key': 'service-key'})
+    assert response.status_code == 400
+
+    response = client.post('/api/recommendations/batch', json={'userIds': [trained, 'not-an-id', unknown], 'k': 5},
+                           headers={'X-Service-Key': 'service-key'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line['userId'] for line in lines] == [trained, 'not-an-id', unknown]
+    assert lines[1]['success'] is False
+    assert lines[2]['strategy_used'] == 'popular' and len(lines[2]['recommendations']) == 5
+
+    single = get_recommendations(app_module, trained).get_json()
+    assert lines[0]['strategy_used'] == 'ml'
+    assert lines[0]['recommendations'] == single['recommendations'][:5]
+
+
+def test_popular_endpoint_follows_new_events(service):
+    app_module, db, user_ids = service
+    client = app_module.app.test_client()
+
+    response = client.get('/api/recommendations/popular?limit=5')
+    assert response.status_code == 200
+    popular = response.get_json()['recommendations']
+    assert len(popular) == 5
+    assert client.get('/api/recommendations/popular?limit=0').status_code == 400
+
+    category = db.products.find_one({'_id': ObjectId(popular[0])})['category']
+    in_category = client.get(f'/api/recommendations/popular?category={category}&exclude={popular[0]}').get_json()
+    assert popular[0] not in in_category['recommendations']
+    assert all(db.products.find_one({'_id': ObjectId(pid)})['category'] == category
+               for pid in in_category['recommendations'])
+
+    # A burst of purchases after training moves a product to the top
+    product = in_category['recommendations'][-1]
+    later = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=1)
+    db.events.insert_many([
+        {'userId': ObjectId(), 'productId': ObjectId(product), 'action': 'purchase', 'createdAt': later}
+        for _ in range(200)
+    ])
+    assert app_module.refresh_popularity() == 200
+    assert app_module.refresh_popularity() == 0
+    assert client.get('/api/recommendations/popular?limit=1').get_json()['recommendations'] == [product]
@@ -0,0 +1,104 @@
+import asyncio
+import importlib
+import json
+from datetime import datetime, timezone
+
+import mongomock
+from bson import ObjectId
+from flask_jwt_extended import create_access_token
+
+from cooccurrence import aggregate_similar_user_products, aggregate_similar_user_products_async
+
+
+class AsyncCollection:
+    """mongomock collection behind the find/aggregate/to_list shape of pymongo's AsyncCollection"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return _Cursor(self.collection.find(*args, **kwargs))
+
+    async def aggregate(self, pipeline):
+        return _Cursor(self.collection.aggregate(pipeline))
+
+
+class _Cursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    async def to_list(self, length=None):
+        return list(self.cursor)
+
+
+def call(asgi_app, method, path, headers=(), body=b''):
+    """Send one HTTP request through the ASGI app; returns (status, headers, body)"""
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'scheme': 'http',
+        'headers': [(b'host', b'localhost')] + [(k.lower().encode(), v.encode()) for k, v in headers]
+    }
+    asyncio.run(asgi_app(scope, receive, send))
+    return messages[0]['status'], dict(messages[0]['headers']), b''.join(m['body'] for m in messages[1:])
+
+
+def token_for(app_module, user_id):
+    with app_module.app.app_context():
+        return create_access_token(identity=str(user_id))
+
+
+def test_asgi_matches_the_flask_endpoints(service):
+    app_module, db, user_ids = service
+    asgi = importlib.import_module('asgi')
+    asgi_app = asgi.AsyncRecommendationApp(events_collection=AsyncCollection(db.events))
+    flask_client = app_module.app.test_client()
+
+    status, headers, body = call(asgi_app, 'GET', '/api/recommendations')
+    assert status == 401
+    assert body == flask_client.get('/api/recommendations').get_data()
+
+    for user_id in (app_module.bundle.user_ids[0], ObjectId()):
+        auth = ('Authorization', f'Bearer {token_for(app_module, user_id)}')
+        status, headers, body = call(asgi_app, 'GET', '/api/recommendations', [auth])
+        expected = flask_client.get('/api/recommendations', headers=[auth])
+        assert status == expected.status_code == 200
+        assert headers[b'content-type'] == b'application/json'
+        assert body == expected.get_data()
+
+    # Everything else is served by the Flask app
+    status, headers, body = call(asgi_app, 'GET', '/api/health')
+    assert status == 200
+    assert json.loads(body)['model_loaded'] is True
+
+    batch = json.dumps({'userIds': [str(uid) for uid in user_ids[:3]]}).encode()
+    status, headers, body = call(asgi_app, 'POST', '/api/recommendations/batch', [
+        ('Content-Type', 'application/json'), ('X-Service-Key', 'service-key'), ('Content-Length', str(len(batch)))
+    ], body=batch)
+    assert status == 200
+    assert [json.loads(line)['userId'] for line in body.splitlines()] == [str(uid) for uid in user_ids[:3]]
+
+
+def test_async_similar_user_products_match_the_sync_version():
+    events = mongomock.MongoClient()['E-commerce'].events
+    user, neighbor, other = ObjectId(), ObjectId(), ObjectId()
+    a, b, c, d = (ObjectId() for _ in range(4))
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    events.insert_many([
+        {'userId': user, 'productId': a, 'action': 'purchase', 'createdAt': now},
+        {'userId': neighbor, 'productId': a, 'action': 'purchase', 'createdAt': now},
+        {'userId': neighbor, 'productId': b, 'action': 'add_to_cart', 'createdAt': now},
+        {'userId': neighbor, 'productId': c, 'action': 'purchase', 'createdAt': now},
+        {'userId': other, 'productId': d, 'action': 'purchase', 'createdAt': now},
+    ])
+    liked, seen = {str(a)}, {str(a), str(c)}
+
+    expected = aggregate_similar_user_products(events, user, liked, seen)
+    result = asyncio.run(aggregate_similar_user_products_async(AsyncCollection(events), user, liked, seen))
+    assert result == expected == [str(b)]
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import numpy as np
+from bson import ObjectId
+
+from catalog import CatalogWatcher
+from scoring import ScoringEngine
+
+
+def make_engine(product_ids):
+    n = len(product_ids)
+    return ScoringEngine(
+        pu=np.zeros((1, 2)), qi=np.zeros((n, 2)), bu=np.zeros(1), bi=np.zeros(n),
+        global_mean=3.0, user_ids=['user'], item_ids=product_ids
+    )
+
+
+def test_poll_tracks_inserts_and_deletes():
+    products = mongomock.MongoClient().db.products
+    start = datetime(2025, 1, 1)
+    ids = [ObjectId() for _ in range(3)]
+    products.insert_many([{'_id': pid, 'updatedAt': start} for pid in ids])
+
+    engine = make_engine([str(ids[0]), str(ids[1]), 'retired_product'])
+    watcher = CatalogWatcher(products, engine, interval=60)
+    watcher.full_refresh()
+
+    snapshot = watcher.current()
+    assert len(snapshot) == 3
+    assert snapshot.active_mask.tolist() == [True, True, False]
+    assert snapshot.new_product_ids == (str(ids[2]),)
+
+    added = ObjectId()
+    products.insert_one({'_id': added, 'updatedAt': start + timedelta(minutes=5)})
+    watcher.poll()
+    assert str(added) in watcher.current()
+    assert watcher.current() is not snapshot
+
+    products.delete_one({'_id': ids[0]})
+    watcher.poll()
+    snapshot = watcher.current()
+    assert str(ids[0]) not in snapshot
+    assert snapshot.active_mask.tolist() == [False, True, False]
+
+
+def test_rebind_realigns_mask_with_new_model():
+    products = mongomock.MongoClient().db.products
+    ids = [ObjectId() for _ in range(2)]
+    products.insert_many([{'_id': pid, 'updatedAt': datetime(2025, 1, 1)} for pid in ids])
+
+    watcher = CatalogWatcher(products, make_engine([str(ids[0])]))
+    watcher.full_refresh()
+    watcher.rebind(make_engine([str(ids[1]), str(ids[0]), 'other']))
+
+    assert watcher.current().active_mask.tolist() == [True, True, False]
+    assert watcher.current().new_product_ids == ()
@@ -0,0 +1,90 @@
+import random
+
+import mongomock
+from bson import ObjectId
+
+from cooccurrence import ItemNeighborIndex, aggregate_similar_user_products, aggregate_similar_user_products_many
+from history_cache import POSITIVE_ACTIONS, UserHistory
+
+
+def make_events(seed=11, clusters=3, products_per_cluster=10, users_per_cluster=12):
+    """Users mostly buy inside their own cluster and browse everywhere"""
+    rng = random.Random(seed)
+    products = [[ObjectId() for _ in range(products_per_cluster)] for _ in range(clusters)]
+    all_products = [pid for cluster in products for pid in cluster]
+    users, events = [], []
+    for cluster in range(clusters):
+        for _ in range(users_per_cluster):
+            uid = ObjectId()
+            users.append((uid, cluster))
+            for pid in rng.sample(products[cluster], 4):
+                events.append({'userId': uid, 'productId': pid, 'action': rng.choice(POSITIVE_ACTIONS)})
+            for pid in rng.sample(all_products, 3):
+                events.append({'userId': uid, 'productId': pid, 'action': 'view'})
+    return products, users, events
+
+
+def test_item_neighbors_agree_with_event_aggregation():
+    products, users, events = make_events()
+    collection = mongomock.MongoClient().db.events
+    collection.insert_many([dict(e) for e in events])
+
+    positive = [e for e in events if e['action'] in POSITIVE_ACTIONS]
+    index = ItemNeighborIndex.build([str(e['userId']) for e in positive], [str(e['productId']) for e in positive])
+
+    agreements = []
+    for uid, cluster in users:
+        history = UserHistory.from_events(e for e in events if e['userId'] == uid)
+        cluster_ids = {str(pid) for pid in products[cluster]}
+
+        expected = aggregate_similar_user_products(
+            collection, str(uid), history.liked_products, history.seen_products, limit=5)
+        actual = index.recommend(history.liked_products, history.seen_products, limit=5)
+
+        assert actual and set(actual) <= cluster_ids
+        assert not set(actual) & history.seen_products
+        agreements.append(len(set(actual) & set(expected)) / max(1, len(expected)))
+
+    # Both rank the same cluster; they only differ on how ties are cut
+    assert sum(agreements) / len(agreements) >= 0.7
+
+
+def test_batched_aggregation_matches_per_user_aggregation():
+    products, users, events = make_events()
+    collection = mongomock.MongoClient().db.events
+    collection.insert_many([dict(e) for e in events])
+    histories = {str(uid): UserHistory.from_events(e for e in events if e['userId'] == uid) for uid, _ in users}
+
+    calls = []
+    aggregate = collection.aggregate
+    collection.aggregate = lambda pipeline, **options: calls.append(pipeline) or aggregate(pipeline, **options)
+    batched = aggregate_similar_user_products_many(
+        collection, {uid: h.liked_products for uid, h in histories.items()},
+        {uid: h.seen_products for uid, h in histories.items()}, limit=5)
+    assert len(calls) == 2 and set(batched) == set(histories)
+
+    agreements = []
+    for uid, _ in users:
+        history = histories[str(uid)]
+        expected = aggregate_similar_user_products(
+            collection, str(uid), history.liked_products, history.seen_products, limit=5)
+        actual = batched[str(uid)]
+        assert len(actual) == len(expected) and not set(actual) & history.seen_products
+        agreements.append(len(set(actual) & set(expected)) / max(1, len(expected)))
+    # Same ranking up to how ties are cut
+    assert sum(agreements) / len(agreements) >= 0.9
+
+
+def test_item_neighbors_round_trip_and_top_n(tmp_path):
+    users = ['u1', 'u1', 'u1', 'u2', 'u2', 'u3', 'u3']
+    items = ['a', 'b', 'c', 'a', 'b', 'a', 'c']
+    index = ItemNeighborIndex.build(users, items, top_n=1)
+    # 'a' is co-liked with 'b' twice and with 'c' twice; the tie keeps one
+    assert index.matrix[index.item_index['a']].nnz == 1
+
+    path = str(tmp_path / 'item_neighbors.npz')
+    index.save(path)
+    loaded = ItemNeighborIndex.load(path)
+    assert loaded.product_ids == ['a', 'b', 'c']
+    assert loaded.recommend({'b'}, set(), limit=5) == index.recommend({'b'}, set(), limit=5)
+    assert loaded.recommend({'unknown'}, set()) == []
@@ -0,0 +1,95 @@
+import json
+from datetime import datetime, timedelta
+
+import joblib
+import mongomock
+import numpy as np
+import pytest
+
+from evaluation import EVALUATION_FILE, evaluate_bundle, holdout_bundle, split_at
+from event_loader import load_events
+from model_store import METADATA_FILE
+from scoring import ScoringEngine
+from synthetic_data import generate_catalog, generate_events
+
+
+def test_metrics_and_cascade_on_a_known_ranking():
+    # Scores are the item biases, so every user ranks p0 > p1 > ... > p4
+    engine = ScoringEngine(np.zeros((2, 1)), np.zeros((5, 1)), np.zeros(2), np.array([5.0, 4, 3, 2, 1]), 0.0,
+                           ['u0', 'u1'], [f'p{i}' for i in range(5)])
+    cutoff = datetime(2025, 6, 1)
+    before, after = cutoff - timedelta(days=1), cutoff + timedelta(days=1)
+    db = mongomock.MongoClient().db
+    db.events.insert_many([
+        {'userId': 'u0', 'productId': 'p0', 'action': 'view', 'createdAt': before},
+        {'userId': 'u1', 'productId': 'p1', 'action': 'view', 'createdAt': before},
+        {'userId': 'u2', 'productId': 'p2', 'action': 'purchase', 'createdAt': before},
+        # u0 wants p2 and p4; u1 already saw p1, so only p0 counts; u2 is not in the model
+        {'userId': 'u0', 'productId': 'p2', 'action': 'purchase', 'createdAt': after},
+        {'userId': 'u0', 'productId': 'p4', 'action': 'add_to_cart', 'createdAt': after},
+        {'userId': 'u1', 'productId': 'p1', 'action': 'purchase', 'createdAt': after},
+        {'userId': 'u1', 'productId': 'p0', 'action': 'purchase', 'createdAt': after},
+        {'userId': 'u2', 'productId': 'p3', 'action': 'purchase', 'createdAt': after},
+        # Views are not relevant
+        {'userId': 'u1', 'productId': 'p3', 'action': 'view', 'createdAt': after},
+    ])
+    train_events, test_events = split_at(load_events(db.events), cutoff)
+
+    report = evaluate_bundle(holdout_bundle(engine, train_events), train_events, test_events, k=2,
+                             catalog_ids=[f'p{i}' for i in range(5)])
+    assert report['test'] == {'events': 6, 'users': 3, 'relevant_pairs': 4, 'users_in_model': 2}
+    # u0 gets [p1, p2]: one of two relevant items, at rank 2; u1 gets [p0, p2]
+    u0_ndcg = (1 / np.log2(3)) / (1 + 1 / np.log2(3))
+    assert report['model']['recall_at_2'] == pytest.approx((0.5 + 1) / 2, abs=1e-6)
+    assert report['model']['ndcg_at_2'] == pytest.approx((u0_ndcg + 1) / 2, abs=1e-6)
+    assert report['model']['hit_rate_at_2'] == 1.0 and report['model']['coverage'] == 0.6
+
+    cascade = report['cascade']
+    assert cascade['strategies']['ml']['users'] == 2 and cascade['strategies']['ml']['hit_rate'] == 1.0
+    # u2 has no co-liked products and falls back to popular ones, none of them p3
+    assert cascade['strategies']['popular'] == {'users': 1, 'share': pytest.approx(1 / 3, abs=1e-6),
+                                                'hit_rate': 0.0, 'recall_at_2': 0.0, 'ndcg_at_2': 0.0}
+    assert cascade['hit_rate'] == pytest.approx(2 / 3, abs=1e-6)
+
+
+def test_training_with_holdout_evaluation(tmp_path, monkeypatch):
+    import train
+
+    db = mongomock.MongoClient()['E-commerce']
+    product_ids = generate_catalog(db.products, 40, seed=6)
+    generate_events(db.events, product_ids, 60, 2500, seed=6)
+    monkeypatch.setattr(train, 'connect_to_database', lambda: db)
+    monkeypatch.setenv('TOPK_TABLE_SIZE', '0')
+
+    train.main(output_dir=str(tmp_path), engine_name='als', evaluate=True)
+    metadata = joblib.load(tmp_path / METADATA_FILE)
+    with open(tmp_path / EVALUATION_FILE) as f:
+        report = json.load(f)
+
+    assert report['mode'] == 'holdout' and report['engine'] == 'als' and report['catalog'] == 40
+    assert report['test']['users'] > 0 and report['cascade']['users'] == report['test']['users']
+    assert sum(s['users'] for s in report['cascade']['strategies'].values()) == report['test']['users']
+    assert 0 <= report['model']['recall_at_10'] <= 1 and 0 < report['model']['coverage'] <= 1
+    # The holdout replaces cross-validation as the source of the error metrics
+    assert metadata['model_params']['rmse'] == report['model']['rmse']
+    assert metadata['evaluation']['recall_at_10'] == report['model']['recall_at_10']
+
+
+def test_holdout_evaluation_is_skipped_for_pre_aggregated_interactions(tmp_path, monkeypatch):
+    import train
+    from interactions import INTERACTIONS_COLLECTION, backfill
+    from test_interactions import BulkCollection
+
+    db = mongomock.MongoClient()['E-commerce']
+    product_ids = generate_catalog(db.products, 40, seed=6)
+    generate_events(db.events, product_ids, 60, 2500, seed=6)
+    backfill(db.events, BulkCollection(db[INTERACTIONS_COLLECTION]), settle_seconds=0)
+    monkeypatch.setattr(train, 'connect_to_database', lambda: db)
+    monkeypatch.setenv('TOPK_TABLE_SIZE', '0')
+
+    train.main(output_dir=str(tmp_path), engine_name='als', from_interactions=True, evaluate=True)
+    metadata = joblib.load(tmp_path / METADATA_FILE)
+
+    assert not (tmp_path / EVALUATION_FILE).exists() and 'evaluation' not in metadata
+    # Cross-validated instead
+    assert metadata['model_params']['rmse'] > 0
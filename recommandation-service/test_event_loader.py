@@ -0,0 +1,78 @@
+import random
+from datetime import datetime, timedelta
+
+import mongomock
+import numpy as np
+import pandas as pd
+import pytest
+from bson import ObjectId
+
+from event_loader import load_events
+
+
+def legacy_aggregate(events_data, now):
+    """The pandas pipeline train.py used before streaming"""
+    df = pd.DataFrame(events_data)
+    df['userId'] = df['userId'].astype(str)
+    df['productId'] = df['productId'].astype(str)
+    action_weights = {'view': 1.0, 'add_to_cart': 3.5, 'purchase': 5.0, 'rating': 4.0}
+    df['rating'] = df['action'].apply(lambda x: action_weights.get(x, 1.0))
+    rating_mask = df['action'] == 'rating'
+    df.loc[rating_mask, 'rating'] = df.loc[rating_mask, 'value'].fillna(3.0)
+    df['createdAt'] = pd.to_datetime(df['createdAt'])
+    days_ago = (now - df['createdAt']).dt.days
+    df['rating'] = df['rating'] * (1 + (30 - days_ago.clip(0, 30)) / 30 * 0.3)
+    return df.groupby(['userId', 'productId'])['rating'].mean().to_dict()
+
+
+@pytest.fixture
+def events_data():
+    rng = random.Random(5)
+    now = datetime(2025, 6, 1, 12, 0)
+    users = [ObjectId() for _ in range(20)]
+    products = [ObjectId() for _ in range(30)]
+    events = []
+    for _ in range(600):
+        action = rng.choice(['view', 'view', 'add_to_cart', 'purchase', 'rating', 'search'])
+        events.append({
+            'userId': rng.choice(users),
+            'productId': rng.choice(products),
+            'action': action,
+            'value': rng.choice([None, 2, 5]) if action == 'rating' else None,
+            'createdAt': now - timedelta(hours=rng.randint(0, 24 * 60))
+        })
+    return now, events
+
+
+def test_streaming_aggregate_matches_pandas(events_data):
+    now, events = events_data
+    collection = mongomock.MongoClient().db.events
+    collection.insert_many([dict(e) for e in events])
+
+    columns = load_events(collection, batch_size=64)
+    assert len(columns) == len(events)
+    assert columns.user_codes.dtype == np.int32 and columns.timestamps.dtype == np.int64
+
+    pair_users, pair_items, ratings = columns.aggregate(now=now)
+    actual = {
+        (columns.user_ids[u], columns.product_ids[i]): r
+        for u, i, r in zip(pair_users, pair_items, ratings)
+    }
+    expected = legacy_aggregate(events, now)
+
+    assert actual.keys() == expected.keys()
+    for key, rating in expected.items():
+        assert actual[key] == pytest.approx(rating, rel=1e-6)
+
+
+def test_events_without_ids_are_skipped():
+    collection = mongomock.MongoClient().db.events
+    collection.insert_many([
+        {'userId': ObjectId(), 'action': 'search'},
+        {'sessionId': 'anonymous', 'productId': ObjectId(), 'action': 'view'},
+        {'userId': ObjectId(), 'productId': ObjectId(), 'action': 'view'},
+    ])
+
+    columns = load_events(collection)
+    assert len(columns) == 1
+    assert columns.ratings().tolist() == [1.0]
@@ -0,0 +1,80 @@
+import json
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from surprise import Dataset, Reader, SVD
+
+from flat_model import FLAT_MODEL_DIR, MANIFEST_FILE, load_flat_model, save_flat_model
+from model_store import METADATA_FILE, MODEL_FILE, POPULAR_PRODUCTS_FILE, ModelBundle
+from scoring import ScoringEngine
+
+
+@pytest.fixture(scope='module')
+def engine_and_algo():
+    rng = np.random.default_rng(3)
+    rows = [
+        {'userId': f'user_{u}', 'productId': f'product_{p}', 'rating': float(rng.choice([1.0, 3.5, 5.0]))}
+        for u in range(20) for p in rng.choice(30, size=8, replace=False)
+    ]
+    df = pd.DataFrame(rows)
+    data = Dataset.load_from_df(df[['userId', 'productId', 'rating']], Reader(rating_scale=(1, 5)))
+    algo = SVD(n_factors=6, n_epochs=10, random_state=1)
+    algo.fit(data.build_full_trainset())
+    engine = ScoringEngine.from_surprise(algo, df['productId'].unique().tolist(), df['userId'].unique().tolist())
+    return engine, algo
+
+
+def test_flat_model_round_trip_is_memory_mapped(engine_and_algo, tmp_path):
+    engine, algo = engine_and_algo
+    path = str(tmp_path / FLAT_MODEL_DIR)
+    save_flat_model(engine, path)
+
+    loaded = load_flat_model(path, verify=True)
+    assert isinstance(loaded.qi, np.memmap) and isinstance(loaded.pu, np.memmap)
+    assert loaded.user_ids == engine.user_ids and loaded.item_ids == engine.item_ids
+    for uid in engine.user_ids[:5]:
+        np.testing.assert_array_equal(loaded.score_user(uid), engine.score_user(uid))
+        assert loaded.top_k(uid, 5) == engine.top_k(uid, 5)
+
+
+def test_flat_model_rejects_corrupt_files(engine_and_algo, tmp_path):
+    engine, algo = engine_and_algo
+    path = str(tmp_path / FLAT_MODEL_DIR)
+    save_flat_model(engine, path)
+
+    qi = np.load(os.path.join(path, 'qi.npy'))
+    np.save(os.path.join(path, 'qi.npy'), qi + 1)
+    with pytest.raises(ValueError, match='Checksum'):
+        load_flat_model(path, verify=True)
+
+    np.save(os.path.join(path, 'qi.npy'), qi[:-1])
+    with pytest.raises(ValueError, match='manifest'):
+        load_flat_model(path)
+
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    manifest['format_version'] = 99
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+    with pytest.raises(ValueError, match='Unsupported'):
+        load_flat_model(path)
+
+
+def test_bundle_prefers_flat_model_and_falls_back_to_joblib(engine_and_algo, tmp_path):
+    engine, algo = engine_and_algo
+    metadata = {'product_ids': engine.item_ids, 'user_ids': engine.user_ids, 'trained_at': '2025-06-01T00:00:00'}
+    joblib.dump(algo, tmp_path / MODEL_FILE)
+    joblib.dump(metadata, tmp_path / METADATA_FILE)
+    joblib.dump(engine.item_ids[:5], tmp_path / POPULAR_PRODUCTS_FILE)
+
+    legacy = ModelBundle.load(str(tmp_path))
+    assert legacy.model is not None and legacy.loaded
+
+    save_flat_model(engine, str(tmp_path / FLAT_MODEL_DIR))
+    flat = ModelBundle.load(str(tmp_path))
+    assert flat.model is None and flat.loaded
+    uid = engine.user_ids[0]
+    np.testing.assert_array_equal(flat.engine.score_user(uid), legacy.engine.score_user(uid))
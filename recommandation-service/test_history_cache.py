@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+
+from history_cache import HistoryCache, UserHistory
+
+
+def test_user_history_from_events():
+    history = UserHistory.from_events([
+        {'productId': 'a', 'action': 'view'},
+        {'productId': 'a', 'action': 'purchase'},
+        {'productId': 'b', 'action': 'add_to_cart'},
+        {'productId': 'c', 'action': 'search'},
+    ])
+    assert history.seen_products == {'a', 'b', 'c'}
+    assert history.product_scores == {'a': 11, 'b': 5, 'c': 1}
+    assert history.liked_products == {'a', 'b'}
+
+
+def test_cache_hits_evictions_and_invalidation():
+    loads = []
+
+    def loader(user_id):
+        loads.append(user_id)
+        return UserHistory({user_id: 1}, [])
+
+    cache = HistoryCache(loader, max_size=2, ttl=60)
+    cache.get('u1')
+    cache.get('u1')
+    cache.get('u2')
+    cache.get('u3')  # evicts u1, the least recently used
+
+    assert loads == ['u1', 'u2', 'u3']
+    assert cache.invalidate('u3')
+    assert not cache.invalidate('u1')
+    cache.get('u1')
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['invalidations']) == (1, 4, 1, 1)
+
+
+def test_cache_entries_expire():
+    cache = HistoryCache(lambda user_id: UserHistory({}, []), ttl=0.01)
+    first = cache.get('u1')
+    time.sleep(0.02)
+    assert cache.get('u1') is not first
+    assert cache.stats()['expirations'] == 1
+
+
+def test_invalidation_during_load_is_not_cached():
+    cache = HistoryCache(lambda user_id: cache.invalidate(user_id) or UserHistory({}, []))
+    cache.get('u1')
+    assert cache.stats()['size'] == 0
+
+
+def test_invalidation_reaches_every_concurrent_load():
+    started = threading.Semaphore(0)
+    release = [threading.Event(), threading.Event()]
+    loads = []
+
+    def loader(user_id):
+        n = len(loads)
+        loads.append(n)
+        if n < 2:
+            started.release()
+            release[n].wait(5)
+        return UserHistory({f'load{n}': 1}, [])
+
+    cache = HistoryCache(loader, ttl=60)
+    threads = []
+    for _ in range(2):
+        threads.append(threading.Thread(target=cache.get, args=('u1',)))
+        threads[-1].start()
+        assert started.acquire(timeout=5)
+    # New events arrive while both loads are reading the old history
+    cache.invalidate('u1')
+    for event, thread in zip(release, threads):
+        event.set()
+        thread.join(5)
+
+    assert cache.stats()['size'] == 0
+    assert cache.get('u1').seen_products == {'load2'}
+    assert cache.get('u1').seen_products == {'load2'}
+
+
+def test_async_get_shares_the_cache():
+    cache = HistoryCache(lambda user_id: UserHistory({'sync': 1}, []))
+
+    async def load(user_id):
+        return UserHistory({'async': 1}, [])
+
+    first = asyncio.run(cache.get_async('u1', load))
+    assert first.seen_products == {'async'}
+    assert cache.get('u1') is first
+
+    async def load_and_invalidate(user_id):
+        cache.invalidate(user_id)
+        return UserHistory({}, [])
+
+    asyncio.run(cache.get_async('u2', load_and_invalidate))
+    assert cache.stats()['size'] == 1
@@ -0,0 +1,46 @@
+import numpy as np
+from bson import ObjectId
+
+from id_registry import IdRegistry
+
+
+def test_object_ids_are_stored_as_raw_bytes():
+    ids = [str(ObjectId()) for _ in range(50)]
+    # Trailing zero bytes are dropped by fixed-width arrays and must come back
+    ids.append('65f0c0ffee00000000000000')
+    registry = IdRegistry.of(ids)
+
+    assert registry.kind == 'objectid' and registry.ids.dtype == 'S12'
+    assert list(registry) == ids and registry[-1] == ids[-1] and registry[1:3] == ids[1:3]
+    assert all(registry.index[value] == code for code, value in enumerate(ids))
+    missing = str(ObjectId())
+    assert missing not in registry and 'not-an-id' not in registry.index
+    assert registry.codes([ids[7], missing, ids[-1], 'x']).tolist() == [7, -1, len(ids) - 1, -1]
+
+
+def test_sorted_ids_need_no_search_order():
+    ids = sorted(str(ObjectId()) for _ in range(20))
+    assert IdRegistry.of(ids).order is None
+    shuffled = IdRegistry.of(ids[::-1])
+    assert shuffled.order is not None and shuffled.code(ids[0]) == 19
+
+
+def test_extended_keeps_existing_codes():
+    ids = sorted(str(ObjectId()) for _ in range(10))
+    registry = IdRegistry.of(ids[1:])
+    grown = registry.extended([ids[0]])
+    assert grown.kind == 'objectid' and grown.code(ids[0]) == 9
+    assert np.array_equal(grown.codes(ids[1:]), registry.codes(ids[1:]))
+    assert registry.code(ids[0]) == -1
+
+    # Any other id switches the whole table to UTF-8
+    mixed = grown.extended(['guest_user'])
+    assert mixed.kind == 'utf-8' and list(mixed) == ids[1:] + [ids[0], 'guest_user']
+    assert mixed.code('guest_user') == 10 and mixed.code(ids[0]) == 9
+
+
+def test_other_ids_fall_back_to_utf8():
+    registry = IdRegistry.of(['user_b', 'usér_a', 'ABCDEF0123456789ABCDEF01'])
+    assert registry.kind == 'utf-8'
+    assert registry == ['user_b', 'usér_a', 'ABCDEF0123456789ABCDEF01']
+    assert registry.codes(['usér_a', 'user_c', 'a_much_longer_id_than_any']).tolist() == [1, -1, -1]
@@ -0,0 +1,132 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+import numpy as np
+import pandas as pd
+import pytest
+from bson import ObjectId
+from surprise import Dataset, Reader, SVD
+
+from event_loader import load_events
+from incremental import apply_to_surprise, fold_in, metadata_watermark
+from model_store import ModelBundle
+from scoring import ScoringEngine
+from topk_table import build_topk_table
+
+
+@pytest.fixture
+def trained():
+    """A small SVD trained on ObjectId strings, like train.py produces"""
+    rng = random.Random(11)
+    users = [str(ObjectId()) for _ in range(30)]
+    products = [str(ObjectId()) for _ in range(40)]
+    rows = []
+    for uid in users:
+        for pid in rng.sample(products, 10):
+            rows.append({'userId': uid, 'productId': pid, 'rating': rng.choice([1.0, 3.5, 4.0, 5.0])})
+    df = pd.DataFrame(rows)
+
+    data = Dataset.load_from_df(df[['userId', 'productId', 'rating']], Reader(rating_scale=(1, 5)))
+    algo = SVD(n_factors=8, n_epochs=20, lr_all=0.005, reg_all=0.02, random_state=3)
+    algo.fit(data.build_full_trainset())
+    return algo, users, products
+
+
+def new_events(users, products, now):
+    """A new user with a few purchases and views, plus a brand-new product"""
+    new_user, new_product = ObjectId(), ObjectId()
+    events = [
+        {'userId': new_user, 'productId': ObjectId(pid), 'action': action, 'createdAt': now}
+        for pid, action in zip(products[:6], ['purchase'] * 3 + ['view'] * 3)
+    ]
+    events += [
+        {'userId': ObjectId(uid), 'productId': new_product, 'action': 'add_to_cart', 'createdAt': now}
+        for uid in users[:3]
+    ]
+    return str(new_user), str(new_product), events
+
+
+def test_fold_in_makes_new_users_and_products_scorable(trained):
+    algo, users, products = trained
+    engine = ScoringEngine.from_surprise(algo, products, users)
+    now = datetime(2025, 6, 1, 12, 0)
+    new_user, new_product, events_data = new_events(users, products, now)
+
+    collection = mongomock.MongoClient().db.events
+    collection.insert_many(events_data)
+    updated, summary = fold_in(engine, load_events(collection), now=now)
+
+    assert summary['new_users'] == 1 and summary['new_items'] == 1
+    assert summary['events_watermark'] == now
+    assert updated.has_user(new_user) and not engine.has_user(new_user)
+    assert updated.item_ids[-1] == new_product
+
+    scores = updated.score_user(new_user)
+    assert np.isfinite(scores).all()
+    # Purchased products should score above merely viewed ones for the new user
+    purchased = updated.item_mask(products[:3])
+    viewed = updated.item_mask(products[3:6])
+    assert scores[purchased].mean() > scores[viewed].mean()
+
+    # Users who were not part of the new events keep their factors
+    untouched = engine.user_index[users[-1]]
+    np.testing.assert_array_equal(updated.pu[untouched], engine.pu[untouched])
+    # The others only move by a few SGD steps
+    touched = engine.user_index[users[0]]
+    assert np.abs(updated.pu[touched] - engine.pu[touched]).max() < 0.1
+
+
+def test_untouched_users_keep_valid_topk_rows(trained):
+    algo, users, products = trained
+    engine = ScoringEngine.from_surprise(algo, products, users)
+    table, _ = build_topk_table(engine, k=10)
+    bundle = ModelBundle(None, {}, [], engine, topk_table=table)
+    now = datetime(2025, 6, 1, 12, 0)
+    new_user, new_product, events_data = new_events(users, products, now)
+
+    collection = mongomock.MongoClient().db.events
+    collection.insert_many(events_data)
+    events = load_events(collection)
+    updated, summary = fold_in(engine, events, now=now)
+    bundle = bundle.with_engine(updated, summary['events_watermark'], summary, changed_users=events.user_ids)
+
+    # Existing items are frozen, so the ANN index and the table still line up
+    np.testing.assert_array_equal(updated.qi[:engine.n_items], engine.qi)
+    np.testing.assert_array_equal(updated.bi[:engine.n_items], engine.bi)
+    allowed = np.ones(updated.n_items, dtype=bool)
+    for uid in users[3:]:
+        row = updated.user_index[uid]
+        expected = [updated.item_index[pid] for pid, score in updated.top_k(uid, 10, candidates=range(engine.n_items))]
+        assert table.indices[row].tolist() == expected
+        # The product folded in is ranked in as well
+        rows = bundle.topk_table.recommend(row, allowed, 6, engine=updated)
+        assert rows.tolist() == [updated.item_index[pid] for pid, score in updated.top_k(uid, 6)]
+    assert bundle.topk_table.recommend(updated.user_index[users[0]], allowed, 6, engine=updated) is None
+
+
+def test_apply_to_surprise_matches_engine(trained):
+    algo, users, products = trained
+    engine = ScoringEngine.from_surprise(algo, products, users)
+    now = datetime(2025, 6, 1, 12, 0)
+    new_user, new_product, events_data = new_events(users, products, now - timedelta(days=1))
+
+    collection = mongomock.MongoClient().db.events
+    collection.insert_many(events_data)
+    updated, summary = fold_in(engine, load_events(collection), now=now)
+    apply_to_surprise(algo, updated)
+
+    for uid in (new_user, users[0]):
+        for pid in (new_product, products[0]):
+            prediction = algo.predict(uid, pid)
+            assert not prediction.details['was_impossible']
+            assert prediction.est == pytest.approx(updated.score_user(uid)[updated.item_index[pid]])
+
+
+def test_watermark_falls_back_to_training_time_in_utc():
+    trained_at = datetime(2025, 6, 1, 12, 0)
+    assert metadata_watermark({'events_watermark': trained_at, 'trained_at': 'unused'}) == trained_at
+    assert metadata_watermark({'events_watermark': None, 'trained_at': '2025-06-01T14:00:00+02:00'}) == trained_at
+    # Metadata from before trained_at carried an offset was written in local time
+    local = trained_at.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    assert metadata_watermark({'trained_at': local.isoformat()}) == trained_at
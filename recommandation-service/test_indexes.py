@@ -0,0 +1,63 @@
+import mongomock
+from pymongo import ASCENDING
+
+from indexes import REQUIRED_INDEXES, ensure_required_indexes, plan_summary, provision
+
+
+def test_missing_indexes_are_created_once():
+    db = mongomock.MongoClient()['E-commerce']
+    # Same keys under another name already serve the watermark reads
+    db.events.create_index([('createdAt', ASCENDING)], name='by_created_at')
+
+    dry_run = ensure_required_indexes(db, create=False)
+    assert dry_run['present'] == ['events.createdAt_1']
+    assert len(dry_run['missing']) == len(REQUIRED_INDEXES) - 1 and not dry_run['created']
+
+    first = ensure_required_indexes(db)
+    assert sorted(first['created']) == sorted(dry_run['missing'])
+    assert db.user_item_interactions.index_information()['userId_1_productId_1']['unique']
+
+    second = ensure_required_indexes(db)
+    assert not second['created'] and not second['missing'] and len(second['present']) == len(REQUIRED_INDEXES)
+
+
+def test_plan_summary_classifies_explain_output():
+    covered = {'queryPlanner': {'winningPlan': {
+        'stage': 'PROJECTION_COVERED',
+        'inputStage': {'stage': 'IXSCAN', 'indexName': 'userId_1_action_1_productId_1'}
+    }}}
+    fetched = {'queryPlanner': {'winningPlan': {
+        'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'createdAt_1'}
+    }}}
+    scanned = {'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN'}},
+               'executionStats': {'executionStages': {'stage': 'COLLSCAN'}}}
+    # Aggregations nest the find plan under their $cursor stage
+    pipeline = {'stages': [
+        {'$cursor': {'queryPlanner': {'winningPlan': covered['queryPlanner']['winningPlan']}}},
+        {'$group': {}}
+    ]}
+    # The slot-based engine wraps the plan tree in queryPlan
+    slot_based = {'queryPlanner': {'winningPlan': {
+        'queryPlan': {'stage': 'GROUP', 'inputStage': {'stage': 'FETCH', 'inputStage': {
+            'stage': 'IXSCAN', 'indexName': 'productId_1_action_1_userId_1'}}}},
+        'slotBasedPlan': {'stages': '[2] group ...'}
+    }}
+
+    assert plan_summary(covered) == {'plan': 'covered', 'stages': ['PROJECTION_COVERED', 'IXSCAN'],
+                                     'indexes': ['userId_1_action_1_productId_1']}
+    assert plan_summary(fetched)['plan'] == 'index'
+    assert plan_summary(scanned) == {'plan': 'collscan', 'stages': ['COLLSCAN'], 'indexes': []}
+    assert plan_summary(pipeline)['plan'] == 'covered'
+    assert plan_summary(slot_based)['indexes'] == ['productId_1_action_1_userId_1']
+    assert plan_summary(slot_based)['plan'] == 'index'
+    assert plan_summary({'queryPlanner': {'winningPlan': {'stage': 'EOF'}}})['plan'] == 'empty'
+
+
+def test_provision_reports_queries_it_cannot_explain():
+    db = mongomock.MongoClient()['E-commerce']
+    report = provision(db)
+    assert len(report['indexes']['created']) == len(REQUIRED_INDEXES)
+    # mongomock has no explain; every query is reported instead of raising
+    assert set(report['queries']) >= {'user_history', 'similar_users', 'liked_products', 'new_events'}
+    assert all(summary['plan'] == 'error' and not summary['ok'] for summary in report['queries'].values())
+    assert report['collection_scans'] == []
@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+import numpy as np
+import pytest
+from bson import ObjectId
+from pymongo import ReplaceOne
+
+from event_loader import load_events
+from history_cache import UserHistory
+from interactions import apply_events, backfill, check, load_interactions
+from synthetic_data import generate_catalog, generate_events
+
+
+class BulkCollection:
+    """mongomock collection whose bulk_write accepts UpdateOne/ReplaceOne upserts"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def bulk_write(self, operations, ordered=True):
+        for op in operations:
+            if isinstance(op, ReplaceOne):
+                self.collection.replace_one(op._filter, op._doc, upsert=op._upsert)
+            else:
+                self.collection.update_one(op._filter, op._doc, upsert=op._upsert)
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient()['E-commerce']
+    product_ids = generate_catalog(db.products, 30, seed=4)
+    generate_events(db.events, product_ids, 20, 600, seed=4)
+    return db
+
+
+def sorted_pairs(collection):
+    docs = collection.find({}, {'_id': 0})
+    return sorted(docs, key=lambda doc: (str(doc['userId']), str(doc['productId'])))
+
+
+def test_backfill_and_incremental_updates_agree(db):
+    rebuilt = BulkCollection(db.rebuilt)
+    assert backfill(db.events, rebuilt)['pairs'] > 0
+    assert check(db.events, rebuilt, sample=50)['consistent']
+
+    incremental = BulkCollection(db.incremental)
+    events = list(db.events.find().sort('createdAt', 1))
+    for start in range(0, len(events), 97):
+        apply_events(incremental, events[start:start + 97], batch_size=10)
+
+    report = check(db.events, incremental, sample=50)
+    assert report['consistent'] and report['pairs'] == db.rebuilt.count_documents({})
+
+
+def test_check_finds_and_repairs_drift(db):
+    collection = BulkCollection(db.user_item_interactions)
+    backfill(db.events, collection)
+    tampered = db.user_item_interactions.find_one()
+    db.user_item_interactions.update_one({'_id': tampered['_id']}, {'$inc': {'score': 3}})
+    removed = db.user_item_interactions.find_one({'userId': {'$ne': tampered['userId']}})
+    db.user_item_interactions.delete_one({'_id': removed['_id']})
+    db.user_item_interactions.insert_one({'userId': tampered['userId'], 'productId': ObjectId(), 'events': 1})
+
+    users = [tampered['userId'], removed['userId']]
+    report = check(db.events, collection, user_ids=users, repair=True)
+    assert (report['missing'], report['extra'], report['mismatched']) == (1, 1, 1)
+    assert report['repaired'] == 3
+    assert check(db.events, collection, user_ids=users)['consistent']
+
+
+def test_histories_match_raw_events(db):
+    collection = BulkCollection(db.user_item_interactions)
+    backfill(db.events, collection)
+    for user_id in db.events.distinct('userId')[:5]:
+        expected = UserHistory.from_events(db.events.find({'userId': user_id}))
+        history = UserHistory.from_interactions(collection.find({'userId': user_id}))
+        assert history.product_scores == expected.product_scores
+        assert history.liked_products == expected.liked_products
+
+
+def test_training_ratings_match_raw_events():
+    db = mongomock.MongoClient()['E-commerce']
+    now = datetime(2025, 6, 1)
+    rng = np.random.default_rng(5)
+    users, products = [ObjectId() for _ in range(8)], [ObjectId() for _ in range(12)]
+    actions = ['view', 'add_to_cart', 'purchase', 'rating', 'wishlist']
+    # Every pair's events fall on one day, so the lastSeen boost is exact
+    days_ago = {(u, p): int(rng.integers(60)) for u in range(8) for p in range(12)}
+    db.events.insert_many([
+        {'userId': users[u], 'productId': products[p], 'action': actions[rng.integers(5)],
+         'value': int(rng.integers(1, 6)), 'createdAt': now - timedelta(days=days_ago[u, p], minutes=int(m))}
+        for u, p, m in zip(rng.integers(8, size=300), rng.integers(12, size=300), rng.integers(600, size=300))
+    ])
+    collection = BulkCollection(db.user_item_interactions)
+    apply_events(collection, db.events.find())
+
+    events, pairs = load_events(db.events), load_interactions(collection)
+    assert len(pairs) == len(events) == 300
+
+    def ratings_by_pair(columns):
+        user_codes, item_codes, ratings = columns.aggregate(now)
+        return {(columns.user_ids[u], columns.product_ids[i]): r for u, i, r in zip(user_codes, item_codes, ratings)}
+
+    expected, actual = ratings_by_pair(events), ratings_by_pair(pairs)
+    assert expected.keys() == actual.keys()
+    assert all(np.isclose(actual[key], expected[key]) for key in expected)
+    assert np.isclose(pairs.action_weights().sum(), events.action_weights().sum())
+
+
+def test_backfill_and_repair_keep_concurrent_ingest_updates(db):
+    collection = BulkCollection(db.user_item_interactions)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    user_id, product_id = db.events.find_one()['userId'], db.events.find_one()['productId']
+
+    # Ingest is running: a new event reached the pair before the backfill did
+    fresh = {'userId': user_id, 'productId': product_id, 'action': 'purchase', 'createdAt': now}
+    db.events.insert_one(dict(fresh))
+    apply_events(collection, [fresh])
+    backfill(db.events, collection, now=now)
+    assert check(db.events, collection, sample=50, now=now + timedelta(hours=1))['consistent']
+    doc = db.user_item_interactions.find_one({'userId': user_id, 'productId': product_id})
+    assert doc['events'] == db.events.count_documents({'userId': user_id, 'productId': product_id})
+
+    # Pairs that ingest updates after the cutoff are not rewritten from the events
+    db.user_item_interactions.update_one({'_id': doc['_id']}, {'$inc': {'score': 3}})
+    later = dict(fresh, createdAt=now + timedelta(hours=1))
+    db.events.insert_one(dict(later))
+    apply_events(collection, [later])
+    report = check(db.events, collection, user_ids=[user_id], repair=True, now=later['createdAt'])
+    assert report['active'] == 1 and report['repaired'] == 0
+    # Once they settle, they are
+    report = check(db.events, collection, user_ids=[user_id], repair=True, now=now + timedelta(hours=2))
+    assert report['mismatched'] == 1 and report['repaired'] == 1
+    assert check(db.events, collection, user_ids=[user_id], now=now + timedelta(hours=2))['consistent']
@@ -0,0 +1,68 @@
+import time
+from types import SimpleNamespace
+
+from metrics import MetricsRegistry, RequestTracer
+from profiling import SamplingProfiler, SlowRequestRecorder
+
+
+def test_registry_renders_text_exposition_format():
+    registry = MetricsRegistry()
+    requests = registry.counter('requests_total', 'Requests served', ('strategy',))
+    latency = registry.histogram('request_seconds', 'Request latency', buckets=(0.1, 1.0))
+    registry.gauge('model_info', 'Serving model', lambda: [({'version': 'v"1'}, 1)])
+
+    requests.inc(strategy='ml')
+    requests.inc(2, strategy='ml')
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(3.0)
+
+    lines = registry.render().splitlines()
+    assert '# TYPE requests_total counter' in lines
+    assert 'requests_total{strategy="ml"} 3' in lines
+    assert 'request_seconds_bucket{le="0.1"} 1' in lines
+    assert 'request_seconds_bucket{le="1.0"} 2' in lines
+    assert 'request_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'request_seconds_count 3' in lines
+    assert 'request_seconds_sum 3.55' in lines
+    assert 'model_info{version="v\\"1"} 1' in lines
+
+
+def test_tracer_times_stages_and_counts_mongo_commands():
+    registry = MetricsRegistry()
+    tracer = RequestTracer(registry)
+
+    with tracer.trace() as trace:
+        with tracer.stage('history'):
+            tracer.listener.started(SimpleNamespace(command_name='find'))
+        with tracer.stage('scoring'):
+            pass
+    # Outside a trace commands are still counted, but not per request
+    tracer.listener.started(SimpleNamespace(command_name='find'))
+
+    assert set(trace.stages) == {'history', 'scoring'}
+    assert trace.mongo_round_trips == 1
+    assert tracer.current() is None
+    output = registry.render()
+    assert 'recommendation_mongo_commands_total{command="find"} 2' in output
+    assert 'recommendation_stage_seconds_count{stage="history"} 1' in output
+
+
+def test_profiler_keeps_the_slowest_requests(tmp_path):
+    profiler = SamplingProfiler(interval=0.001)
+    token = profiler.start()
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+    stacks = profiler.stop(token)
+    assert stacks
+    assert any('test_profiler_keeps_the_slowest_requests' in stack for stack in stacks)
+
+    recorder = SlowRequestRecorder(str(tmp_path), keep=2)
+    assert recorder.offer(0.2, stacks) is not None
+    assert recorder.offer(0.1, stacks) is not None
+    assert recorder.offer(0.3, stacks) is not None
+    assert recorder.offer(0.05, stacks) is None
+
+    assert [p['seconds'] for p in recorder.profiles()] == [0.3, 0.2]
+    assert len(list(tmp_path.iterdir())) == 2
@@ -0,0 +1,128 @@
+import time
+
+import joblib
+
+from jobs import RetrainJobManager
+from model_store import LEGACY_VERSION, METADATA_FILE, MODEL_FILE, POPULAR_PRODUCTS_FILE, ModelStore
+
+# Stands in for train.py: writes placeholder artifacts into --output-dir
+FAKE_TRAINER = '''
+import os, sys, time
+import joblib
+output_dir = sys.argv[sys.argv.index('--output-dir') + 1]
+time.sleep(float(os.environ.get('FAKE_TRAIN_SECONDS', '0')))
+if os.environ.get('FAKE_TRAIN_FAIL'):
+    sys.exit('boom')
+for name in ('recommendation_model.joblib', 'model_metadata.joblib', 'popular_products.joblib'):
+    joblib.dump({}, os.path.join(output_dir, name))
+'''
+
+
+def write_version(store):
+    version = store.create_version()
+    for name in (MODEL_FILE, METADATA_FILE, POPULAR_PRODUCTS_FILE):
+        joblib.dump({}, f'{store.path(version)}/{name}')
+    return version
+
+
+def wait_for(job, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert job.finished
+
+
+def test_store_tracks_active_version_and_prunes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = ModelStore(str(tmp_path / 'models'), keep=2)
+    assert store.current_version() is None
+
+    # Models trained before versioning are served from the working directory
+    for name in (MODEL_FILE, METADATA_FILE, POPULAR_PRODUCTS_FILE):
+        joblib.dump({}, tmp_path / name)
+    assert store.current_version() == LEGACY_VERSION
+
+    first, second = write_version(store), write_version(store)
+    # Incomplete directories (training still running) are ignored
+    store.create_version()
+    assert store.versions() == [first, second]
+    assert store.current_version() == second
+
+    store.activate(first)
+    assert store.current_version() == first
+    assert store.previous_version(second) == first
+
+    third = write_version(store)
+    store.activate(third)
+    # keep=2 drops the oldest directories but never the active one
+    assert store.versions() == [third]
+    assert store.current_version() == third
+
+
+def test_job_manager_runs_one_trainer_at_a_time(tmp_path, monkeypatch):
+    script = tmp_path / 'fake_train.py'
+    script.write_text(FAKE_TRAINER)
+    store = ModelStore(str(tmp_path / 'models'))
+    activated = []
+    manager = RetrainJobManager(store, activated.append, script=str(script))
+
+    monkeypatch.setenv('FAKE_TRAIN_SECONDS', '0.5')
+    job, created = manager.submit()
+    again, created_again = manager.submit()
+    assert created and not created_again
+    assert again is job
+
+    wait_for(job)
+    assert job.status == 'succeeded', job.error
+    assert activated == [job.version]
+    assert store.is_complete(job.version)
+    assert {'train_seconds', 'activate_seconds', 'total_seconds'} <= set(job.timings)
+    assert manager.get(job.id).to_dict()['status'] == 'succeeded'
+    # Stamped in UTC, like the model metadata
+    assert all(job.to_dict()[name].endswith('+00:00') for name in ('created_at', 'started_at', 'finished_at'))
+
+    # A failed run reports the error and leaves no version behind
+    monkeypatch.setenv('FAKE_TRAIN_FAIL', '1')
+    failed, created = manager.submit()
+    assert created and failed is not job
+    wait_for(failed)
+    assert failed.status == 'failed' and 'boom' in failed.error
+    assert failed.version not in store.versions()
+    assert activated == [job.version]
+
+
+def test_jobs_are_shared_by_every_process_serving_the_store(tmp_path, monkeypatch):
+    import json
+
+    script = tmp_path / 'fake_train.py'
+    script.write_text(FAKE_TRAINER)
+    store = ModelStore(str(tmp_path / 'models'), keep=1)
+    # Two workers of a pre-fork server, each with its own manager
+    first = RetrainJobManager(store, lambda version: None, script=str(script))
+    second = RetrainJobManager(store, lambda version: None, script=str(script))
+
+    monkeypatch.setenv('FAKE_TRAIN_SECONDS', '0.5')
+    job, created = first.submit()
+    running, created_again = second.submit()
+    assert created and not created_again and running.id == job.id
+    assert second.get(job.id).status in ('queued', 'training')
+
+    wait_for(job)
+    assert second.get(job.id).to_dict()['status'] == 'succeeded'
+    assert second.active().id == job.id
+    # Pruning versions leaves the job records alone
+    write_version(store)
+    store.prune()
+    assert second.get(job.id) is not None
+
+    # A job whose process died without finishing is reported as failed
+    path = tmp_path / 'models' / '.jobs' / f'{job.id}.json'
+    record = json.loads(path.read_text())
+    path.write_text(json.dumps(dict(record, status='training', pid=2 ** 22 + 1)))
+    assert second.get(job.id).status == 'failed'
+
+    # Records written with naive local times still load
+    path.write_text(json.dumps(dict(record, created_at='2025-06-01T12:00:00', started_at='2025-06-01T12:00:01',
+                                    finished_at='2025-06-01T12:00:03')))
+    loaded = second.get(job.id).to_dict()
+    assert loaded['created_at'].endswith('+00:00') and loaded['elapsed_seconds'] == 2.0
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+
+from pipeline import FAILED, SKIPPED, TIMED_OUT, CandidatePipeline, CandidateRequest, Deadline, Source
+from profiling import SamplingProfiler
+
+
+def candidate_request(seconds):
+    return CandidateRequest(None, None, 'u1', None, Deadline(seconds))
+
+
+def test_late_and_failing_sources_are_dropped():
+    release = threading.Event()
+
+    def failing(request):
+        raise ValueError('index unavailable')
+    pipeline = CandidatePipeline([
+        Source('slow', lambda request: release.wait(5) and ['p1'], expensive=lambda request: True),
+        Source('fast', lambda request: ['p2'], expensive=lambda request: True),
+        Source('inline', lambda request: ['p3']),
+        Source('broken', failing),
+        Source('other_users', lambda request: ['p4'], applies=lambda request: request.user_id != 'u1')
+    ])
+
+    started = time.monotonic()
+    candidates, dropped = pipeline.run(candidate_request(0.05))
+    assert time.monotonic() - started < 1
+    assert candidates == {'fast': ['p2'], 'inline': ['p3']}
+    assert dropped == {'slow': TIMED_OUT, 'broken': FAILED}
+    release.set()
+
+    stats = pipeline.stats()
+    assert stats['sources']['slow'] == {'ok': 0, SKIPPED: 0, TIMED_OUT: 1, FAILED: 0}
+    assert stats['sources']['other_users']['ok'] == 0
+
+
+def test_expensive_sources_are_shed_while_the_pool_is_saturated():
+    release = threading.Event()
+    pipeline = CandidatePipeline([
+        Source('scoring', lambda request: release.wait(5) and ['p1'], expensive=lambda request: True),
+        Source('popular', lambda request: ['p2'])
+    ], workers=1)
+
+    assert pipeline.run(candidate_request(0.02))[1] == {'scoring': TIMED_OUT}
+    # The late call still holds the only worker
+    candidates, dropped = pipeline.run(candidate_request(0.02))
+    assert candidates == {'popular': ['p2']} and dropped == {'scoring': SKIPPED}
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while pipeline.stats()['pending'] and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert pipeline.run(candidate_request(0))[0] == {'scoring': ['p1'], 'popular': ['p2']}
+    assert pipeline.stats()['shed_requests'] == 1
+
+
+def test_pooled_sources_are_profiled_with_their_request():
+    def slow_scoring(request):
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            sum(range(1000))
+        return ['p1']
+    pipeline = CandidatePipeline([Source('scoring', slow_scoring, expensive=lambda request: True)])
+    profiler = SamplingProfiler(interval=0.001)
+
+    token = profiler.start()
+    assert pipeline.run(candidate_request(0))[0] == {'scoring': ['p1']}
+    stacks = profiler.stop(token)
+    assert any('slow_scoring' in stack for stack in stacks)
+
+    # Pool threads are only sampled while they work for a profiled request
+    pipeline.run(candidate_request(0))
+    assert not profiler._threads
+
+
+def test_async_fetchers_are_cancelled_when_late():
+    cancelled = []
+
+    async def slow_aggregation(request):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(request.user_id)
+            raise
+
+    async def fast_aggregation(request):
+        return ['p9']
+    pipeline = CandidatePipeline([
+        Source('ml', lambda request: ['p1'], expensive=lambda request: True),
+        Source('collaborative', lambda request: ['p2']),
+        Source('similar', lambda request: ['p3'])
+    ])
+
+    async def main():
+        result = await pipeline.run_async(candidate_request(0.05), {
+            'collaborative': slow_aggregation, 'similar': fast_aggregation
+        })
+        await asyncio.sleep(0)
+        return result
+
+    candidates, dropped = asyncio.run(main())
+    assert candidates == {'ml': ['p1'], 'similar': ['p9']}
+    assert dropped == {'collaborative': TIMED_OUT} and cancelled == ['u1']
+    assert pipeline.stats()['pending'] == 0
@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import numpy as np
+from bson import ObjectId
+
+from event_loader import load_events
+import popularity
+from popularity import PopularityIndex, load_product_categories
+
+NOW = datetime(2025, 6, 1, 12, 0)
+
+
+def events_of(rows):
+    """EventColumns from (product, action, days_ago) rows"""
+    collection = mongomock.MongoClient().db.events
+    collection.insert_many([
+        {'userId': ObjectId(), 'productId': pid, 'action': action, 'createdAt': NOW - timedelta(days=days_ago)}
+        for pid, action, days_ago in rows
+    ])
+    return load_events(collection)
+
+
+def test_scores_decay_with_age_and_weigh_actions():
+    old, recent, viewed = ObjectId(), ObjectId(), ObjectId()
+    index = PopularityIndex(half_life_days=7)
+    index.update(events_of([(old, 'purchase', 28), (recent, 'purchase', 0), (viewed, 'view', 0)]))
+
+    assert index.top_k(3) == [str(recent), str(viewed), str(old)]
+    assert np.isclose(index.score(str(recent), now=NOW), 5.0)
+    assert np.isclose(index.score(str(old), now=NOW), 5.0 / 16)
+    # Two weeks later every score has halved twice
+    assert np.isclose(index.score(str(recent), now=NOW + timedelta(days=14)), 5.0 / 4)
+    assert index.watermark == NOW
+
+
+def test_incremental_updates_match_one_batch(monkeypatch):
+    rng = np.random.default_rng(1)
+    products = [ObjectId() for _ in range(30)]
+    actions = ['view', 'add_to_cart', 'purchase']
+    rows = [(products[rng.integers(30)], actions[rng.integers(3)], int(rng.integers(60))) for _ in range(300)]
+
+    batch = PopularityIndex(half_life_days=3)
+    batch.update(events_of(rows))
+    incremental = PopularityIndex(half_life_days=3)
+    # Oldest first, as they would arrive; re-anchor on almost every batch
+    monkeypatch.setattr(popularity, 'REBASE_HALF_LIVES', 1)
+    rows.sort(key=lambda row: -row[2])
+    for start in range(0, len(rows), 50):
+        incremental.update(events_of(rows[start:start + 50]))
+
+    assert incremental.top_k(30) == batch.top_k(30)
+    assert all(np.isclose(incremental.score(str(pid), NOW), batch.score(str(pid), NOW)) for pid in products)
+
+
+def test_top_k_skips_exclusions_and_filters_by_category(tmp_path):
+    products = mongomock.MongoClient().db.products
+    shirts = [ObjectId() for _ in range(5)]
+    shoes = [ObjectId() for _ in range(5)]
+    products.insert_many([{'_id': pid, 'category': 'Men'} for pid in shirts] +
+                         [{'_id': pid, 'category': 'Kids'} for pid in shoes])
+    # More views for later products in each list
+    events = events_of([(pid, 'view', 0) for i, pid in enumerate(shirts + shoes) for _ in range(i % 5 + 1)])
+
+    index = PopularityIndex(depth=3)
+    index.update(events, load_product_categories(products))
+    assert index.top_k(2, category='Men') == [str(shirts[4]), str(shirts[3])]
+    assert index.top_k(2, exclude_ids={str(shirts[4]), str(shoes[4])}) == [str(shirts[3]), str(shoes[3])]
+    # Deeper than the ranked prefix still returns everything left
+    assert index.top_k(5, exclude_ids={str(shoes[4])}, category='Kids') == [str(pid) for pid in shoes[3::-1]]
+    assert index.top_k(3, category='Women') == []
+
+    index.save(tmp_path / 'popularity.npz')
+    loaded = PopularityIndex.load(tmp_path / 'popularity.npz')
+    assert loaded.top_k(10) == index.top_k(10)
+    assert loaded.top_k(3, category='Kids') == index.top_k(3, category='Kids')
+    assert loaded.watermark == index.watermark and loaded.uncategorized(index.product_ids) == []
+
+
+def test_updates_rerank_like_a_full_ranking():
+    rng = np.random.default_rng(7)
+    products = [ObjectId() for _ in range(40)]
+    labels = ['Men', 'Women', 'Kids']
+    categories = {str(pid): labels[i % 3] for i, pid in enumerate(products)}
+    actions = ['view', 'add_to_cart', 'purchase']
+
+    index = PopularityIndex(half_life_days=3, depth=4)
+    for batch in range(12):
+        rows = [(products[rng.integers(40)], actions[rng.integers(3)], int(rng.integers(30))) for _ in range(25)]
+        if batch == 6:
+            # A product moves to another category
+            categories[str(products[0])] = 'Kids'
+        index.update(events_of(rows), categories)
+
+        expected = PopularityIndex(half_life_days=3, depth=4)
+        expected.__dict__.update({name: value for name, value in index.__dict__.items() if name != '_rankings'})
+        expected._rank()
+        for category in [None] + labels:
+            assert index.top_k(4, category=category) == expected.top_k(4, category=category)
+
+
+def test_deep_queries_sort_once_per_update(monkeypatch):
+    products = [ObjectId() for _ in range(10)]
+    index = PopularityIndex(depth=3)
+    index.update(events_of([(pid, 'view', 0) for i, pid in enumerate(products) for _ in range(i + 1)]))
+    sorts = []
+    top_rows = popularity._top_rows
+    monkeypatch.setattr(popularity, '_top_rows', lambda *args: sorts.append(args[2]) or top_rows(*args))
+
+    best_first = [str(pid) for pid in reversed(products)]
+    for excluded in (3, 5):
+        assert index.top_k(2, exclude_ids=set(best_first[:excluded])) == best_first[excluded:excluded + 2]
+    assert sorts == [10]
+
+    # New events publish new rankings, and the next deep query sorts them again
+    index.update(events_of([(products[0], 'purchase', 0)] * 3))
+    assert index.top_k(2, exclude_ids=set(best_first[:4])) == [str(products[0]), best_first[4]]
+    assert index.top_k(1, exclude_ids=set(best_first)) == []
+    assert sorts[-1] == 10 and sorts.count(10) == 2
@@ -0,0 +1,66 @@
+import os
+import signal
+import threading
+import time
+
+import prefork
+
+
+def test_single_process_status_reports_memory():
+    status = prefork.serving_status()
+    assert status['mode'] == 'single' and status['pid'] == os.getpid()
+    assert status['memory']['rss_mb'] > 0 and status['memory']['private_mb'] > 0
+    assert prefork.request_reload() is False
+
+
+def test_workers_and_reloads_are_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(prefork, 'PREFORK_STATE_DIR', str(tmp_path))
+    monkeypatch.setattr(prefork, '_master_pid', os.getppid())
+    started_at = time.time() - 1
+    prefork._write_record('master', {'pid': os.getppid(), 'version': 'v2', 'reloads': 1, 'last_reload': {
+        'version': 'v2', 'started_at': started_at, 'load_seconds': 0.5}})
+    prefork._write_record(str(os.getpid()), {'pid': os.getpid(), 'version': 'v2', 'ready_at': started_at + 0.75,
+                                             'ready_seconds': 0.1})
+    # A worker that exited without cleaning up is dropped
+    prefork._write_record('999999999', {'pid': 999999999, 'version': 'v1', 'ready_at': 0, 'ready_seconds': 0.1})
+
+    status = prefork.serving_status()
+    assert status['mode'] == 'prefork'
+    assert [w['pid'] for w in status['workers']] == [os.getpid()] and status['workers'][0]['current']
+    assert status['workers'][0]['memory']['rss_mb'] > 0
+    assert status['master']['last_reload']['total_seconds'] == 0.75
+    assert not (tmp_path / '999999999.json').exists()
+
+
+def test_reload_request_signals_the_master(monkeypatch):
+    sent = []
+    monkeypatch.setattr(prefork, '_master_pid', os.getpid() + 1)
+    monkeypatch.setattr(os, 'kill', lambda pid, sig: sent.append((pid, sig)))
+    assert prefork.request_reload()
+    assert sent == [(os.getpid() + 1, signal.SIGHUP)]
+
+
+def test_invalidations_reach_every_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(prefork, 'PREFORK_STATE_DIR', str(tmp_path))
+    monkeypatch.setattr(prefork, '_master_pid', os.getppid())
+    monkeypatch.setattr(prefork, 'INVALIDATION_JOURNAL_MAX_BYTES', 8)
+    prefork.publish_invalidations(['before-start'])
+
+    received, stop = [[], []], threading.Event()
+    workers = [threading.Thread(target=prefork.follow_invalidations, args=(seen.append, 0.001, stop))
+               for seen in received]
+    for worker in workers:
+        worker.start()
+    time.sleep(0.05)
+    # The second batch starts a fresh journal: the first one is over the limit
+    assert prefork.publish_invalidations(['u1', 'u2'])
+    assert prefork.publish_invalidations(['u3'])
+
+    deadline = time.monotonic() + 5
+    while any(len(seen) < 3 for seen in received) and time.monotonic() < deadline:
+        time.sleep(0.001)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    assert received == [['u1', 'u2', 'u3']] * 2
+    assert prefork.publish_invalidations([]) is False
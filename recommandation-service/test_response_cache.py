@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from response_cache import ResponseCache
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def blocking_compute(release, calls, payload):
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return payload
+    return compute
+
+
+def test_concurrent_requests_share_one_computation():
+    cache = ResponseCache(ttl=60)
+    release, calls, results = threading.Event(), [], []
+    compute = blocking_compute(release, calls, {'recommendations': ['p1']})
+
+    def request():
+        results.append(cache.get('u1', 'v1', compute))
+    threads = [threading.Thread(target=request) for _ in range(5)]
+    threads[0].start()
+    wait_until(lambda: cache.stats()['in_flight'] == 1)
+    for thread in threads[1:]:
+        thread.start()
+    wait_until(lambda: cache.stats()['coalesced'] == 4)
+    time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(source for _, source in results) == ['coalesced'] * 4 + ['computed']
+    assert all(payload is results[0][0] for payload, _ in results)
+    assert cache.get('u1', 'v1', compute) == ({'recommendations': ['p1']}, 'cached')
+    # Another model state is a different computation
+    assert cache.get('u1', 'v2', compute)[1] == 'computed'
+
+    stats = cache.stats()
+    assert (stats['requests'], stats['computed'], stats['hits'], stats['coalesced']) == (7, 2, 1, 4)
+    assert stats['dedup_ratio'] == round(5 / 7, 4) and stats['saved_seconds'] > 0
+
+
+def test_invalidation_during_a_computation_is_not_stored():
+    cache = ResponseCache(ttl=60)
+    release, calls, results = threading.Event(), [], []
+    thread = threading.Thread(
+        target=lambda: results.append(cache.get('u1', 'v1', blocking_compute(release, calls, 'old')))
+    )
+    thread.start()
+    wait_until(lambda: cache.stats()['in_flight'] == 1)
+    cache.invalidate('u1')
+    # Requests after the new events don't join the old computation
+    assert cache.get('u1', 'v1', lambda: 'new') == ('new', 'computed')
+    release.set()
+    thread.join()
+
+    assert results == [('old', 'computed')]
+    assert cache.get('u1', 'v1', lambda: 'newer') == ('new', 'cached')
+    cache.clear()
+    assert cache.get('u1', 'v1', lambda: 'newer') == ('newer', 'computed')
+
+
+def test_failures_reach_every_waiter_and_are_not_cached():
+    cache = ResponseCache(ttl=60)
+    release, errors = threading.Event(), []
+
+    def failing():
+        release.wait(5)
+        raise ValueError('scoring failed')
+
+    def request():
+        try:
+            cache.get('u1', 'v1', failing)
+        except ValueError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    threads[0].start()
+    wait_until(lambda: cache.stats()['in_flight'] == 1)
+    for thread in threads[1:]:
+        thread.start()
+    wait_until(lambda: cache.stats()['coalesced'] == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 3 and cache.stats()['failures'] == 1
+    assert cache.get('u1', 'v1', lambda: 'ok') == ('ok', 'computed')
+
+
+def test_async_requests_share_one_computation():
+    cache = ResponseCache(ttl=0)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {'recommendations': ['p2']}
+
+    async def main():
+        return await asyncio.gather(*(cache.get_async('u1', 'v1', compute) for _ in range(4)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1 and [source for _, source in results].count('coalesced') == 3
+    # ttl=0 only coalesces
+    assert asyncio.run(cache.get_async('u1', 'v1', compute))[1] == 'computed'
+    assert cache.stats()['size'] == 0
+
+
+def test_lru_eviction():
+    cache = ResponseCache(max_size=2, ttl=60)
+    for user_id in ('a', 'b', 'a', 'c'):
+        cache.get(user_id, 'v1', lambda: user_id)
+    assert cache.stats()['evictions'] == 1
+    assert cache.get('a', 'v1', lambda: pytest.fail('a was used recently'))[1] == 'cached'
+    assert cache.get('b', 'v1', lambda: 'b2') == ('b2', 'computed')
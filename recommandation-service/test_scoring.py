@@ -0,0 +1,107 @@
+import random
+
+import pandas as pd
+import pytest
+from surprise import Dataset, Reader, SVD
+
+from ann_index import IVFIndex, load_ann_index, recall_at_k
+from scoring import ScoringEngine
+
+
+@pytest.fixture(scope='module')
+def trained():
+    """Train a small SVD the same way train.py does"""
+    rng = random.Random(7)
+    users = [f'user_{i}' for i in range(40)]
+    products = [f'product_{i}' for i in range(60)]
+    rows = []
+    for uid in users:
+        for pid in rng.sample(products, 12):
+            rows.append({'userId': uid, 'productId': pid, 'rating': rng.choice([1.0, 3.5, 4.0, 5.0, 6.5])})
+    df = pd.DataFrame(rows)
+
+    data = Dataset.load_from_df(df[['userId', 'productId', 'rating']], Reader(rating_scale=(1, 5)))
+    algo = SVD(n_factors=10, n_epochs=20, lr_all=0.005, reg_all=0.02, random_state=3)
+    algo.fit(data.build_full_trainset())
+
+    product_ids = df['productId'].unique().tolist()
+    user_ids = df['userId'].unique().tolist()
+    return algo, df, product_ids, user_ids
+
+
+def legacy_ranking(algo, user_id, product_ids, seen, current):
+    """The per-product predict loop that get_recommendations used to run"""
+    predictions = []
+    for pid in product_ids:
+        if pid not in seen and pid in current:
+            predictions.append((pid, algo.predict(user_id, pid).est))
+    predictions.sort(key=lambda x: x[1], reverse=True)
+    return [pid for pid, score in predictions[:6]]
+
+
+def test_scores_match_surprise_predict(trained):
+    algo, df, product_ids, user_ids = trained
+    engine = ScoringEngine.from_surprise(algo, product_ids, user_ids)
+
+    scores = engine.score_user(user_ids[0])
+    for pid in product_ids:
+        assert scores[engine.item_index[pid]] == pytest.approx(algo.predict(user_ids[0], pid).est)
+
+
+def test_top_k_matches_legacy_ranking(trained):
+    algo, df, product_ids, user_ids = trained
+    engine = ScoringEngine.from_surprise(algo, product_ids, user_ids)
+    current = set(product_ids[5:])
+
+    for uid in user_ids:
+        seen = set(df.loc[df['userId'] == uid, 'productId'])
+        allowed = engine.item_mask(current) & ~engine.item_mask(seen)
+        ranked = [pid for pid, score in engine.top_k(uid, 6, allowed_mask=allowed)]
+        assert ranked == legacy_ranking(algo, uid, product_ids, seen, current)
+
+
+def test_top_k_with_fewer_candidates_than_k(trained):
+    algo, df, product_ids, user_ids = trained
+    engine = ScoringEngine.from_surprise(algo, product_ids, user_ids)
+
+    allowed = engine.item_mask(product_ids[:3])
+    assert len(engine.top_k(user_ids[0], 6, allowed_mask=allowed)) == 3
+    assert engine.top_k(user_ids[0], 6, allowed_mask=engine.item_mask([])) == []
+    assert not engine.has_user('unknown_user')
+
+
+def test_ann_index_full_probe_matches_exact(trained):
+    algo, df, product_ids, user_ids = trained
+    engine = ScoringEngine.from_surprise(algo, product_ids, user_ids)
+    index = IVFIndex.build(engine, n_lists=6)
+
+    allowed = ~engine.item_mask(product_ids[:10])
+    for uid in user_ids[:10]:
+        exact = engine.top_k(uid, 6, allowed_mask=allowed)
+        assert index.search(engine, uid, 6, allowed_mask=allowed, n_probe=index.n_lists) == exact
+
+    assert recall_at_k(index, engine, k=10, n_probe=index.n_lists) == 1.0
+    assert 0.0 < recall_at_k(index, engine, k=10, n_probe=1) <= 1.0
+
+
+def test_ann_index_round_trip(trained, tmp_path):
+    algo, df, product_ids, user_ids = trained
+    engine = ScoringEngine.from_surprise(algo, product_ids, user_ids)
+    path = str(tmp_path / 'ann_index.npz')
+    IVFIndex.build(engine, n_lists=4).save(path)
+
+    loaded = load_ann_index(engine, path)
+    assert loaded.n_lists == 4
+    assert sorted(loaded.list_items.tolist()) == list(range(engine.n_items))
+
+
+def test_untrained_ids_score_like_surprise_predict(trained):
+    algo, df, product_ids, user_ids = trained
+    # Cold-start metadata lists more products than the dummy trainset saw
+    catalog = product_ids + ['product_new_1', 'product_new_2']
+    engine = ScoringEngine.from_surprise(algo, catalog, user_ids + ['user_new'])
+
+    for uid in (user_ids[0], 'user_new'):
+        scores = engine.score_user(uid)
+        for pid in (product_ids[0], 'product_new_1'):
+            assert scores[engine.item_index[pid]] == pytest.approx(algo.predict(uid, pid).est)
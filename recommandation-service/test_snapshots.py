@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta, timezone
+
+import joblib
+import mongomock
+import numpy as np
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from event_loader import load_events
+from model_store import METADATA_FILE
+from snapshots import compact, export_events, load_snapshot_events, read_manifest, scan, status
+from synthetic_data import generate_catalog, generate_events
+
+
+def event_rows(events):
+    """Every event as a comparable tuple, independent of code assignment"""
+    return sorted(zip(
+        [events.user_ids[code] for code in events.user_codes],
+        [events.product_ids[code] for code in events.item_codes],
+        events.action_codes.tolist(),
+        np.nan_to_num(events.values, nan=-1).tolist(),
+        events.timestamps.tolist()
+    ))
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient()['E-commerce']
+    product_ids = generate_catalog(db.products, 40, seed=4)
+    generate_events(db.events, product_ids, 30, 1200, seed=4)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    db.events.insert_many([
+        # No date: only the first export sees it, under day=undated
+        {'userId': 'guest', 'productId': product_ids[0], 'action': 'view'},
+        {'userId': 'guest', 'productId': product_ids[1], 'action': 'share', 'value': 2,
+         'createdAt': now - timedelta(days=1)},
+        {'userId': None, 'productId': product_ids[1], 'action': 'search', 'createdAt': now},
+    ])
+    return db
+
+
+def test_snapshot_reads_the_same_events_as_mongo(db, tmp_path):
+    report = export_events(db.events, str(tmp_path), batch_size=300, settle_seconds=0)
+    assert report['events'] == len(load_events(db.events)) and 'undated' in report['days']
+    assert event_rows(load_snapshot_events(str(tmp_path))) == event_rows(load_events(db.events))
+
+    # Only the id and time columns are read, and only the days in the window
+    since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=7)
+    window = scan(str(tmp_path), ['userId', 'createdAt'], since=since)
+    assert window.column_names == ['userId', 'createdAt']
+    assert event_rows(load_snapshot_events(str(tmp_path), since=since)) == \
+        event_rows(load_events(db.events, {'createdAt': {'$gte': since}}))
+
+
+def test_exports_append_and_compaction_merges(db, tmp_path):
+    export_events(db.events, str(tmp_path), settle_seconds=0)
+    first = read_manifest(str(tmp_path))
+    assert export_events(db.events, str(tmp_path), settle_seconds=0)['events'] == 0
+
+    # MongoDB stores milliseconds; mongomock would keep the microseconds
+    later = (datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=1)).replace(microsecond=0)
+    db.events.insert_many([
+        {'userId': 'late', 'productId': 'p', 'action': 'purchase', 'createdAt': later + timedelta(seconds=i)}
+        for i in range(3)
+    ])
+    report = export_events(db.events, str(tmp_path), now=later + timedelta(minutes=10))
+    assert report['events'] == 3 and report['days'] == [later.date().isoformat()]
+    assert report['watermark'] == (later + timedelta(minutes=5)).isoformat()
+    assert status(str(tmp_path))['files'] == len(first['files']) + 1
+
+    # Left by an export that failed before writing the manifest
+    (tmp_path / f'day={later.date().isoformat()}' / 'part-x.parquet.tmp').write_bytes(b'partial')
+    result = compact(str(tmp_path))
+    assert result['files_after'] == len(first['files']) and result['orphans_removed'] == 1
+    assert event_rows(load_snapshot_events(str(tmp_path))) == event_rows(load_events(db.events))
+
+
+def test_events_written_late_reach_the_next_export(db, tmp_path):
+    now = datetime.now(timezone.utc).replace(tzinfo=None).replace(microsecond=0) + timedelta(hours=1)
+    report = export_events(db.events, str(tmp_path), now=now)
+    assert report['watermark'] == (now - timedelta(minutes=5)).isoformat()
+
+    # Created before the last export ran but committed after it
+    db.events.insert_many([
+        {'userId': 'late', 'productId': 'p', 'action': 'view', 'createdAt': now - timedelta(minutes=2)},
+        {'userId': 'late', 'productId': 'p', 'action': 'view', 'createdAt': now + timedelta(minutes=4)},
+    ])
+    report = export_events(db.events, str(tmp_path), now=now + timedelta(minutes=5))
+    assert report['events'] == 1
+    report = export_events(db.events, str(tmp_path), now=now + timedelta(minutes=10))
+    assert report['events'] == 1
+    assert event_rows(load_snapshot_events(str(tmp_path))) == event_rows(load_events(db.events))
+
+
+def test_training_from_snapshots(db, tmp_path, monkeypatch):
+    import train
+
+    monkeypatch.setattr(train, 'connect_to_database', lambda: db)
+    monkeypatch.setenv('TOPK_TABLE_SIZE', '0')
+    export_events(db.events, str(tmp_path / 'snapshots'), settle_seconds=0)
+    for output, options in (('from_mongo', {}), ('from_snapshots', {'from_snapshots': True})):
+        (tmp_path / output).mkdir()
+        train.main(output_dir=str(tmp_path / output), snapshot_dir=str(tmp_path / 'snapshots'), **options)
+
+    from_mongo = joblib.load(tmp_path / 'from_mongo' / METADATA_FILE)
+    from_snapshots = joblib.load(tmp_path / 'from_snapshots' / METADATA_FILE)
+    assert from_snapshots['load_stats']['source'] == 'snapshots'
+    assert from_snapshots['load_stats']['events'] == from_mongo['load_stats']['events']
+    assert (from_snapshots['n_users'], from_snapshots['n_products']) == (from_mongo['n_users'], from_mongo['n_products'])
+    assert from_snapshots['events_watermark'] == from_mongo['events_watermark']
@@ -0,0 +1,84 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+from surprise import Dataset, Reader, SVD
+
+from catalog import CatalogSnapshot
+from flat_model import save_flat_model
+from model_store import ModelBundle
+from recommender import rank_for_trained_user, rank_for_trained_users
+from scoring import ScoringEngine
+from topk_table import build_topk_table, load_topk_table
+
+
+@pytest.fixture(scope='module')
+def engine():
+    rng = random.Random(13)
+    products = [f'product_{i}' for i in range(80)]
+    rows = [
+        {'userId': f'user_{u}', 'productId': pid, 'rating': rng.choice([1.0, 3.5, 4.0, 5.0, 6.5])}
+        for u in range(70) for pid in rng.sample(products, 10)
+    ]
+    df = pd.DataFrame(rows)
+    data = Dataset.load_from_df(df[['userId', 'productId', 'rating']], Reader(rating_scale=(1, 5)))
+    algo = SVD(n_factors=10, n_epochs=20, random_state=5)
+    algo.fit(data.build_full_trainset())
+    return ScoringEngine.from_surprise(algo, df['productId'].unique().tolist(), df['userId'].unique().tolist())
+
+
+def test_table_matches_online_top_k(engine):
+    table, stats = build_topk_table(engine, k=12, block_size=16)
+    assert table.indices.dtype == np.int32 and table.indices.shape == (70, 12)
+    assert stats['users'] == 70 and stats['users_per_second'] > 0
+
+    for row, uid in enumerate(engine.user_ids):
+        expected = [engine.item_index[pid] for pid, score in engine.top_k(uid, 12)]
+        assert table.indices[row].tolist() == expected
+
+
+def test_process_pool_build_matches_single_process(engine, tmp_path):
+    path = str(tmp_path / 'svd_factors')
+    save_flat_model(engine, path)
+    single, _ = build_topk_table(engine, k=8, block_size=16)
+    pooled, stats = build_topk_table(engine, k=8, block_size=16, workers=2, flat_model_path=path)
+    assert stats['workers'] == 2
+    np.testing.assert_array_equal(pooled.indices, single.indices)
+
+
+def test_recommend_filters_and_falls_back(engine, tmp_path):
+    table, _ = build_topk_table(engine, k=10)
+    path = str(tmp_path / 'topk_table.npy')
+    table.save(path)
+    table = load_topk_table(engine, path)
+
+    uid = engine.user_ids[0]
+    best = table.indices[0]
+    allowed = np.ones(engine.n_items, dtype=bool)
+    allowed[best[:2]] = False
+    rows = table.recommend(0, allowed, 6)
+    assert rows.tolist() == [engine.item_index[pid] for pid, score in engine.top_k(uid, 6, allowed_mask=allowed)]
+
+    # Too few stored items survive: the caller has to score online
+    allowed[best[:6]] = False
+    assert table.recommend(0, allowed, 6) is None
+    # Users changed by an incremental update, or added after the build
+    assert table.excluding([1]).recommend(1, np.ones(engine.n_items, dtype=bool), 6) is None
+    assert table.recommend(table.n_users, allowed, 6) is None
+    assert table.has(1) and not table.excluding([1]).has(1) and not table.has(table.n_users)
+
+
+def test_batch_ranking_matches_single_user_ranking(engine):
+    # Every fifth product was removed from the catalog; users have seen a few
+    catalog = CatalogSnapshot([pid for i, pid in enumerate(engine.item_ids) if i % 5], engine)
+    rng = random.Random(3)
+    seen_by_user = {uid: frozenset(rng.sample(engine.item_ids, 8)) for uid in engine.user_ids}
+    table, _ = build_topk_table(engine, k=12)
+
+    for topk_table in (None, table):
+        current = ModelBundle(None, {}, [], engine, topk_table=topk_table)
+        # A tiny cell budget forces several scoring blocks
+        batch = rank_for_trained_users(current, catalog, seen_by_user, k=6, max_cells=engine.n_items * 7)
+        for uid, seen in seen_by_user.items():
+            assert batch[uid] == rank_for_trained_user(current, catalog, uid, seen, k=6)
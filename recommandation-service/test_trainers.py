@@ -0,0 +1,93 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+import joblib
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from flat_model import FLAT_MODEL_DIR, load_flat_model
+from model_store import METADATA_FILE, MODEL_FILE
+from synthetic_data import generate_catalog, generate_events
+from trainers import ALSTrainer, Ratings, SurpriseSVDTrainer, compare_trainers
+
+
+@pytest.fixture(scope='module')
+def ratings():
+    """Low-rank ratings with a popularity skew"""
+    rng = np.random.default_rng(2)
+    n_users, n_items = 200, 80
+    user_factors = rng.normal(0, 1, (n_users, 3))
+    item_factors = rng.normal(0, 1, (n_items, 3))
+    users = rng.integers(0, n_users, 6000)
+    items = np.minimum(rng.zipf(1.5, 6000) - 1, n_items - 1)
+    _, first = np.unique(users * n_items + items, return_index=True)
+    users, items = users[first], items[first]
+    values = np.clip(3 + (user_factors[users] * item_factors[items]).sum(1) / 2 + rng.normal(0, 0.3, len(users)), 1, 5)
+    return Ratings(users, items, values, [f'u{i}' for i in range(n_users)], [f'p{i}' for i in range(n_items)])
+
+
+def test_als_fits_better_than_the_global_mean(ratings):
+    engine = ALSTrainer(n_factors=6, n_epochs=8, reg_all=2.0, random_state=0).fit(ratings)
+    assert engine.user_ids == ratings.user_ids and engine.item_ids == ratings.item_ids
+    assert engine.pu.shape == (len(ratings.user_ids), 6) and engine.qi.shape == (len(ratings.item_ids), 6)
+
+    predictions = engine.predict_pairs(ratings.user_codes, ratings.item_codes)
+    rmse = np.sqrt(np.mean((predictions - ratings.values) ** 2))
+    assert rmse < 0.6 * np.std(ratings.values)
+    # The batched path agrees with the per-user scorer
+    user = ratings.user_codes[0]
+    assert np.allclose(engine.score_users(np.array([user]))[0], engine.score_user(engine.user_ids[user]))
+
+    # Batch sizes change the blocking, not the result
+    small_blocks = ALSTrainer(n_factors=6, n_epochs=8, reg_all=2.0, random_state=0, block_cells=500).fit(ratings)
+    assert np.allclose(small_blocks.pu, engine.pu) and np.allclose(small_blocks.qi, engine.qi)
+
+
+def test_svd_trainer_matches_surprise_predictions(ratings):
+    trainer = SurpriseSVDTrainer(n_factors=4, n_epochs=5, random_state=1)
+    engine = trainer.fit(ratings)
+    predictions = engine.predict_pairs(ratings.user_codes[:20], ratings.item_codes[:20])
+    expected = [trainer.model.predict(ratings.user_ids[u], ratings.item_ids[i]).est
+                for u, i in zip(ratings.user_codes[:20], ratings.item_codes[:20])]
+    assert np.allclose(predictions, expected)
+
+
+def test_compare_trainers_reports_both_engines(ratings):
+    results = compare_trainers(ratings, params={'svd': {'n_factors': 4}, 'als': {'n_factors': 4, 'reg_all': 2.0}})
+    assert set(results) == {'svd', 'als'}
+    for row in results.values():
+        assert row['seconds'] >= 0 and 0 < row['rmse'] < 2 and 0 <= row['recall_at_10'] <= 1
+
+
+def test_als_training_and_incremental_update(tmp_path, monkeypatch):
+    import train
+
+    db = mongomock.MongoClient()['E-commerce']
+    product_ids = generate_catalog(db.products, 40, seed=3)
+    generate_events(db.events, product_ids, 30, 800, seed=3)
+    monkeypatch.setattr(train, 'connect_to_database', lambda: db)
+    monkeypatch.setenv('TOPK_TABLE_SIZE', '0')
+
+    # A stale pickle from an earlier SVD run must not outlive the ALS model
+    (tmp_path / MODEL_FILE).write_bytes(b'stale')
+    train.main(output_dir=str(tmp_path), engine_name='als')
+    assert not (tmp_path / MODEL_FILE).exists()
+    metadata = joblib.load(tmp_path / METADATA_FILE)
+    assert metadata['model_params']['engine'] == 'als' and metadata['model_params']['rmse'] > 0
+    # Ids are kept once, in the flat artifact's registry
+    flat = load_flat_model(str(tmp_path / FLAT_MODEL_DIR))
+    assert 'user_ids' not in metadata and len(flat.user_ids) == metadata['n_users']
+    assert flat.user_ids.kind == 'objectid' and flat.user_ids.ids.dtype == 'S12'
+
+    later = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=1)
+    new_user = ObjectId()
+    db.events.insert_many([
+        {'userId': new_user, 'productId': pid, 'action': 'purchase', 'createdAt': later} for pid in product_ids[:3]
+    ])
+    output_dir = tmp_path / 'next'
+    output_dir.mkdir()
+    assert train.incremental_update(str(tmp_path), str(output_dir))
+    assert load_flat_model(str(output_dir / FLAT_MODEL_DIR)).has_user(str(new_user))
+    assert not os.path.exists(output_dir / MODEL_FILE)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from trainers import Ratings
+from tuning import cross_validate, sample_candidates, tune
+
+
+@pytest.fixture(scope='module')
+def ratings():
+    rng = np.random.default_rng(4)
+    user_codes = rng.integers(0, 40, size=600)
+    item_codes = rng.integers(0, 30, size=600)
+    ratings = np.clip(1 + (user_codes % 5) * 0.6 + (item_codes % 3) + rng.normal(0, 0.3, size=600), 1, 5)
+    return user_codes, item_codes, ratings
+
+
+def test_grid_and_random_candidates():
+    space = {'n_factors': [5, 10], 'n_epochs': [5, 10, 20], 'lr_all': [0.005]}
+    grid = sample_candidates(space)
+    assert len(grid) == 6
+    assert {'n_factors': 10, 'n_epochs': 20, 'lr_all': 0.005} in grid
+
+    sampled = sample_candidates({'n_factors': [5, 10], 'reg_all': {'low': 0.01, 'high': 0.1, 'log': True}},
+                                n_samples=4, seed=1)
+    assert len(sampled) == 4
+    assert all(0.01 <= c['reg_all'] <= 0.1 and c['n_factors'] in (5, 10) for c in sampled)
+    with pytest.raises(ValueError):
+        sample_candidates({'reg_all': {'low': 0.01, 'high': 0.1}})
+
+
+def test_process_pool_matches_serial_search(ratings):
+    candidates = sample_candidates({'n_factors': [2, 8], 'n_epochs': [5, 15], 'reg_all': [0.02, 0.2]})
+    best, results, stats = tune(*ratings, candidates, folds=3, workers=1)
+    pool_best, pool_results, pool_stats = tune(*ratings, candidates, folds=3, workers=2)
+
+    assert stats['evaluated'] == pool_stats['evaluated'] == len(candidates)
+    assert pool_stats['workers'] == 2 and not pool_stats['budget_exhausted']
+    assert pool_results == [dict(r, fit_seconds=p['fit_seconds']) for r, p in zip(results, pool_results)]
+    assert best == pool_best == {k: results[0][k] for k in ('n_epochs', 'n_factors', 'reg_all')}
+    assert [r['rmse'] for r in results] == sorted(r['rmse'] for r in results)
+
+
+def test_budget_stops_the_search(ratings):
+    candidates = sample_candidates({'n_factors': [2, 4, 8, 16], 'n_epochs': [20, 40]})
+    best, results, stats = tune(*ratings, candidates, folds=2, budget_seconds=1e-9)
+    assert stats['budget_exhausted'] and stats['evaluated'] < len(candidates)
+    assert best is None or best == {k: results[0][k] for k in ('n_epochs', 'n_factors')}
+
+
+def test_single_configuration_cross_validates_in_process(ratings, monkeypatch):
+    import tuning
+
+    params = {'n_factors': 4, 'n_epochs': 10}
+    _, results, _ = tune(*ratings, [params], folds=3, workers=1)
+    # No worker pool and no memory-mapped copy of the ratings
+    monkeypatch.setattr(tuning, 'ProcessPoolExecutor', None)
+    monkeypatch.setattr(tuning.np, 'save', None)
+    user_codes, item_codes, values = ratings
+    rmse, mae = cross_validate(Ratings(user_codes, item_codes, values, range(40), range(30)), params, folds=3)
+    assert (round(rmse, 6), round(mae, 6)) == (results[0]['rmse'], results[0]['mae'])
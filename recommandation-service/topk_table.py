@@ -0,0 +1,142 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from flat_model import load_flat_model
+from scoring import top_k_rows
+
+TOPK_TABLE_FILE = 'topk_table.npy'
+
+
+class TopKTable:
+    """Precomputed top-K item rows for every trained user.
+
+    ``indices[u]`` holds the K best item rows of user row ``u``, best first,
+    ordered exactly as ``ScoringEngine.top_k`` would rank them. Users whose
+    factors changed after the build (incremental updates) are listed in
+    ``excluded_users`` and always scored online. Only the first ``n_items``
+    item rows were ranked; items folded in later are scored for each
+    request and merged in.
+    """
+
+    def __init__(self, indices, n_items, excluded_users=frozenset()):
+        self.indices = indices
+        self.n_items = n_items
+        self.excluded_users = frozenset(excluded_users)
+
+    @property
+    def k(self):
+        return self.indices.shape[1]
+
+    @property
+    def n_users(self):
+        return self.indices.shape[0]
+
+    def has(self, user_row):
+        """Whether the table holds a current row for ``user_row``"""
+        return 0 <= user_row < self.n_users and user_row not in self.excluded_users
+
+    def excluding(self, user_rows):
+        """Copy of the table that no longer answers for ``user_rows``"""
+        return TopKTable(self.indices, self.n_items, self.excluded_users | set(user_rows))
+
+    def recommend(self, user_row, allowed_mask, k, excluded_rows=None, engine=None):
+        """Best ``k`` allowed item rows, or None when the table can't answer.
+
+        Returns None for users built after (or changed since) the table and
+        when fewer than ``k`` of the stored items survive ``allowed_mask``
+        (and ``excluded_rows``, if given); the caller then scores online.
+        Allowed items folded in after the build are ranked against the
+        surviving rows with ``engine``; without one the table can't answer.
+        """
+        if not self.has(user_row):
+            return None
+        rows = self.indices[user_row]
+        rows = rows[allowed_mask[rows]]
+        unindexed = np.arange(self.n_items, len(allowed_mask))
+        unindexed = unindexed[allowed_mask[unindexed]]
+        if excluded_rows is not None and len(excluded_rows):
+            rows = rows[~np.isin(rows, excluded_rows)]
+            unindexed = unindexed[~np.isin(unindexed, excluded_rows)]
+        if len(rows) < k:
+            return None
+        if len(unindexed) == 0:
+            return rows[:k]
+        if engine is None:
+            return None
+
+        # Ranked like ScoringEngine.top_k over these candidates
+        candidates = np.sort(np.concatenate([rows[:k], unindexed]))
+        scores = engine.score_user(engine.user_ids[user_row], rows=candidates)
+        return candidates[np.argsort(-scores, kind='stable')[:k]].astype(rows.dtype)
+
+    def save(self, path=TOPK_TABLE_FILE):
+        np.save(path, self.indices)
+
+    @classmethod
+    def load(cls, path, n_items):
+        return cls(np.load(path, mmap_mode='r'), n_items)
+
+
+def load_topk_table(engine, path=TOPK_TABLE_FILE):
+    """Load the table if it exists and was built for the engine's users"""
+    if engine is None or not os.path.exists(path):
+        return None
+    table = TopKTable.load(path, engine.n_items)
+    if table.n_users > len(engine.user_ids) or table.indices.max(initial=-1) >= engine.n_items:
+        return None
+    return table
+
+
+def build_topk_table(engine, k=50, block_size=1024, workers=1, flat_model_path=None):
+    """Score every user against every item and keep the top-K rows per user.
+
+    Users are scored in blocks of ``block_size`` with one matrix product per
+    block. With ``workers > 1`` blocks are spread over a process pool; each
+    worker memory-maps the flat model at ``flat_model_path`` rather than
+    receiving a pickled copy of the factors. Returns (table, stats).
+    """
+    n_users = len(engine.user_ids)
+    k = min(k, engine.n_items)
+    blocks = [(start, min(start + block_size, n_users)) for start in range(0, n_users, block_size)]
+
+    started = time.perf_counter()
+    indices = np.zeros((n_users, k), dtype=np.int32)
+    if workers > 1 and flat_model_path is not None and len(blocks) > 1:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(flat_model_path,)) as pool:
+            for (start, end), rows in zip(blocks, pool.map(_score_block_in_worker, blocks, [k] * len(blocks))):
+                indices[start:end] = rows
+    else:
+        workers = 1
+        for start, end in blocks:
+            indices[start:end] = score_block(engine, start, end, k)
+    seconds = time.perf_counter() - started
+
+    stats = {
+        'users': n_users,
+        'k': k,
+        'workers': workers,
+        'seconds': round(seconds, 3),
+        'users_per_second': round(n_users / seconds, 1) if seconds > 0 else None
+    }
+    return TopKTable(indices, engine.n_items), stats
+
+
+def score_block(engine, start, end, k):
+    """Top-k item rows for user rows ``start:end``, ranked like ScoringEngine.top_k"""
+    return top_k_rows(engine.score_users(slice(start, end)), k)
+
+
+_worker_engine = None
+
+
+def _init_worker(flat_model_path):
+    global _worker_engine
+    _worker_engine = load_flat_model(flat_model_path)
+
+
+def _score_block_in_worker(block, k):
+    start, end = block
+    return score_block(_worker_engine, start, end, k)
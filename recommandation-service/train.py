@@ -1,14 +1,33 @@
 import pandas as pd
+import numpy as np
 from pymongo import MongoClient
 from surprise import Dataset, Reader, SVD
-from surprise.model_selection import cross_validate
 import joblib
 import os
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import sys
+import shutil
+import argparse
+import time
+from scoring import ScoringEngine
+from ann_index import ANN_INDEX_FILE, IVFIndex, recall_at_k
+from cooccurrence import ITEM_NEIGHBORS_FILE, ItemNeighborIndex
+from history_cache import POSITIVE_ACTIONS
+from event_loader import load_events, peak_rss_mb
+from incremental import apply_to_surprise, events_watermark, fold_in, fold_in_options, metadata_watermark
+from flat_model import FLAT_MODEL_DIR, has_flat_model, load_flat_model, save_flat_model
+from topk_table import TOPK_TABLE_FILE, build_topk_table
+from model_store import METADATA_FILE, MODEL_FILE, POPULAR_PRODUCTS_FILE, ModelStore
+from interactions import INTERACTIONS_COLLECTION, load_interactions
+from popularity import POPULARITY_FILE, PopularityIndex, load_popularity, load_product_categories
+from trainers import TRAINERS, Ratings, make_trainer
+from tuning import cross_validate, default_space, load_space, sample_candidates, tune as tune_parameters
 
-def create_cold_start_model(db):
+# Incremental runs kept in the metadata history
+MAX_INCREMENTAL_HISTORY = 20
+
+def create_cold_start_model(db, output_dir='.'):
     """Create a minimal model when no user interaction data exists"""
     try:
         # Get all products from the database
@@ -39,14 +58,16 @@ def create_cold_start_model(db):
         algo.fit(trainset)
         
         # Save model and metadata
-        joblib.dump(algo, 'recommendation_model.joblib')
+        user_ids = [f'cold_start_user_{i}' for i in range(3)]
+        joblib.dump(algo, os.path.join(output_dir, MODEL_FILE))
+        save_flat_model(ScoringEngine.from_surprise(algo, product_ids, user_ids), os.path.join(output_dir, FLAT_MODEL_DIR))
         
         metadata = {
-            'product_ids': product_ids,
-            'user_ids': [f'cold_start_user_{i}' for i in range(3)],
+            'n_products': len(product_ids),
+            'n_users': len(user_ids),
             'total_events': 0,
             'unique_pairs': len(dummy_data),
-            'trained_at': datetime.now().isoformat(),
+            'trained_at': datetime.now(timezone.utc).isoformat(),
             'model_params': {
                 'n_factors': 10,
                 'n_epochs': 10,
@@ -56,20 +77,22 @@ def create_cold_start_model(db):
             'cold_start': True
         }
         
-        joblib.dump(metadata, 'model_metadata.joblib')
+        joblib.dump(metadata, os.path.join(output_dir, METADATA_FILE))
+        for stale_file in (ANN_INDEX_FILE, ITEM_NEIGHBORS_FILE, TOPK_TABLE_FILE, POPULARITY_FILE):
+            if os.path.exists(os.path.join(output_dir, stale_file)):
+                os.remove(os.path.join(output_dir, stale_file))
         
         # Use all products as popular products for cold start
         popular_products = product_ids[:20]  # First 20 products
-        joblib.dump(popular_products, 'popular_products.joblib')
+        joblib.dump(popular_products, os.path.join(output_dir, POPULAR_PRODUCTS_FILE))
         
         return True
         
     except Exception as e:
         raise RuntimeError(f"Failed to create cold start model: {e}")
 
-def main():
-    load_dotenv()
-
+def connect_to_database():
+    """Connect to MongoDB using MONGO_URI and return the E-commerce database"""
     mongo_connection_string = os.getenv('MONGO_URI')
     if not mongo_connection_string:
         raise ValueError("MONGO_URI not found. Please set it in the .env file.")
@@ -84,158 +107,411 @@ def main():
     except Exception as e:
         raise ConnectionError(f"Failed to connect to MongoDB: {e}")
 
-    # Fetch all events
-    try:
-        events_data = list(db.events.find({}, {
-            '_id': 0, 
-            'userId': 1, 
-            'productId': 1, 
-            'action': 1,
-            'value': 1,
-            'createdAt': 1
-        }))
-    except Exception as e:
-        raise RuntimeError(f"Failed to fetch events from database: {e}")
-
-    # Handle empty database case
-    if not events_data:
-        create_cold_start_model(db)
-        return
-
-    df = pd.DataFrame(events_data)
+    return db
 
-    # Convert ObjectIds to strings for consistency
-    df['userId'] = df['userId'].astype(str)
-    df['productId'] = df['productId'].astype(str)
+def _sorted_codes(codes, ids):
+    """Dense codes for the ids used in ``codes``, numbered in sorted id order"""
+    used, dense = np.unique(codes, return_inverse=True)
+    names = [ids[code] for code in used]
+    order = np.argsort(np.array(names, dtype=object), kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[dense.ravel()], [names[i] for i in order]
 
-    # Remove any null values
-    df = df.dropna(subset=['userId', 'productId'])
+def prepare_ratings(events, now=None):
+    """The Ratings a model is trained on, or None when there are too few for one"""
+    # Weight each event by action and recency, then average per user-product pair
+    pair_users, pair_items, pair_ratings = events.aggregate(now)
     
-    if len(df) == 0:
-        create_cold_start_model(db)
-        return
+    if len(pair_ratings) == 0:
+        return None
 
-    # Improved action weights
-    action_weights = {
-        'view': 1.0,
-        'add_to_cart': 3.5,
-        'purchase': 5.0,
-        'rating': 4.0
-    }
+    # Ensure minimum interactions per user (quality control)
+    user_counts = np.bincount(pair_users, minlength=len(events.user_ids))
+    
+    # Adjust minimum interactions based on data size
+    min_interactions = 2 if len(pair_ratings) >= 10 else 1
+    keep = user_counts[pair_users] >= min_interactions
 
-    # Calculate base rating from action
-    df['rating'] = df['action'].apply(lambda x: action_weights.get(x, 1.0))
+    # If still no valid data, use all available data
+    if not keep.any():
+        keep[:] = True
 
-    # For rating actions, use actual rating value if available
-    if 'value' in df.columns:
-        rating_mask = df['action'] == 'rating'
-        df.loc[rating_mask, 'rating'] = df.loc[rating_mask, 'value'].fillna(3.0)
+    # Final check - need at least 2 interactions for Surprise
+    if keep.sum() < 2:
+        return None
 
-    # Add recency boost (more recent interactions are more relevant)
-    if 'createdAt' in df.columns:
-        try:
-            df['createdAt'] = pd.to_datetime(df['createdAt'])
-            days_ago = (datetime.now() - df['createdAt']).dt.days
-            recency_boost = 1 + (30 - days_ago.clip(0, 30)) / 30 * 0.3
-            df['rating'] = df['rating'] * recency_boost
-        except Exception:
-            pass  # Skip recency boost if there's an error
+    # Re-code the kept pairs densely, ids in sorted order so the model's id
+    # registries are their own search index
+    user_codes, user_ids = _sorted_codes(pair_users[keep], events.user_ids)
+    item_codes, product_ids = _sorted_codes(pair_items[keep], events.product_ids)
+    return Ratings(user_codes, item_codes, pair_ratings[keep], user_ids, product_ids)
 
-    # Handle duplicate user-product interactions by aggregating
-    df_aggregated = df.groupby(['userId', 'productId']).agg({
-        'rating': 'mean'
-    }).reset_index()
+def main(build_ann=False, output_dir='.', tune=None, engine_name='svd', from_interactions=False,
+         from_snapshots=False, snapshot_dir=None, window_days=None, evaluate=False):
+    """Train and save every artifact to ``output_dir``.
 
-    # Drop any rows with missing values
-    df_aggregated.dropna(subset=['userId', 'productId', 'rating'], inplace=True)
-    
-    if len(df_aggregated) == 0:
-        create_cold_start_model(db)
-        return
+    ``from_interactions`` reads one pre-aggregated document per user-product
+    pair (interactions.py) instead of every raw event. ``from_snapshots``
+    reads the events from the Parquet snapshots in ``snapshot_dir``
+    (snapshots.py) instead of MongoDB. ``window_days`` keeps only the events
+    of the last N days (raw events and snapshots). ``evaluate`` replaces the
+    cross-validation with a time-based holdout (evaluation.py): one extra
+    fit, ranking metrics and a replay of the serving cascade (raw events
+    and snapshots only).
+    ``engine_name`` picks the trainer (see trainers.TRAINERS). ``tune``
+    enables the hyper-parameter search: a dict with the optional keys
+    space, samples, folds, workers, budget_seconds and seed (see
+    tuning.tune); the best configuration is then used for the final fit.
+    """
+    load_dotenv()
+    db = connect_to_database()
 
-    # Ensure minimum interactions per user (quality control)
-    user_counts = df_aggregated['userId'].value_counts()
-    
-    # Adjust minimum interactions based on data size
-    min_interactions = 2 if len(df_aggregated) >= 10 else 1
-    valid_users = user_counts[user_counts >= min_interactions].index
-    df_filtered = df_aggregated[df_aggregated['userId'].isin(valid_users)]
+    # Stream all events into compact columns
+    source = INTERACTIONS_COLLECTION if from_interactions else 'snapshots' if from_snapshots else 'events'
+    try:
+        load_started = time.perf_counter()
+        # Number of events decoded from the cursor at a time
+        batch_size = int(os.getenv('TRAIN_EVENT_BATCH_SIZE', '50000'))
+        since = None
+        if window_days:
+            since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=window_days)
+        if from_interactions:
+            events = load_interactions(db[INTERACTIONS_COLLECTION], batch_size=batch_size)
+        elif from_snapshots:
+            from snapshots import SNAPSHOT_DIR, load_snapshot_events
+            events = load_snapshot_events(snapshot_dir or SNAPSHOT_DIR, since=since)
+        else:
+            events = load_events(db.events, {'createdAt': {'$gte': since}} if since else None, batch_size=batch_size)
+        load_seconds = time.perf_counter() - load_started
+    except Exception as e:
+        raise RuntimeError(f"Failed to fetch events from {source}: {e}")
 
-    # If still no valid data, use all available data
-    if len(df_filtered) == 0:
-        df_filtered = df_aggregated
+    load_stats = {
+        'source': source,
+        'window_days': window_days,
+        'events': len(events),
+        'documents': len(events.user_codes),
+        'seconds': round(load_seconds, 3),
+        'peak_rss_mb': peak_rss_mb()
+    }
+    print(f"Loaded {load_stats['events']} events ({load_stats['documents']} documents) from {source} "
+          f"in {load_stats['seconds']}s "
+          f"(peak RSS {load_stats['peak_rss_mb']} MB)")
 
-    # Final check - need at least 2 interactions for Surprise
-    if len(df_filtered) < 2:
-        create_cold_start_model(db)
+    # Handle empty database case
+    if len(events) == 0:
+        create_cold_start_model(db, output_dir)
         return
 
-    # Prepare data for Surprise
-    reader = Reader(rating_scale=(1, 5))
-    data = Dataset.load_from_df(df_filtered[['userId', 'productId', 'rating']], reader)
-    trainset = data.build_full_trainset()
+    ratings = prepare_ratings(events)
+    if ratings is None:
+        create_cold_start_model(db, output_dir)
+        return
 
     # Adjust hyperparameters based on data size
-    n_users = len(df_filtered['userId'].unique())
-    n_items = len(df_filtered['productId'].unique())
-    data_size = len(df_filtered)
+    n_users = len(ratings.user_ids)
+    n_items = len(ratings.item_ids)
+    data_size = len(ratings)
 
     # Use smaller factors for small datasets
     n_factors = min(50, max(10, min(n_users, n_items) // 2))
+    params = dict(make_trainer(engine_name).params, n_factors=n_factors)
+    workers = int(os.getenv('TRAIN_WORKERS', str(os.cpu_count() or 1)))
 
-    algo = SVD(
-        n_factors=n_factors,
-        n_epochs=20,
-        lr_all=0.005,
-        reg_all=0.02
-    )
-
-    # Cross-validate only if we have enough data
     rmse, mae = 0.0, 0.0
-    if data_size >= 6:  # Need at least 6 samples for 3-fold CV
+    tuning = None
+    if tune is not None and data_size >= 6:
+        # Search the space with every fold of every candidate on a worker process
+        folds = tune.get('folds', 3)
+        candidates = sample_candidates(
+            tune.get('space') or default_space(n_factors, engine_name), tune.get('samples', 20),
+            seed=tune.get('seed', 0)
+        )
+        best, results, tuning = tune_parameters(
+            ratings.user_codes, ratings.item_codes, ratings.values, candidates,
+            folds=min(folds, data_size // 2),
+            workers=tune.get('workers', workers),
+            budget_seconds=tune.get('budget_seconds'),
+            seed=tune.get('seed', 0),
+            engine=engine_name
+        )
+        tuning.update({'best': best, 'results': results})
+        print(f"Evaluated {tuning['evaluated']}/{tuning['candidates']} configurations in {tuning['seconds']}s "
+              f"({tuning['workers']} workers)")
+        if best is not None:
+            params.update(best)
+            rmse, mae = results[0]['rmse'], results[0]['mae']
+            print(f"Best: {best} (RMSE {rmse})")
+
+    evaluation = None
+    if evaluate and from_interactions:
+        # Each pair sums events from both sides of any cutoff
+        print("Skipped the holdout evaluation: the pre-aggregated interactions cannot be split by time")
+    elif evaluate and events_watermark(events) is not None:
+        from evaluation import default_cutoff, evaluate_holdout, summary
         try:
-            cv_folds = min(3, data_size // 2)
-            cv_results = cross_validate(algo, data, measures=['RMSE', 'MAE'], cv=cv_folds, verbose=False)
-            rmse = cv_results['test_rmse'].mean()
-            mae = cv_results['test_mae'].mean()
-        except Exception:
-            pass  # Skip CV if it fails
+            evaluation = evaluate_holdout(
+                events, default_cutoff(events), engine_name, params,
+                catalog_ids=[str(p['_id']) for p in db.products.find({}, {'_id': 1})],
+                popularity_half_life_days=float(os.getenv('POPULARITY_HALF_LIFE_DAYS', '7'))
+            )
+            rmse, mae = evaluation['model']['rmse'] or 0.0, evaluation['model']['mae'] or 0.0
+            headline = summary(evaluation)
+            print(f"Holdout evaluation: {headline} ({evaluation['seconds']['total']}s)")
+        except ValueError as e:
+            print(f"Skipped the holdout evaluation: {e}")
 
-    # Train on full dataset
-    algo.fit(trainset)
+    # Cross-validate only if we have enough data (tuning and evaluation already did)
+    if (tuning is None or tuning['best'] is None) and evaluation is None:
+        if data_size >= 6:  # Need at least 6 samples for 3-fold CV
+            try:
+                rmse, mae = cross_validate(ratings, params, folds=min(3, data_size // 2), engine=engine_name)
+            except Exception:
+                pass  # Skip CV if it fails
 
-    # Save the model
-    joblib.dump(algo, 'recommendation_model.joblib')
+    # Train on full dataset
+    trainer = make_trainer(engine_name, **params)
+    fit_started = time.perf_counter()
+    engine = trainer.fit(ratings)
+    fit_seconds = time.perf_counter() - fit_started
+    print(f"Trained {engine_name} on {data_size} ratings in {fit_seconds:.3f}s")
 
-    # Save metadata for the API
-    all_product_ids = df_filtered['productId'].unique().tolist()
-    all_user_ids = df_filtered['userId'].unique().tolist()
+    # Save the model as memory-mappable factor arrays, and pickled if the
+    # engine has a Surprise model
+    if trainer.model is not None:
+        joblib.dump(trainer.model, os.path.join(output_dir, MODEL_FILE))
+    elif os.path.exists(os.path.join(output_dir, MODEL_FILE)):
+        os.remove(os.path.join(output_dir, MODEL_FILE))
+    save_flat_model(engine, os.path.join(output_dir, FLAT_MODEL_DIR))
 
+    # Ids live in the flat artifact's id registry, so they are not repeated here
     metadata = {
-        'product_ids': all_product_ids,
-        'user_ids': all_user_ids,
-        'total_events': len(df),
-        'unique_pairs': len(df_filtered),
-        'trained_at': datetime.now().isoformat(),
-        'model_params': {
-            'n_factors': n_factors,
-            'n_epochs': 20,
-            'rmse': float(rmse),
-            'mae': float(mae)
-        },
-        'cold_start': False
+        'n_products': len(ratings.item_ids),
+        'n_users': len(ratings.user_ids),
+        'total_events': len(events),
+        'unique_pairs': data_size,
+        'trained_at': datetime.now(timezone.utc).isoformat(),
+        'model_params': dict(params, engine=engine_name, rmse=float(rmse), mae=float(mae),
+                             fit_seconds=round(fit_seconds, 3)),
+        'cold_start': False,
+        'load_stats': load_stats,
+        # Incremental updates pick up events created after this point
+        'events_watermark': events_watermark(events)
     }
+    if tuning is not None:
+        metadata['tuning'] = tuning
+    if evaluation is not None:
+        from evaluation import save_report
+        save_report(evaluation, output_dir)
+        metadata['evaluation'] = summary(evaluation)
+
+    # Item-item co-occurrence of purchases and cart additions, used by the
+    # collaborative fallback instead of aggregating over events per request
+    positive = events.action_mask(POSITIVE_ACTIONS)
+    if positive.any():
+        item_neighbors = ItemNeighborIndex.from_codes(
+            events.user_codes[positive], events.item_codes[positive], events.product_ids,
+            n_users=len(events.user_ids)
+        )
+        item_neighbors.save(os.path.join(output_dir, ITEM_NEIGHBORS_FILE))
+        metadata['item_neighbors'] = {
+            'items': item_neighbors.n_items,
+            'pairs': int(item_neighbors.matrix.nnz)
+        }
+    elif os.path.exists(os.path.join(output_dir, ITEM_NEIGHBORS_FILE)):
+        os.remove(os.path.join(output_dir, ITEM_NEIGHBORS_FILE))
 
-    joblib.dump(metadata, 'model_metadata.joblib')
+    # Optional ANN index over the item factors for approximate top-k retrieval
+    if build_ann:
+        ann_index = IVFIndex.build(engine)
+        ann_index.save(os.path.join(output_dir, ANN_INDEX_FILE))
 
-    # Calculate popular products as fallback
-    product_interaction_counts = df['productId'].value_counts()
-    popular_products = product_interaction_counts.head(20).index.tolist()
-    joblib.dump(popular_products, 'popular_products.joblib')
+        n_probe = int(os.getenv('ANN_NPROBE', '8'))
+        metadata['ann_index'] = {
+            'n_lists': ann_index.n_lists,
+            'n_probe': n_probe,
+            'k': 10,
+            'recall_at_k': recall_at_k(ann_index, engine, k=10, n_probe=n_probe)
+        }
+    elif os.path.exists(os.path.join(output_dir, ANN_INDEX_FILE)):
+        # A stale index would no longer line up with the new item factors
+        os.remove(os.path.join(output_dir, ANN_INDEX_FILE))
+
+    # Precomputed top-K items per trained user, served by direct lookup
+    topk_size = int(os.getenv('TOPK_TABLE_SIZE', '50'))
+    if topk_size > 0:
+        topk_table, topk_stats = build_topk_table(
+            engine,
+            k=topk_size,
+            workers=int(os.getenv('TOPK_WORKERS', str(os.cpu_count() or 1))),
+            flat_model_path=os.path.join(output_dir, FLAT_MODEL_DIR)
+        )
+        topk_table.save(os.path.join(output_dir, TOPK_TABLE_FILE))
+        metadata['topk_table'] = topk_stats
+        print(f"Built top-{topk_stats['k']} table for {topk_stats['users']} users in {topk_stats['seconds']}s "
+              f"({topk_stats['users_per_second']} users/sec, {topk_stats['workers']} workers)")
+    elif os.path.exists(os.path.join(output_dir, TOPK_TABLE_FILE)):
+        os.remove(os.path.join(output_dir, TOPK_TABLE_FILE))
+
+    # Time-decayed, action-weighted popularity as fallback; the service keeps
+    # it current from new events between retrains
+    popularity = PopularityIndex(half_life_days=float(os.getenv('POPULARITY_HALF_LIFE_DAYS', '7')))
+    popularity.update(events, load_product_categories(db.products, events.product_ids))
+    popularity.save(os.path.join(output_dir, POPULARITY_FILE))
+    metadata['popularity'] = popularity.status()
+
+    joblib.dump(metadata, os.path.join(output_dir, METADATA_FILE))
+
+    # Static list for versions served without the popularity index
+    joblib.dump(popularity.top_k(20), os.path.join(output_dir, POPULAR_PRODUCTS_FILE))
+
+def incremental_update(source_dir='.', output_dir='.'):
+    """Fold events created since the last run into the saved model.
+
+    Only events after the metadata watermark are read, so the cost grows with
+    the number of new events rather than the full history. The popularity
+    index absorbs the same events; the ANN index and co-occurrence
+    neighbours are carried over unchanged until the next full retrain.
+    """
+    load_dotenv()
+    if source_dir is None:
+        raise RuntimeError("No trained model found; run a full training first")
+
+    db = connect_to_database()
+    metadata = joblib.load(os.path.join(source_dir, METADATA_FILE))
+    # Engines without a Surprise model (ALS) only have the flat factors
+    algo = None
+    if os.path.exists(os.path.join(source_dir, MODEL_FILE)):
+        algo = joblib.load(os.path.join(source_dir, MODEL_FILE))
+    watermark = metadata_watermark(metadata)
+
+    started = time.perf_counter()
+    try:
+        events = load_events(db.events, {'createdAt': {'$gt': watermark}})
+    except Exception as e:
+        raise RuntimeError(f"Failed to fetch events from database: {e}")
+
+    if len(events) == 0:
+        print(f"No new events since {watermark.isoformat()}")
+        return False
+
+    if has_flat_model(os.path.join(source_dir, FLAT_MODEL_DIR)):
+        # Saved from the same Surprise model, so rows line up with it
+        engine = load_flat_model(os.path.join(source_dir, FLAT_MODEL_DIR))
+    else:
+        engine = ScoringEngine.from_surprise(algo, metadata['product_ids'], metadata['user_ids'])
+    updated, summary = fold_in(engine, events, **fold_in_options(metadata.get('model_params', {})))
+    if algo is not None:
+        apply_to_surprise(algo, updated)
+        joblib.dump(algo, os.path.join(output_dir, MODEL_FILE))
+    save_flat_model(updated, os.path.join(output_dir, FLAT_MODEL_DIR))
+    popularity = load_popularity(os.path.join(source_dir, POPULARITY_FILE))
+    if popularity is not None:
+        popularity.update(events, load_product_categories(db.products, popularity.uncategorized(events.product_ids)))
+        popularity.save(os.path.join(output_dir, POPULARITY_FILE))
+    if os.path.abspath(source_dir) != os.path.abspath(output_dir):
+        for name in (POPULAR_PRODUCTS_FILE, ANN_INDEX_FILE, ITEM_NEIGHBORS_FILE):
+            if os.path.exists(os.path.join(source_dir, name)):
+                shutil.copy2(os.path.join(source_dir, name), os.path.join(output_dir, name))
+    # The top-K table is not carried over: rows of the updated users are stale
+    if os.path.exists(os.path.join(output_dir, TOPK_TABLE_FILE)):
+        os.remove(os.path.join(output_dir, TOPK_TABLE_FILE))
+
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    summary['updated_at'] = datetime.now(timezone.utc).isoformat()
+    summary['events_watermark'] = summary['events_watermark'] or watermark
+    history = metadata.get('incremental_updates', []) + [summary]
+    metadata.pop('topk_table', None)
+    # Versions from before the id registry listed every id here
+    metadata.pop('product_ids', None)
+    metadata.pop('user_ids', None)
+
+    metadata.update({
+        'n_products': len(updated.item_ids),
+        'n_users': len(updated.user_ids),
+        'total_events': metadata.get('total_events', 0) + len(events),
+        'events_watermark': summary['events_watermark'],
+        'incremental_updates': history[-MAX_INCREMENTAL_HISTORY:]
+    })
+    joblib.dump(metadata, os.path.join(output_dir, METADATA_FILE))
+    print(f"Folded in {summary['events']} events ({summary['new_users']} new users, "
+          f"{summary['new_items']} new products) in {summary['seconds']}s")
+    return True
 
 if __name__ == '__main__':
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Train the recommendation model')
+    parser.add_argument('--ann', action='store_true',
+                        default=os.getenv('BUILD_ANN_INDEX', '').lower() in ('1', 'true'),
+                        help='also build an approximate nearest-neighbour index over the item factors')
+    parser.add_argument('--incremental', action='store_true',
+                        help='fold events since the last run into the saved model instead of retraining')
+    parser.add_argument('--from-interactions', action='store_true',
+                        default=os.getenv('USE_INTERACTIONS_COLLECTION', '').lower() in ('1', 'true'),
+                        help='train from the pre-aggregated user_item_interactions collection instead of raw events')
+    parser.add_argument('--from-snapshots', action='store_true',
+                        default=os.getenv('USE_EVENT_SNAPSHOTS', '').lower() in ('1', 'true'),
+                        help='train from the Parquet event snapshots (snapshots.py export) instead of MongoDB')
+    parser.add_argument('--snapshot-dir', help='snapshot directory (default: EVENT_SNAPSHOT_DIR)')
+    parser.add_argument('--window-days', type=int, default=int(os.getenv('TRAIN_WINDOW_DAYS', '0')) or None,
+                        help='train on the events of the last N days only')
+    parser.add_argument('--engine', choices=sorted(TRAINERS), default=os.getenv('TRAIN_ENGINE', 'svd'),
+                        help='training engine: Surprise SVD (svd) or NumPy/SciPy alternating least squares (als)')
+    parser.add_argument('--tune', action='store_true',
+                        default=os.getenv('TRAIN_TUNE', '').lower() in ('1', 'true'),
+                        help='cross-validate a space of model parameters on a process pool and train the best')
+    parser.add_argument('--tune-space',
+                        help='JSON file or inline JSON mapping parameters to value lists (or low/high ranges)')
+    parser.add_argument('--tune-samples', type=int, default=int(os.getenv('TUNE_SAMPLES', '20')),
+                        help='random configurations to try (0 searches the full grid)')
+    parser.add_argument('--tune-folds', type=int, default=3, help='cross-validation folds per configuration')
+    parser.add_argument('--tune-budget', type=float, default=float(os.getenv('TUNE_BUDGET_SECONDS', '0')),
+                        help='stop starting new evaluations after this many seconds (0 = no limit)')
+    parser.add_argument('--evaluate', action='store_true',
+                        default=os.getenv('TRAIN_EVALUATE', '').lower() in ('1', 'true'),
+                        help='evaluate on a time-based holdout (ranking metrics) instead of cross-validating RMSE')
+    parser.add_argument('--output-dir',
+                        help='write artifacts here instead of a new version under MODEL_DIR '
+                             '(the version is then not activated)')
+    args = parser.parse_args()
+
     try:
-        main()
+        store = ModelStore(os.getenv('MODEL_DIR', 'models'), keep=int(os.getenv('MODEL_VERSIONS_KEPT', '5')))
+        version = None
+        output_dir = args.output_dir
+        if output_dir is None:
+            version = store.create_version()
+            output_dir = store.path(version)
+
+        try:
+            if args.incremental:
+                current = store.current_version()
+                updated = incremental_update(current and store.path(current), output_dir)
+            else:
+                tune = None
+                if args.tune:
+                    tune = {
+                        'space': load_space(args.tune_space) if args.tune_space else None,
+                        'samples': args.tune_samples,
+                        'folds': args.tune_folds,
+                        'budget_seconds': args.tune_budget or None
+                    }
+                main(build_ann=args.ann, output_dir=output_dir, tune=tune, engine_name=args.engine,
+                     from_interactions=args.from_interactions, from_snapshots=args.from_snapshots,
+                     snapshot_dir=args.snapshot_dir, window_days=args.window_days, evaluate=args.evaluate)
+                updated = True
+        except Exception:
+            if version is not None:
+                shutil.rmtree(output_dir, ignore_errors=True)
+            raise
+
+        if version is not None:
+            if updated:
+                store.activate(version)
+                print(f"Activated model version {version}")
+            else:
+                shutil.rmtree(output_dir, ignore_errors=True)
         sys.exit(0)  # Success
     except Exception as e:
         # Write error to stderr for the calling process
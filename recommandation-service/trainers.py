@@ -0,0 +1,202 @@
+import itertools
+import time
+
+import numpy as np
+from scipy import sparse
+from surprise import SVD, Dataset, Reader
+
+from scoring import ScoringEngine
+
+# Upper bound on floats held by one batch of ALS normal equations
+ALS_BLOCK_CELLS = 4_000_000
+
+
+class Ratings:
+    """Integer-coded (user, item, rating) triples plus the raw ids the codes stand for"""
+
+    def __init__(self, user_codes, item_codes, values, user_ids, item_ids, rating_scale=(1, 5)):
+        self.user_codes = np.asarray(user_codes, dtype=np.int64)
+        self.item_codes = np.asarray(item_codes, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.user_ids = list(user_ids)
+        self.item_ids = list(item_ids)
+        self.rating_scale = tuple(rating_scale)
+
+    def __len__(self):
+        return len(self.values)
+
+    def subset(self, mask):
+        """The triples selected by ``mask``, keeping every id (and code) of the full set"""
+        return Ratings(self.user_codes[mask], self.item_codes[mask], self.values[mask],
+                       self.user_ids, self.item_ids, self.rating_scale)
+
+
+class SurpriseSVDTrainer:
+    """Surprise's SVD: per-rating SGD in one process.
+
+    ``model`` keeps the fitted Surprise algorithm so it can still be pickled
+    next to the flat factors.
+    """
+
+    name = 'svd'
+
+    def __init__(self, n_factors=100, n_epochs=20, lr_all=0.005, reg_all=0.02, random_state=None):
+        self.params = {'n_factors': n_factors, 'n_epochs': n_epochs, 'lr_all': lr_all, 'reg_all': reg_all}
+        self.random_state = random_state
+        self.model = None
+
+    def prepare(self, ratings):
+        """Surprise trainset of ``ratings``; reusable across fits with other parameters"""
+        user_ids = np.array(ratings.user_ids, dtype=object)[ratings.user_codes]
+        item_ids = np.array(ratings.item_ids, dtype=object)[ratings.item_codes]
+        rows = list(zip(user_ids.tolist(), item_ids.tolist(), ratings.values.tolist(), itertools.repeat(None)))
+        return Dataset(Reader(rating_scale=ratings.rating_scale)).construct_trainset(rows)
+
+    def fit(self, ratings, prepared=None):
+        """Train and return a ScoringEngine over ``ratings.user_ids`` x ``ratings.item_ids``"""
+        trainset = prepared if prepared is not None else self.prepare(ratings)
+        self.model = SVD(random_state=self.random_state, **self.params)
+        self.model.fit(trainset)
+        return ScoringEngine.from_surprise(self.model, ratings.item_ids, ratings.user_ids)
+
+
+class ALSTrainer:
+    """Biased matrix factorisation fitted by alternating least squares.
+
+    Trains straight on the integer-coded arrays held as SciPy sparse
+    matrices. Each half-step solves the ridge normal equations of every
+    user (then every item) against the fixed other side, in padded batches
+    of rows with similar counts, so the work is batched matmuls and LAPACK
+    solves that use the multithreaded BLAS. ``reg_all`` is the ridge
+    penalty of each row's solve, not a per-rating weight as in SVD, so it
+    takes larger values; it shrinks rarely rated items hardest. The output
+    has the same pu/qi/bu/bi form as SVD, so serving and incremental
+    fold-ins work unchanged.
+    """
+
+    name = 'als'
+
+    def __init__(self, n_factors=50, n_epochs=10, reg_all=10.0, random_state=None, block_cells=ALS_BLOCK_CELLS):
+        self.params = {'n_factors': n_factors, 'n_epochs': n_epochs, 'reg_all': reg_all}
+        self.random_state = random_state
+        self.block_cells = block_cells
+        self.model = None
+
+    def prepare(self, ratings):
+        """(user x item, item x user) CSR matrices of ``ratings``"""
+        by_user = sparse.csr_matrix(
+            (ratings.values, (ratings.user_codes, ratings.item_codes)),
+            shape=(len(ratings.user_ids), len(ratings.item_ids))
+        )
+        by_user.sort_indices()
+        return by_user, by_user.T.tocsr()
+
+    def fit(self, ratings, prepared=None):
+        by_user, by_item = prepared if prepared is not None else self.prepare(ratings)
+        n_factors, reg = self.params['n_factors'], self.params['reg_all']
+        rng = np.random.default_rng(self.random_state)
+
+        global_mean = float(ratings.values.mean()) if len(ratings) else 0.0
+        qi = rng.normal(0, 0.1, size=(by_item.shape[0], n_factors))
+        bi = np.zeros(by_item.shape[0])
+        pu = np.zeros((by_user.shape[0], n_factors))
+        bu = np.zeros(by_user.shape[0])
+        for _ in range(self.params['n_epochs']):
+            pu, bu = _solve_side(by_user, qi, bi, global_mean, reg, self.block_cells)
+            qi, bi = _solve_side(by_item, pu, bu, global_mean, reg, self.block_cells)
+
+        return ScoringEngine(pu, qi, bu, bi, global_mean, ratings.user_ids, ratings.item_ids,
+                             rating_scale=ratings.rating_scale)
+
+
+TRAINERS = {trainer.name: trainer for trainer in (SurpriseSVDTrainer, ALSTrainer)}
+
+
+def make_trainer(engine, **params):
+    if engine not in TRAINERS:
+        raise ValueError(f"Unknown training engine {engine!r} (choose from {', '.join(TRAINERS)})")
+    return TRAINERS[engine](**params)
+
+
+def evaluate(engine, train, test, k=10, relevant=4.0):
+    """RMSE and MAE on ``test``, plus recall@k of its items rated >= ``relevant``.
+
+    Recall ranks every item the user did not rate in ``train``; both sets
+    must use the codes of ``engine``'s users and items.
+    """
+    predictions = engine.predict_pairs(test.user_codes, test.item_codes)
+    errors = predictions - test.values
+
+    hits, total = 0, 0
+    liked = test.values >= relevant
+    train_items = sparse.csr_matrix(
+        (np.ones(len(train)), (train.user_codes, train.item_codes)), shape=(len(engine.user_ids), engine.n_items)
+    )
+    users = np.unique(test.user_codes[liked])
+    for start in range(0, len(users), 256):
+        block = users[start:start + 256]
+        scores = engine.score_users(block)
+        seen = train_items[block]
+        scores[seen.nonzero()] = -np.inf
+        top = np.argpartition(-scores, min(k, engine.n_items) - 1, axis=1)[:, :k]
+        for row, user in enumerate(block):
+            relevant_items = test.item_codes[liked & (test.user_codes == user)]
+            hits += int(np.isin(relevant_items, top[row]).sum())
+            total += len(relevant_items)
+
+    return {
+        'rmse': round(float(np.sqrt(np.mean(errors ** 2))), 6) if len(test) else None,
+        'mae': round(float(np.mean(np.abs(errors))), 6) if len(test) else None,
+        f'recall_at_{k}': round(hits / total, 6) if total else None
+    }
+
+
+def compare_trainers(ratings, engines=('svd', 'als'), test_fraction=0.2, k=10, seed=0, params=None):
+    """Train each engine on the same split and report wall time and accuracy"""
+    test = np.random.default_rng(seed).random(len(ratings)) < test_fraction
+    train, holdout = ratings.subset(~test), ratings.subset(test)
+
+    results = {}
+    for name in engines:
+        trainer = make_trainer(name, random_state=seed, **(params or {}).get(name, {}))
+        started = time.perf_counter()
+        engine = trainer.fit(train)
+        seconds = time.perf_counter() - started
+        results[name] = dict(trainer.params, seconds=round(seconds, 3), **evaluate(engine, train, holdout, k=k))
+    return results
+
+
+def _solve_side(matrix, fixed, fixed_bias, global_mean, reg, block_cells):
+    """Ridge-fit [factors, bias] of every row of ``matrix`` against the fixed side"""
+    n_rows, k = matrix.shape[0], fixed.shape[1] + 1
+    augmented = np.hstack([fixed, np.ones((len(fixed), 1))])
+    counts = np.diff(matrix.indptr)
+    order = np.argsort(counts, kind='stable')
+    order = order[counts[order] > 0]
+    sorted_counts = counts[order]
+    solution = np.zeros((n_rows, k))
+    eye = np.eye(k)
+
+    start = 0
+    while start < len(order):
+        # Rows with up to twice the shortest row's count share one padded
+        # batch, bounded so neither the padded rows nor the grams overflow
+        shortest = sorted_counts[start]
+        end = np.searchsorted(sorted_counts, 2 * shortest, side='right')
+        end = min(end, start + max(1, block_cells // (k * max(k, 2 * shortest))))
+        rows = order[start:end]
+        row_counts = counts[rows]
+        width = row_counts.max()
+
+        offsets = np.arange(width)
+        valid = offsets[None, :] < row_counts[:, None]
+        positions = np.where(valid, matrix.indptr[rows][:, None] + offsets[None, :], matrix.indptr[rows][:, None])
+        columns = matrix.indices[positions]
+        features = augmented[columns] * valid[..., None]
+        targets = (matrix.data[positions] - global_mean - fixed_bias[columns]) * valid
+
+        transposed = features.transpose(0, 2, 1)
+        gram = transposed @ features + reg * eye
+        solution[rows] = np.linalg.solve(gram, (transposed @ targets[..., None]))[..., 0]
+        start = end
+    return solution[:, :-1], solution[:, -1]
@@ -0,0 +1,217 @@
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from trainers import Ratings, make_trainer
+
+# Arrays shared with the worker processes through memory-mapped .npy files
+SHARED_ARRAYS = ('user_codes', 'item_codes', 'ratings', 'fold_ids')
+# Searched per engine when no --tune-space is given; n_factors is centred on the heuristic
+DEFAULT_SPACES = {
+    'svd': {
+        'n_epochs': [10, 20, 40],
+        'lr_all': [0.002, 0.005, 0.01],
+        'reg_all': [0.02, 0.05, 0.1]
+    },
+    'als': {
+        'n_epochs': [5, 10, 20],
+        'reg_all': [2.0, 10.0, 30.0]
+    }
+}
+
+
+def default_space(n_factors, engine='svd'):
+    space = {'n_factors': sorted({max(2, n_factors // 2), n_factors, n_factors * 2})}
+    space.update(DEFAULT_SPACES[engine])
+    return space
+
+
+def load_space(value):
+    """Search space from a JSON file path or an inline JSON object.
+
+    Each parameter maps to a list of values, or (random search only) to
+    ``{"low": .., "high": .., "log": true}`` for a continuous range.
+    """
+    if os.path.exists(value):
+        with open(value) as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+def sample_candidates(space, n_samples=0, seed=0):
+    """Parameter dicts to evaluate: the full grid, or ``n_samples`` random draws"""
+    names = sorted(space)
+    if n_samples <= 0:
+        ranges = [name for name in names if isinstance(space[name], dict)]
+        if ranges:
+            raise ValueError(f"Grid search needs lists of values, got ranges for {', '.join(ranges)}")
+        return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+    rng = np.random.default_rng(seed)
+    candidates = []
+    seen = set()
+    for _ in range(n_samples * 10):
+        candidate = {name: _draw(space[name], rng) for name in names}
+        key = tuple(candidate[name] for name in names)
+        if key not in seen:
+            seen.add(key)
+            candidates.append(candidate)
+            if len(candidates) == n_samples:
+                break
+    return candidates
+
+
+def tune(user_codes, item_codes, ratings, candidates, folds=3, workers=1, budget_seconds=None,
+         rating_scale=(1, 5), seed=0, engine='svd'):
+    """Cross-validate every candidate of ``engine`` and return (best_params, results, stats).
+
+    Each (candidate, fold) pair is one task. With ``workers > 1`` tasks run
+    on a process pool whose workers memory-map the ratings once, so no task
+    pickles the dataset. After ``budget_seconds`` no new task is started;
+    candidates missing a fold are left out of the ranking.
+    """
+    started = time.perf_counter()
+    fold_ids = np.random.default_rng(seed).permutation(len(ratings)) % folds
+    directory = tempfile.mkdtemp(prefix=f'{engine}-tune-')
+    try:
+        for name, values in zip(SHARED_ARRAYS, (user_codes, item_codes, ratings, fold_ids)):
+            np.save(os.path.join(directory, f'{name}.npy'), np.asarray(values))
+
+        tasks = [(index, params, fold) for index, params in enumerate(candidates) for fold in range(folds)]
+        scores = {}
+        if workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(directory, rating_scale, engine)) as pool:
+                _run_pool(pool, tasks, scores, workers, started, budget_seconds, seed)
+        else:
+            workers = 1
+            _init_worker(directory, rating_scale, engine)
+            for index, params, fold in tasks:
+                if _over_budget(started, budget_seconds):
+                    break
+                scores[(index, fold)] = _evaluate(params, fold, seed)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    results = []
+    for index, params in enumerate(candidates):
+        fold_scores = [scores[(index, fold)] for fold in range(folds) if (index, fold) in scores]
+        if len(fold_scores) < folds:
+            continue
+        rmse = np.array([s['rmse'] for s in fold_scores])
+        results.append(dict(
+            params,
+            rmse=round(float(rmse.mean()), 6),
+            rmse_std=round(float(rmse.std()), 6),
+            mae=round(float(np.mean([s['mae'] for s in fold_scores])), 6),
+            fit_seconds=round(float(np.mean([s['seconds'] for s in fold_scores])), 3)
+        ))
+    results.sort(key=lambda row: row['rmse'])
+
+    stats = {
+        'engine': engine,
+        'candidates': len(candidates),
+        'evaluated': len(results),
+        'folds': folds,
+        'workers': workers,
+        'budget_seconds': budget_seconds,
+        'budget_exhausted': len(results) < len(candidates),
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+    best = {name: results[0][name] for name in candidates[0]} if results else None
+    return best, results, stats
+
+
+def cross_validate(ratings, params, folds=3, seed=0, engine='svd'):
+    """Mean RMSE and MAE of one configuration of ``engine`` over ``folds`` folds.
+
+    Runs in this process on the in-memory Ratings, with the same folds as
+    ``tune``: a single configuration gains nothing from the process pool and
+    the memory-mapped copies of the ratings.
+    """
+    fold_ids = np.random.default_rng(seed).permutation(len(ratings)) % folds
+    scores = []
+    for fold in range(folds):
+        test = fold_ids == fold
+        scores.append(_score(make_trainer(engine, random_state=seed, **params).fit(ratings.subset(~test)),
+                             ratings.subset(test)))
+    return float(np.mean([s['rmse'] for s in scores])), float(np.mean([s['mae'] for s in scores]))
+
+
+def _run_pool(pool, tasks, scores, workers, started, budget_seconds, seed):
+    # Keep only a couple of tasks per worker queued, so the budget can stop
+    # the search without a long backlog of already-submitted work
+    pending = {}
+    queue = iter(tasks)
+    while True:
+        while len(pending) < workers * 2 and not _over_budget(started, budget_seconds):
+            task = next(queue, None)
+            if task is None:
+                break
+            index, params, fold = task
+            pending[pool.submit(_evaluate, params, fold, seed)] = (index, fold)
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            scores[pending.pop(future)] = future.result()
+
+
+def _over_budget(started, budget_seconds):
+    return bool(budget_seconds) and time.perf_counter() - started >= budget_seconds
+
+
+def _draw(choice, rng):
+    if isinstance(choice, dict):
+        low, high = choice['low'], choice['high']
+        if choice.get('log'):
+            value = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        else:
+            value = float(rng.uniform(low, high))
+        return int(round(value)) if isinstance(low, int) and isinstance(high, int) else value
+    value = choice[int(rng.integers(len(choice)))]
+    return value.item() if isinstance(value, np.generic) else value
+
+
+_worker_data = None
+_worker_folds = {}
+
+
+def _init_worker(directory, rating_scale, engine):
+    global _worker_data
+    data = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name in SHARED_ARRAYS}
+    _worker_data = {
+        'ratings': Ratings(data['user_codes'], data['item_codes'], data['ratings'],
+                           range(int(np.max(data['user_codes'], initial=-1)) + 1),
+                           range(int(np.max(data['item_codes'], initial=-1)) + 1), rating_scale),
+        'fold_ids': data['fold_ids'],
+        'engine': engine
+    }
+    _worker_folds.clear()
+
+
+def _fold(fold):
+    """(train, test, prepared train data) of one fold, built once per worker"""
+    if fold not in _worker_folds:
+        ratings = _worker_data['ratings']
+        test = np.asarray(_worker_data['fold_ids']) == fold
+        train = ratings.subset(~test)
+        _worker_folds[fold] = (train, ratings.subset(test), make_trainer(_worker_data['engine']).prepare(train))
+    return _worker_folds[fold]
+
+
+def _evaluate(params, fold, seed):
+    train, test, prepared = _fold(fold)
+    started = time.perf_counter()
+    engine = make_trainer(_worker_data['engine'], random_state=seed, **params).fit(train, prepared)
+    return dict(_score(engine, test), seconds=time.perf_counter() - started)
+
+
+def _score(engine, test):
+    errors = engine.predict_pairs(test.user_codes, test.item_codes) - test.values
+    return {'rmse': float(np.sqrt(np.mean(errors ** 2))), 'mae': float(np.mean(np.abs(errors)))}